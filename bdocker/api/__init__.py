@@ -14,11 +14,135 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
+import os
+import signal
+import threading
+
 import flask
 import webob
 
 from bdocker import exceptions
 
+# Content type of the streaming responses.
+STREAM_MIMETYPE = "application/x-ndjson"
+
+
+class ServerControllerHolder(object):
+    """Process-wide holder of the server controller.
+
+    The configuration and the controller are built the first
+    time they are used in a process, so every gunicorn worker
+    builds its own ones after the fork and shares them between
+    its threads. They are built again by reload, or when the
+    holder is used in a forked process.
+
+    Its post_fork, post_worker_init and on_reload methods are the
+    gunicorn hooks of the servers.
+    """
+
+    def __init__(self, load_configuration, controller_class,
+                 init_worker=None):
+        self._load_configuration = load_configuration
+        self._controller_class = controller_class
+        self._init_worker = init_worker
+        self._lock = threading.Lock()
+        # (pid, configuration, controller), replaced at once
+        self._state = None
+
+    def _get_state(self):
+        state = self._state
+        if state is None or state[0] != os.getpid():
+            with self._lock:
+                state = self._state
+                if state is None or state[0] != os.getpid():
+                    state = self._build()
+        return state
+
+    def _build(self):
+        conf = self._load_configuration()
+        state = (os.getpid(), conf, self._controller_class(conf))
+        self._state = state
+        return state
+
+    def get_conf(self):
+        """Return the configuration of the process."""
+        return self._get_state()[1]
+
+    def get_controller(self):
+        """Return the server controller of the process."""
+        return self._get_state()[2]
+
+    def reset(self):
+        """Drop the controller, it is built again when used."""
+        with self._lock:
+            self._state = None
+
+    def reload(self):
+        """Load the configuration and build the controller again.
+
+        Requests being served keep the previous controller until
+        they finish.
+        """
+        with self._lock:
+            return self._build()[2]
+
+    def handle_hup(self, signum=None, frame=None):
+        """Reload the controller in the background.
+
+        It is the SIGHUP handler of the workers. The reload runs
+        in its own thread, so the handler does not wait for the
+        lock held by the code it interrupts.
+        """
+        thread = threading.Thread(target=self._safe_reload)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def post_fork(self, server, worker):
+        """Build the server controller of a gunicorn worker.
+
+        It is the gunicorn post_fork hook, so the first request
+        of the worker does not pay for it. The init_worker function
+        of the holder runs afterwards.
+
+        :param server: gunicorn arbiter, unused
+        :param worker: gunicorn worker, unused
+        """
+        self.get_controller()
+        if self._init_worker:
+            self._init_worker()
+
+    def post_worker_init(self, worker):
+        """Reload the server controller on SIGHUP.
+
+        It is the gunicorn post_worker_init hook, which runs
+        after the worker sets its own signal handlers.
+
+        :param worker: gunicorn worker, unused
+        """
+        signal.signal(signal.SIGHUP, self.handle_hup)
+
+    def on_reload(self, server):
+        """Forget the state of the master process.
+
+        It is the gunicorn on_reload hook. The master does not
+        serve requests, so its state is only dropped, and built
+        again with the new configuration if it is used.
+
+        :param server: gunicorn arbiter, unused
+        """
+        self.reset()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+            exceptions.make_log("info", "Configuration reloaded")
+        except BaseException as e:
+            exceptions.make_log("warning",
+                                "Configuration not reloaded, keeping"
+                                " the current one: %s" % e)
+
 
 def eval_bool(s):
     if s:
@@ -47,6 +171,34 @@ def make_json_response(status_code, description):
     }), status_code
 
 
+def is_stream_request(data):
+    return bool(eval_bool(data.get('stream', False)))
+
+
+def make_stream_response(status_code, chunks):
+    """Stream chunks as newline-delimited JSON.
+
+    Every line is a JSON object with a "log" chunk. An error
+    raised while streaming is sent in the last line, with its
+    "status_code" and "error" message.
+
+    :param status_code: status of the response
+    :param chunks: generator of text chunks
+    """
+    def generate():
+        try:
+            for chunk in chunks:
+                yield json.dumps({"log": chunk}) + "\n"
+        except Exception as e:
+            exceptions.make_log("exception", "Streaming stopped")
+            yield json.dumps({
+                "status_code": getattr(e, "code", None) or 500,
+                "error": getattr(e, "message", None) or str(e)
+            }) + "\n"
+    return flask.Response(generate(), status=status_code,
+                          mimetype=STREAM_MIMETYPE)
+
+
 # def error_json_handler(exception):
 #     ex = exceptions.manage_http_exception(exception)
 #     response = make_json_response(ex.code, ex.message)
@@ -44,21 +44,26 @@ def load_configuration():
     return utils.load_configuration_from_file()
 
 
-def init_server():
-    c = get_conf()
-    return controller.AccountingServerController(c)
+def init_server(conf):
+    return controller.AccountingServerController(conf)
+
+
+server_holder = api.ServerControllerHolder(load_configuration, init_server)
 
 
 def get_conf():
-    if not hasattr(flask.g, 'conf'):
-        flask.g.conf = load_configuration()
-    return flask.g.conf
+    return server_holder.get_conf()
 
 
 def get_server_controller():
-    if not hasattr(flask.g, 'server_controller'):
-        flask.g.server_controller = init_server()
-    return flask.g.server_controller
+    return server_holder.get_controller()
+
+
+def reload_server_controller():
+    """Reload the configuration and the server controller.
+
+    """
+    return server_holder.reload()
 
 if __name__ == '__main__':
     with app.app_context():
@@ -14,9 +14,12 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import time
+
 from bdocker import api
 from bdocker import exceptions
 from bdocker import modules
+from bdocker import utils
 
 
 class AccountingServerController(object):
@@ -60,19 +63,30 @@ class ServerController(object):
         api.validate(data, required)
         admin_token = data['admin_token']
         session_data = data['user_credentials']
-        user_token = self.credentials_module.authenticate(
-            admin_token, session_data
-        )
-        exceptions.make_log("info", "User authentication. Token: %s"
-                            % user_token)
-
+        self.credentials_module.authorize_admin(admin_token)
+        utils.check_user_credentials(session_data)
+        # The batch system is configured out of the transaction, so
+        # the token store is not locked while the cgroups are created
+        # and the job monitor is forked.
         batch_info = self.batch_module.conf_environment(
             session_data, admin_token
         )
-        self.credentials_module.set_token_batch_info(
-            user_token, batch_info
-        )
         exceptions.make_log("info", "Batch system configured")
+        images = session_data.get('job', {}).get('images')
+        with self.credentials_module.transaction():
+            user_token = self.credentials_module.authenticate(
+                admin_token, session_data
+            )
+            self.credentials_module.set_token_batch_info(
+                user_token, batch_info
+            )
+            for image in images or []:
+                self.credentials_module.add_image_name(user_token, image)
+        exceptions.make_log("info", "User authentication. Token: %s"
+                            % user_token)
+        if images:
+            # The images are pulled while the job is starting.
+            self.docker_module.prefetch_images(images)
         return user_token
 
     def clean(self, data):
@@ -96,12 +110,75 @@ class ServerController(object):
             exceptions.make_log("info", "Delete containers")
 
         token_info = self.credentials_module.get_token(token)
+        job_id = (token_info.get("job") or {}).get("job_id")
+        if job_id:
+            self.docker_module.clean_warm_pool(job_id)
+            self.docker_module.forget_copies(job_id)
         self.batch_module.clean_environment(token_info, admin_token)
         exceptions.make_log("info", "Batch system cleaned")
         self.credentials_module.remove_token_from_cache(token)
         exceptions.make_log("info", "Delete token: %s" % token)
         return token
 
+    def sweep_sessions(self, ttl):
+        """Evict the sessions of jobs that are not running.
+
+          Sessions not used during ttl seconds are evicted when
+          the batch system reports that their job is gone, which
+          happens when the epilog of the job did not clean them.
+          Sessions whose job state is unknown are kept.
+          Their containers are deleted and the token store is
+          compacted afterwards, and the expired entries of the
+          pull cache are removed.
+
+        :param ttl: seconds since the last use of the session
+        :return: list of evicted tokens
+        """
+        now = time.time()
+        evicted = []
+        for token, token_info in self.credentials_module.list_sessions():
+            if now - token_info.get("last_seen", 0) < ttl:
+                continue
+            job = token_info.get("job")
+            if job and self.batch_module.is_job_alive(job) is not False:
+                continue
+            containers = token_info.get("containers")
+            if containers:
+                self.docker_module.clean_containers(containers, True)
+            if job and job.get("job_id"):
+                self.docker_module.clean_warm_pool(job["job_id"])
+                self.docker_module.forget_copies(job["job_id"])
+            evicted.append(token)
+        if evicted:
+            self.credentials_module.remove_tokens(evicted)
+            exceptions.make_log("info", "Evicted sessions: %s"
+                                % ", ".join(evicted))
+        self.credentials_module.compact()
+        self.docker_module.prune_pull_cache()
+        return evicted
+
+    def container_died(self, container_id, state):
+        """Take the accounting of the job of a dead container.
+
+          It is called by the docker events listener.
+
+        :param container_id: container id
+        :param state: state of the container, with its exit code
+        :return: accounting snapshot, or None if the container
+                 does not belong to a job
+        """
+        token = self.credentials_module.get_container_token(container_id)
+        if token is None:
+            return None
+        try:
+            token_info = self.credentials_module.get_token(token)
+        except exceptions.UserCredentialsException:
+            # the session was cleaned since the container died
+            return None
+        job = token_info.get("job") or {}
+        return self.batch_module.record_container_accounting(
+            job, container_id, state)
+
     def pull(self, data):
         """Pull image request.
 
@@ -114,11 +191,50 @@ class ServerController(object):
         api.validate(data, required)
         token = data['token']
         repo = data['source']
+        stream = api.is_stream_request(data)
         self.credentials_module.authorize(token)
-        result = self.docker_module.pull_image(repo)
-        # credentials_module.add_image(token, result['image_id'])
+        # The image is referenced by the job from now on, so the
+        # image collector does not remove it while the job runs.
+        self.credentials_module.add_image_name(token, repo)
+        result = self.docker_module.pull_image(repo, stream=stream)
         return result
 
+    def collect_images(self, budget, high_watermark, low_watermark,
+                       policy='lru'):
+        """Evict images when they exceed the disk budget.
+
+          The images pulled by the jobs of the node, and the
+          images of the containers, are not removed.
+
+        :param budget: bytes of disk for the images
+        :param high_watermark: fraction of the budget that starts it
+        :param low_watermark: fraction of the budget that stops it
+        :param policy: lru or largest
+        :return: list of removed image ids
+        """
+        in_use = set()
+        for _token, token_info in self.credentials_module.list_sessions():
+            in_use.update(token_info.get("images") or [])
+            in_use.update(token_info.get("image_names") or [])
+        removed = self.docker_module.collect_images(
+            budget, high_watermark, low_watermark,
+            in_use=in_use, policy=policy)
+        if removed:
+            exceptions.make_log("info", "Removed images: %s"
+                                % ", ".join(removed))
+        return removed
+
+    def list_images(self, data):
+        """List the images present in the node.
+
+        :param data: dict parameter with attributes
+        :return: list of images with id, tags, size and created
+        """
+        required = {'admin_token'}
+        api.validate(data, required)
+        self.credentials_module.authorize_admin(data['admin_token'])
+        return self.docker_module.list_images()
+
     def run(self, data):
         """Execute command in container.
 
@@ -133,6 +249,7 @@ class ServerController(object):
         detach = data.get('detach', False)
         if not detach:
             detach = False
+        stream = bool(api.eval_bool(data.get('stream', False)))
         host_dir = data.get('host_dir', None)
         docker_dir = data.get('docker_dir', None)
         working_dir = data.get('working_dir', None)
@@ -142,9 +259,10 @@ class ServerController(object):
         #     token,
         #     image_id
         # )
-        if host_dir:
-            self.credentials_module.authorize_directory(token, host_dir)
-        job_info = self.credentials_module.get_job_from_token(token)
+        with self.credentials_module.transaction(token, read_only=True):
+            if host_dir:
+                self.credentials_module.authorize_directory(token, host_dir)
+            job_info = self.credentials_module.get_job_from_token(token)
         cgroup_parent = job_info.get('cgroup', None)
         container_id = self.docker_module.run_container(
             image_id,
@@ -153,12 +271,15 @@ class ServerController(object):
             host_dir=host_dir,
             docker_dir=docker_dir,
             working_dir=working_dir,
-            cgroup=cgroup_parent
+            cgroup=cgroup_parent,
+            job_id=job_info.get('job_id')
         )
         self.credentials_module.add_container(token, container_id)
         self.docker_module.start_container(container_id)
         if not detach:
-            results = self.docker_module.logs_container(container_id)
+            results = self.docker_module.logs_container(container_id,
+                                                        stream=stream,
+                                                        follow=stream)
         else:
             results = container_id
         return results
@@ -173,12 +294,17 @@ class ServerController(object):
         api.validate(data, required)
         token = data['token']
         all_list = api.eval_bool(data.get('all', False))
-        containers = self.credentials_module.list_containers(token)
+        with self.credentials_module.transaction(token, read_only=True):
+            containers = self.credentials_module.list_containers(token)
+            token_info = self.credentials_module.get_token(token)
+        # Sessions without a job are listed without the job filter.
+        job_id = (token_info.get('job') or {}).get('job_id')
         results = []
         if containers:
             results = self.docker_module.list_containers(
                 containers,
-                all=all_list)
+                all=all_list,
+                job_id=job_id)
         return results
 
     def show(self, data):
@@ -200,6 +326,9 @@ class ServerController(object):
     def logs(self, data):
         """Log from a contaniner.
 
+        With stream, it returns a generator of the log
+        chunks, which can follow the container until it stops.
+
         :param data: dict parameter with attributes
         :return: log details
         """
@@ -207,11 +336,37 @@ class ServerController(object):
         api.validate(data, required)
         token = data['token']
         container_id = data['container_id']
+        options = self._get_log_options(data)
         self.credentials_module.authorize_container(token,
                                                     container_id)
-        results = self.docker_module.logs_container(container_id)
+        results = self.docker_module.logs_container(container_id,
+                                                    **options)
         return results
 
+    @staticmethod
+    def _get_log_options(data):
+        """Get the log options of a request.
+
+        :param data: dict parameter with attributes
+        :return: dict with stream, tail, since and follow
+        """
+        stream = bool(api.eval_bool(data.get('stream', False)))
+        tail = data.get('tail') or 'all'
+        since = data.get('since') or None
+        try:
+            if tail != 'all':
+                tail = int(tail)
+            if since is not None:
+                since = int(since)
+        except ValueError:
+            raise exceptions.ParseException(
+                "tail and since must be integers")
+        return {"stream": stream,
+                "tail": tail,
+                "since": since,
+                "follow": stream and bool(
+                    api.eval_bool(data.get('follow', False)))}
+
     def delete_container(self, data):
         """Delete a container.
 
@@ -227,19 +382,34 @@ class ServerController(object):
             data.get('force', False)
         )
         docker_out = []
+        authorized = {}
         if not isinstance(container_ids, list):
             container_ids = [container_ids]
-        for c_id in container_ids:
+        for position, c_id in enumerate(container_ids):
             try:
                 full_id = self.credentials_module.authorize_container(
                     token,
                     c_id)
-                self.docker_module.delete_container(full_id, force)
-                self.credentials_module.remove_container(token, full_id)
+                authorized[position] = full_id
                 docker_out.append(full_id)
             except BaseException as e:
                 exceptions.make_log("exception", e.message)
                 docker_out.append(e.message)
+        positions = sorted(authorized)
+        results = self.docker_module.clean_containers(
+            [authorized[position] for position in positions], force)
+        deleted = []
+        for position, out in zip(positions, results):
+            if out == authorized[position]:
+                deleted.append(out)
+            else:
+                exceptions.make_log("exception", out)
+            docker_out[position] = out
+        if deleted:
+            with self.credentials_module.transaction(token):
+                for full_id in deleted:
+                    self.credentials_module.remove_container(token,
+                                                             full_id)
         return docker_out
 
     def notify_accounting(self, data):
@@ -256,10 +426,11 @@ class ServerController(object):
         admin_token = data['admin_token']
         self.credentials_module.authorize_admin(admin_token)
         token = data['token']
-        job = self.credentials_module.get_job_from_token(token)
-        accounting = self.batch_module.get_accounting(job['id'])
-        job.update(accounting)
-        self.credentials_module.update_job(token, job)
+        with self.credentials_module.transaction(token):
+            job = self.credentials_module.get_job_from_token(token)
+            accounting = self.batch_module.get_accounting(job['id'])
+            job.update(accounting)
+            self.credentials_module.update_job(token, job)
         result = self.batch_module.notify_accounting(admin_token, job)
         return result
 
@@ -268,7 +439,10 @@ class ServerController(object):
 
         The attribute host_to_container indicates
         the direction of the copy. It it is True the copy will be
-        from the host to the docker filesystem.
+        from the host to the docker filesystem. The optional
+        attribute delta only transfers the changed files, compression
+        overrides the one of the copies to the containers, and with
+        stream it returns the progress of the copy.
 
         :param data: dict parameter with attributes
         :return: output
@@ -289,19 +463,29 @@ class ServerController(object):
         )
         uid = user_info["uid"]
         gid = user_info["gid"]
+        options = {}
+        if utils.get_boolean(data, "delta", False):
+            options["delta"] = True
+        if api.is_stream_request(data):
+            options["stream"] = True
         if host_to_container:
-            # TODO(jorgesece): compress to tar before send
+            if options.get("delta"):
+                job = self.credentials_module.get_job_from_token(token)
+                options["job_id"] = job.get("job_id")
+            if data.get("compression"):
+                options["compression"] = data["compression"]
             results = self.docker_module.copy_to_container(container_id,
                                                            container_path,
                                                            host_path,
+                                                           **options
                                                            )
         else:
-            # TODO(jorgesece): uncompress
             results = self.docker_module.copy_from_container(container_id,
                                                              container_path,
                                                              host_path,
                                                              uid,
-                                                             gid
+                                                             gid,
+                                                             **options
                                                              )
         return results
 
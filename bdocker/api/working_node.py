@@ -14,12 +14,33 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+
 import flask
 
 from bdocker import api
 from bdocker.api import controller
+from bdocker import exceptions
+from bdocker.modules import docker_helper
+from bdocker.modules import tasks
 from bdocker import utils
 
+# Seconds between sweeps of orphaned sessions.
+DEFAULT_SWEEP_INTERVAL = 600
+# Seconds a session stays in the token store without being used
+# before it can be evicted.
+DEFAULT_TOKEN_TTL = 3600
+# Seconds between runs of the image collector.
+DEFAULT_GC_INTERVAL = 300
+# Fractions of the image budget that start and stop the collector.
+DEFAULT_GC_HIGH_WATERMARK = 0.9
+DEFAULT_GC_LOW_WATERMARK = 0.7
+# Suffix of the lock file, next to the token store, held by the
+# process that leads the node-wide tasks.
+LEADER_SUFFIX = ".leader"
+
+# Leader lock of each process, by pid, None if it is not the leader.
+_leader_locks = {}
 
 app = flask.Flask(__name__)
 
@@ -73,9 +94,25 @@ def pull():
         result = get_server_controller().pull(data)
     except Exception as e:
         return api.manage_exceptions(e)
+    if api.is_stream_request(data):
+        return api.make_stream_response(201, result)
     return api.make_json_response(201, result)
 
 
+@app.route('/images', methods=['GET'])
+def list_images():
+    """List the images present in the node.
+
+    :return: Request 200 with results
+    """
+    data = flask.request.args
+    try:
+        results = get_server_controller().list_images(data)
+    except Exception as e:
+        return api.manage_exceptions(e)
+    return api.make_json_response(200, results)
+
+
 @app.route('/run', methods=['PUT'])
 def run():
     """Execute command in container.
@@ -87,6 +124,8 @@ def run():
         results = get_server_controller().run(data)
     except Exception as e:
         return api.manage_exceptions(e)
+    if api.is_stream_request(data) and not data.get('detach'):
+        return api.make_stream_response(201, results)
     return api.make_json_response(201, results)
 
 
@@ -129,7 +168,8 @@ def logs():
         results = get_server_controller().logs(data)
     except Exception as e:
         return api.manage_exceptions(e)
-
+    if api.is_stream_request(data):
+        return api.make_stream_response(200, results)
     return api.make_json_response(200, results)
 
 
@@ -177,6 +217,8 @@ def copy():
         results = get_server_controller().copy(data)
     except Exception as e:
         return api.manage_exceptions(e)
+    if api.is_stream_request(data):
+        return api.make_stream_response(201, results)
     return api.make_json_response(201, results)
 
 
@@ -239,20 +281,163 @@ def load_configuration():
     return utils.load_configuration_from_file()
 
 
-def init_server():
-    return controller.ServerController(get_conf())
+def init_server(conf):
+    return controller.ServerController(conf)
+
+
+def init_worker():
+    """Start the tasks of a gunicorn worker once it is forked.
+
+    Every worker follows the docker events, and the leader worker
+    also starts the background tasks of the node.
+    """
+    start_event_listener()
+    if is_leader():
+        start_background_tasks()
+
+
+server_holder = api.ServerControllerHolder(load_configuration, init_server,
+                                           init_worker)
 
 
 def get_conf():
-    if not hasattr(flask.g, 'conf'):
-        flask.g.conf = load_configuration()
-    return flask.g.conf
+    return server_holder.get_conf()
 
 
 def get_server_controller():
-    if not hasattr(flask.g, 'server_controller'):
-        flask.g.server_controller = init_server()
-    return flask.g.server_controller
+    return server_holder.get_controller()
+
+
+def reload_server_controller():
+    """Reload the configuration and the server controller.
+
+    """
+    return server_holder.reload()
+
+
+def is_leader():
+    """Check whether the process leads the node-wide tasks.
+
+    The first process that locks the leader file is the leader
+    while it lives. The lock is not inherited by forked processes,
+    so it must not be taken in the gunicorn master, and the worker
+    that replaces a dead leader takes it again.
+
+    :return: True if the process is the leader
+    """
+    pid = os.getpid()
+    if pid not in _leader_locks:
+        path = "%s%s" % (get_conf()['credentials']['token_store'],
+                         LEADER_SUFFIX)
+        _leader_locks[pid] = utils.acquire_process_lock(path)
+    return _leader_locks[pid] is not None
+
+
+def start_event_listener():
+    """Start the docker events listener of the process.
+
+    It keeps the state of the containers, used to list and show
+    them. The listener of the leader also takes the accounting
+    when a container dies, so it is recorded once in the node.
+    It is disabled by [dockerAPI] watch_events = false.
+
+    :return: the listener, or None if it is disabled
+    """
+    if not get_conf()['dockerAPI'].get('watch_events', True):
+        return None
+    on_die = container_died if is_leader() else None
+    return get_server_controller().docker_module.watch_events(
+        on_die=on_die)
+
+
+def container_died(container_id, state):
+    """Take the accounting of a dead container.
+
+    :param container_id: container id
+    :param state: state of the container
+    :return: accounting snapshot
+    """
+    return get_server_controller().container_died(container_id, state)
+
+
+def start_session_sweeper():
+    """Start the background eviction of orphaned sessions.
+
+    :return: the task, or None if it is disabled
+    """
+    interval = get_conf()['server'].get('sweep_interval',
+                                        DEFAULT_SWEEP_INTERVAL)
+    if interval <= 0:
+        return None
+    task = tasks.PeriodicTask(interval, sweep_sessions)
+    task.start()
+    return task
+
+
+def sweep_sessions():
+    """Evict orphaned sessions with the current configuration.
+
+    :return: list of evicted tokens
+    """
+    ttl = get_conf()['credentials'].get('token_ttl', DEFAULT_TOKEN_TTL)
+    return get_server_controller().sweep_sessions(ttl)
+
+
+def start_image_collector():
+    """Start the background eviction of images.
+
+    It is disabled unless [dockerAPI] gc_budget is set.
+
+    :return: the task, or None if it is disabled
+    """
+    docker_conf = get_conf()['dockerAPI']
+    interval = docker_conf.get('gc_interval', DEFAULT_GC_INTERVAL)
+    if not docker_conf.get('gc_budget') or interval <= 0:
+        return None
+    if docker_conf.get('gc_policy', 'lru') not in docker_helper.GC_POLICIES:
+        raise exceptions.ConfigurationException(
+            "gc_policy must be one of %s"
+            % ", ".join(docker_helper.GC_POLICIES))
+    if not (0 < docker_conf.get('gc_low_watermark',
+                                DEFAULT_GC_LOW_WATERMARK) <=
+            docker_conf.get('gc_high_watermark',
+                            DEFAULT_GC_HIGH_WATERMARK)):
+        raise exceptions.ConfigurationException(
+            "gc_low_watermark must be positive and not greater"
+            " than gc_high_watermark")
+    task = tasks.PeriodicTask(interval, collect_images)
+    task.start()
+    return task
+
+
+def collect_images():
+    """Evict images with the current configuration.
+
+    :return: list of removed image ids
+    """
+    docker_conf = get_conf()['dockerAPI']
+    budget = docker_conf.get('gc_budget')
+    if not budget:
+        return []
+    return get_server_controller().collect_images(
+        budget * 1024 * 1024,
+        docker_conf.get('gc_high_watermark', DEFAULT_GC_HIGH_WATERMARK),
+        docker_conf.get('gc_low_watermark', DEFAULT_GC_LOW_WATERMARK),
+        docker_conf.get('gc_policy', 'lru'))
+
+
+def start_background_tasks():
+    """Start the session sweeper and the image collector.
+
+    They run in one process of the node, the leader worker, and
+    not in the gunicorn master, whose threads and locks would be
+    copied in the forked workers.
+
+    :return: list of started tasks
+    """
+    started = [start_session_sweeper(),
+               start_image_collector()]
+    return [task for task in started if task]
 
 if __name__ == '__main__':
     with app.app_context():
@@ -262,6 +447,8 @@ if __name__ == '__main__':
         debug = False
         if logging == 'DEBUG':
             debug = True
+        start_background_tasks()
+        start_event_listener()
         app.run(host=host,
                 port=port,
                 debug=debug)
@@ -14,6 +14,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import sys
+
 import click
 import tabulate
 
@@ -46,6 +48,16 @@ def print_error(message):
     print_message(message)
 
 
+def print_stream(chunks):
+    """Print chunks as they are received.
+
+    :param chunks: generator of text chunks
+    """
+    for chunk in chunks:
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+
+
 def print_table(headers, rows):
     """Print table from list of messages.
 
@@ -148,8 +160,8 @@ def container_pull(ctx, token, source):
     :return:
     """
     try:
-        out = ctx.obj.container_pull(token, source)
-        print_message(out)
+        out = ctx.obj.container_pull(token, source, stream=True)
+        print_stream(out)
     except BaseException as e:
         print_error(e.message)
 
@@ -183,9 +195,13 @@ def container_run(ctx, token, image_id,
         out = ctx.obj.container_run(
             token, image_id, detach, script,
             workdir,
-            volume
+            volume,
+            stream=not detach
         )
-        print_message(out)
+        if detach:
+            print_message(out)
+        else:
+            print_stream(out)
     except BaseException as e:
         print_error(e.message)
 
@@ -215,18 +231,28 @@ def container_list(ctx, token, all):
                               " the time of execution.")
 @decorators.token_option
 @decorators.container_id_argument
+@decorators.follow_option
+@decorators.tail_option
+@decorators.since_option
 @click.pass_context
-def container_logs(ctx, token, container_id):
+def container_logs(ctx, token, container_id, follow, tail, since):
     """Show the log of a container
 
+    The log is printed while it is received.
+
     :param ctx: context
     :param token: token, optional
     :param container_id: container id
+    :param follow: follow the log until the container stops
+    :param tail: number of lines from the end of the log
+    :param since: unix timestamp from which the log is shown
     :return:
     """
     try:
-        out = ctx.obj.container_logs(token, container_id)
-        print_message(out)
+        out = ctx.obj.container_logs(token, container_id, stream=True,
+                                     follow=follow, tail=tail,
+                                     since=since)
+        print_stream(out)
     except BaseException:
         m = ("Error: No container related to %s" %
              container_id)
@@ -286,9 +312,11 @@ def container_delete(ctx, token, container_ids, force):
                       "2) /host/path/target <containerId>:"
                       "/file/path/within/container")
 @decorators.token_option
+@decorators.delta_option
+@decorators.compression_option
 @decorators.path_argument
 @click.pass_context
-def copy(ctx, token, path):
+def copy(ctx, token, delta, compression, path):
     """Copy files/folders
 
     Copy files/folders between a container and
@@ -296,6 +324,8 @@ def copy(ctx, token, path):
 
     :param ctx: context
     :param token: token, optional
+    :param delta: only copy the changed files
+    :param compression: compression of the copy to the container
     :param path: path with the appropiate format
     :return:
     """
@@ -304,12 +334,19 @@ def copy(ctx, token, path):
         container_path = path["container_path"]
         host_path = path["host_path"]
         host_to_container = path["host_to_container"]
+        # The progress is printed for the copies with compression.
+        stream = compression is not None
         out = ctx.obj.copy_to_from_container(token,
                                              container_id,
                                              container_path,
                                              host_path,
-                                             host_to_container)
-        print_message(out)
+                                             host_to_container,
+                                             delta, compression,
+                                             stream=stream)
+        if stream:
+            print_stream(out)
+        else:
+            print_message(out)
     except BaseException as e:
         print_error(e.message)
 
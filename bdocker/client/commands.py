@@ -185,14 +185,29 @@ class CommandController(object):
         os.remove(token_file)
         return token
 
-    def container_pull(self, token, source):
+    def list_node_images(self):
+        """List the images present in the node.
+
+        It validates the admin user. ROOT privileges needed.
+
+        :return: list of images with id, tags, size and created
+        """
+        path = "/images"
+        credential_module = modules.load_credentials_module(self.conf)
+        admin_token = credential_module.get_admin_token()
+        parameters = {"admin_token": admin_token}
+        results = self.control.execute_get(path=path, parameters=parameters)
+        return results
+
+    def container_pull(self, token, source, stream=False):
         """Pull image.
 
         This method get the token from the HOME file and make the pull request.
 
         :param token: token (optional)
         :param source: image repository
-        :return: dictionary with results
+        :param stream: return the progress while the image is pulled
+        :return: dictionary with results, or generator of progress
         """
         path = "/pull"
         job_info = self._get_job_info()
@@ -200,11 +215,16 @@ class CommandController(object):
                                           job_info['job_id'])
         token = token_parse(token, token_file)
         parameters = {"token": token, "source": source}
+        if stream:
+            parameters["stream"] = True
+            return self.control.execute_stream(path=path,
+                                               parameters=parameters,
+                                               method="POST")
         results = self.control.execute_post(path=path, parameters=parameters)
         return results
 
     def container_run(self, token, image_id, detach, script,
-                      working_dir=None, volume=None):
+                      working_dir=None, volume=None, stream=False):
         """Run container.
 
         This method get the token from the HOME file and make the run request.
@@ -215,7 +235,8 @@ class CommandController(object):
         :param script: script to execute
         :param working_dir: working dir
         :param volume: volume to bind
-        :return: dictionary with results
+        :param stream: return the output while the container runs
+        :return: dictionary with results, or generator of output chunks
         """
         path = "/run"
         job_info = self._get_job_info()
@@ -232,6 +253,11 @@ class CommandController(object):
             parameters["docker_dir"] = volume["docker_dir"]
         if working_dir:
             parameters["working_dir"] = working_dir
+        if stream and not detach:
+            parameters["stream"] = True
+            return self.control.execute_stream(path=path,
+                                               parameters=parameters,
+                                               method="PUT")
         results = self.control.execute_put(path=path, parameters=parameters)
         return results
 
@@ -254,7 +280,8 @@ class CommandController(object):
 
         return results
 
-    def container_logs(self, token, container_id):
+    def container_logs(self, token, container_id, stream=False,
+                       follow=False, tail=None, since=None):
         """Show container log
 
         This method get the token from the HOME file and make the
@@ -262,7 +289,11 @@ class CommandController(object):
 
         :param token: token optional
         :param container_id: container id
-        :return:
+        :param stream: return the log while it is received
+        :param follow: keep streaming until the container stops
+        :param tail: number of lines from the end of the log
+        :param since: unix timestamp from which the log is shown
+        :return: log lines, or generator of log chunks
         """
         path = "/logs"
         job_info = self._get_job_info()
@@ -270,6 +301,16 @@ class CommandController(object):
                                           job_info['job_id'])
         token = token_parse(token, token_file)
         parameters = {"token": token, "container_id": container_id}
+        if tail is not None:
+            parameters["tail"] = tail
+        if since is not None:
+            parameters["since"] = since
+        if stream:
+            parameters["stream"] = True
+            if follow:
+                parameters["follow"] = True
+            return self.control.execute_stream(path=path,
+                                               parameters=parameters)
         results = self.control.execute_get(path=path, parameters=parameters)
         return results
 
@@ -359,7 +400,9 @@ class CommandController(object):
     def copy_to_from_container(self, token, container_id,
                                container_path,
                                host_path,
-                               host_to_container):
+                               host_to_container,
+                               delta=False, compression=None,
+                               stream=False):
         """Copy between container and host file system.
 
         This method get the token from the HOME file and make the
@@ -370,7 +413,10 @@ class CommandController(object):
         :param container_path: file path in container
         :param host_path: file path in the host
         :param host_to_container: boolean indicates the sense of copy
-        :return:
+        :param delta: only copy the changed files
+        :param compression: compression of the copy to the container
+        :param stream: return the progress while the data is copied
+        :return: dictionary with results, or generator of progress
         """
         path = "/copy"
         job_info = self._get_job_info()
@@ -382,6 +428,15 @@ class CommandController(object):
                       "container_path": container_path,
                       "host_path": host_path,
                       "host_to_container": host_to_container}
+        if delta:
+            parameters["delta"] = True
+        if compression:
+            parameters["compression"] = compression
+        if stream:
+            parameters["stream"] = True
+            return self.control.execute_stream(path=path,
+                                               parameters=parameters,
+                                               method="PUT")
         results = self.control.execute_put(path=path, parameters=parameters)
         return results
 
@@ -17,6 +17,7 @@
 import click
 
 from bdocker import exceptions
+from bdocker import utils
 
 
 # Callbacks
@@ -198,6 +199,23 @@ def force_option(f):
     )(f)
 
 
+def delta_option(f):
+    return click.option(
+        '--delta', default=False,
+        type=click.BOOL, is_flag=True,
+        help='Only copy the files that changed since the last copy'
+    )(f)
+
+
+def compression_option(f):
+    return click.option(
+        '--compression', default=None,
+        type=click.Choice(utils.TAR_COMPRESSIONS),
+        help='Compression of the copy to the container. pgzip'
+             ' compresses blocks in parallel'
+    )(f)
+
+
 def force_option_clean(f):
     return click.option(
         '--force', '-f', default=True,
@@ -221,6 +239,28 @@ def workdir_option(f):
     )(f)
 
 
+def follow_option(f):
+    return click.option(
+        '--follow', '-f', default=False,
+        type=click.BOOL, is_flag=True,
+        help='Follow log output until the container stops'
+    )(f)
+
+
+def tail_option(f):
+    return click.option(
+        '--tail', default=None, type=click.INT,
+        help='Number of lines to show from the end of the logs'
+    )(f)
+
+
+def since_option(f):
+    return click.option(
+        '--since', default=None, type=click.INT,
+        help='Show logs since a unix timestamp'
+    )(f)
+
+
 def path_argument_source(f):
     return click.argument("path_source",
                           type=click.STRING,
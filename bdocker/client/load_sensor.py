@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 LIP - INDIGO-DataCloud
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sys
+
+import click
+
+from bdocker.client import commands
+from bdocker import exceptions
+
+
+def get_report(controller):
+    """Get the report of the images present in the node.
+
+    The report is empty when the daemon does not answer, so the
+    scheduler does not keep a stale list of images.
+
+    :param controller: command controller
+    :return: list of report lines
+    """
+    try:
+        images = controller.list_node_images()
+    except BaseException as e:
+        exceptions.make_log("warning", "Image report failed: %s" % e)
+        images = []
+    return controller.batch_module.get_load_report(images)
+
+
+@click.command()
+def load_sensor():
+    """Batch load sensor with the images present in the node.
+
+    It answers every line from the scheduler with a report, and
+    it finishes with "quit". ROOT privileges needed.
+    """
+    controller = commands.CommandController()
+    while True:
+        line = sys.stdin.readline()
+        if not line or line.strip() == "quit":
+            break
+        for report_line in get_report(controller):
+            sys.stdout.write("%s\n" % report_line)
+        sys.stdout.flush()
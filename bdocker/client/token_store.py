@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 LIP - INDIGO-DataCloud
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import click
+
+from bdocker.client import cli
+from bdocker.modules import credentials
+from bdocker import utils
+
+
+@click.group()
+def token_store():
+    """Manages the token store of the working node daemon.
+
+    ROOT privileges needed.
+    """
+    pass
+
+
+@token_store.command('migrate',
+                     help="Convert a token store to other format."
+                          " The daemon must be stopped.")
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.argument('destination', type=click.Path(dir_okay=False))
+@click.option('--from', 'source_format', default='yaml',
+              type=click.Choice(utils.DATA_FORMATS),
+              help="Format of the source token store. yaml by default.")
+@click.option('--to', 'destination_format', default='yaml',
+              type=click.Choice(utils.DATA_FORMATS + ('sqlite',)),
+              help="Format of the converted token store. yaml by default.")
+def migrate(source, destination, source_format, destination_format):
+    """Convert a token store to other format.
+
+    :param source: path of the token store
+    :param destination: path of the converted token store
+    :param source_format: format of the token store
+    :param destination_format: format of the converted token store
+    """
+    try:
+        records = credentials.migrate_token_store(source, destination,
+                                                  source_format,
+                                                  destination_format)
+        cli.print_message("%s records written in %s"
+                          % (records, destination))
+    except BaseException as e:
+        cli.print_error(e.message)
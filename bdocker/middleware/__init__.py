@@ -15,8 +15,27 @@
 # under the License.
 
 
+import signal
+import sys
+
 from gunicorn.app import base
-from gunicorn import six
+from gunicorn import arbiter
+import six
+
+
+class ReloadArbiter(arbiter.Arbiter):
+    """Arbiter that reloads the workers in place on SIGHUP.
+
+    The default arbiter replaces every worker. This one runs
+    the on_reload hook in the master and forwards the signal
+    to the workers, which swap their configuration while they
+    keep serving.
+    """
+
+    def handle_hup(self):
+        self.log.info("Hang up: %s", self.master_name)
+        self.cfg.on_reload(self)
+        self.kill_workers(signal.SIGHUP)
 
 
 class StandaloneApplication(base.BaseApplication):
@@ -34,3 +53,11 @@ class StandaloneApplication(base.BaseApplication):
 
     def load(self):
         return self.application
+
+    def run(self):
+        try:
+            ReloadArbiter(self).run()
+        except RuntimeError as e:
+            sys.stderr.write("\nError: %s\n\n" % e)
+            sys.stderr.flush()
+            sys.exit(1)
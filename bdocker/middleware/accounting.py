@@ -26,6 +26,9 @@ if __name__ == '__main__':
     options = {
         'bind': '%s:%s' % (host, port),
         'workers': workers,
-        'timeout': time_out
+        'timeout': time_out,
+        'post_fork': accounting.server_holder.post_fork,
+        'post_worker_init': accounting.server_holder.post_worker_init,
+        'on_reload': accounting.server_holder.on_reload
     }
     middleware.StandaloneApplication(accounting.app, options).run()
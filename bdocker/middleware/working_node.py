@@ -26,6 +26,9 @@ if __name__ == '__main__':
     options = {
         'bind': '%s:%s' % (host, port),
         'workers': workers,
-        'timeout': time_out
+        'timeout': time_out,
+        'post_fork': working_node.server_holder.post_fork,
+        'post_worker_init': working_node.server_holder.post_worker_init,
+        'on_reload': working_node.server_holder.on_reload
     }
     middleware.StandaloneApplication(working_node.app, options).run()
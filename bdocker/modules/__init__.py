@@ -28,7 +28,12 @@ def load_credentials_module(conf):
         credentials_module = conf['credentials']["controller"]
         credentials_class = getattr(credentials, credentials_module)
         path = conf['credentials']["token_store"]
-        credentials_instance = credentials_class(path)
+        store_format = conf['credentials'].get("token_store_format")
+        if store_format:
+            credentials_instance = credentials_class(
+                path, store_format=store_format)
+        else:
+            credentials_instance = credentials_class(path)
         if not isinstance(credentials_instance, credentials.TokenController):
             raise exceptions.ConfigurationException(
                 "%s is not a Credential module" %
@@ -59,6 +64,19 @@ def load_batch_module(conf):
 
 
 def load_docker_module(conf):
+    options = {}
+    for key in ("pull_progress_interval", "pull_cache_dir",
+                "pull_cache_ttl", "image_inventory_ttl", "workers",
+                "warm_pool_size", "copy_compression",
+                "copy_compression_workers", "copy_progress_interval"):
+        if key in conf['dockerAPI']:
+            options[key] = conf['dockerAPI'][key]
+    # The use of the images is only recorded for the image collector.
+    gc_interval = conf['dockerAPI'].get("gc_interval")
+    options["track_image_usage"] = bool(
+        conf['dockerAPI'].get("gc_budget") and
+        (gc_interval is None or gc_interval > 0))
     return docker_helper.DockerController(
-        conf['dockerAPI']["base_url"]
+        conf['dockerAPI']["base_url"],
+        **options
     )
@@ -16,7 +16,9 @@
 
 import abc
 import os
+import re
 import signal
+import socket
 import time
 
 import six
@@ -34,6 +36,11 @@ LOCAL_ACCOUNTING_FILE = ".bdocker_accounting"
 # CGROUP FOR THE JOB PID.
 JOB_PROCESS_CGROUP = 'COMMON'
 
+IMAGES_COMPLEX = 'bdocker_images'
+
+# Job variable with the images to pull before the job starts.
+JOB_IMAGES_VARIABLE = 'BDOCKER_IMAGES'
+
 
 class BatchNotificationController(object):
     """Notification controller for batch systems."""
@@ -214,6 +221,45 @@ class WNController(object):
         raise exceptions.NoImplementedException(
             message="get_job_info is still not supported")
 
+    def is_job_alive(self, job_info):
+        """Check whether the job is still running in the node.
+
+        It is different for each batch scheduler, so, this class
+        does not implement it.
+
+        :param job_info: job information stored in the token
+        :return: True or False, None if it cannot be known
+        """
+        raise exceptions.NoImplementedException(
+            message="is_job_alive is still not supported")
+
+    def get_load_report(self, images, host_name=None):
+        """Get the report of the images present in the node.
+
+        It is different for each batch scheduler, so, this class
+        does not implement it.
+
+        :param images: list of images with their tags
+        :param host_name: name of the node
+        :return: list of report lines
+        """
+        raise exceptions.NoImplementedException(
+            message="get_load_report is still not supported")
+
+    def record_container_accounting(self, job_info, container_id, state):
+        """Record the accounting of the job when a container dies.
+
+        It depends on how the job is tracked, so, this class
+        does not implement it.
+
+        :param job_info: job information stored in the token
+        :param container_id: container id
+        :param state: state of the container, with its exit code
+        :return: accounting snapshot
+        """
+        raise exceptions.NoImplementedException(
+            message="record_container_accounting is still not supported")
+
 
 class CgroupsWNController(WNController):
     """Working node controller based in Cgroups."""
@@ -361,6 +407,38 @@ class CgroupsWNController(WNController):
                 message="Accounting not available without enabling "
                         "cgroups")
 
+    def record_container_accounting(self, job_info, container_id, state):
+        """Record the accounting of the job when a container dies.
+
+        The accounting of the job cgroup at that moment is kept,
+        with the exit code and finished time of the container,
+        under the containers key of the local accounting file.
+        The snapshot is merged into the file while it is locked,
+        since the job monitoring updates it too. Nothing is
+        recorded without cgroups, or for jobs without accounting
+        file.
+
+        :param job_info: job information stored in the token
+        :param container_id: container id
+        :param state: state of the container, with its exit code
+        :return: accounting snapshot, or None if it is not recorded
+        """
+        if not self.enable_cgroups:
+            return None
+        job_id = job_info.get("job_id")
+        acc_path = job_info.get("acc_file")
+        if not job_id or not acc_path:
+            return None
+        track_acc = self.track_accounting(acc_path, job_id)
+        snapshot = {"exit_code": state.get("exit_code"),
+                    "finished_at": state.get("finished_at"),
+                    "cpu_usage": track_acc["cpu_usage"],
+                    "memory_usage": track_acc["memory_usage"]}
+        utils.update_yaml_file(acc_path,
+                               {"containers": {container_id: snapshot}},
+                               merge_keys=("containers",))
+        return snapshot
+
     def launch_job_monitoring(self, job_id, job_info, file_path, job_pid,
                               cpu_max=None,
                               mem_max=None,
@@ -517,6 +595,25 @@ class CgroupsWNController(WNController):
             flag = False
         return flag
 
+    def is_job_alive(self, job_info):
+        """Check whether the cgroup of the job still exists.
+
+        Without cgroups, the state of the job is unknown.
+
+        :param job_info: job information stored in the token
+        :return: True or False, None if it cannot be known
+        """
+        if not self.enable_cgroups:
+            return None
+        cgroup_job = job_info.get("cgroup")
+        if not cgroup_job:
+            return False
+        for controller in ("memory", "cpuacct"):
+            if os.path.isdir("%s/%s%s" % (self.root_cgroup, controller,
+                                          cgroup_job)):
+                return True
+        return False
+
     def create_accounting_register(self, accounting_source):
         """Create a accounting register in bath system format.
 
@@ -613,6 +710,31 @@ class SGEWNController(CgroupsWNController):
             'terminate_method': terminate_method,
         }
 
+    @staticmethod
+    def _get_job_images(spool):
+        """Get the images declared by the job.
+
+        The images are listed, separated by commas, in the
+        BDOCKER_IMAGES variable of the job (qsub -v), which is
+        taken from the environment or from the job spool.
+
+        :param spool: job spool directory
+        :return: list of image names
+        """
+        value = os.environ.get(JOB_IMAGES_VARIABLE)
+        if value is None and spool:
+            try:
+                with open(os.path.join(spool, "environment")) as env_file:
+                    for line in env_file:
+                        name, _sep, env_value = line.partition("=")
+                        if name == JOB_IMAGES_VARIABLE:
+                            value = env_value
+                            break
+            except IOError:
+                pass
+        return [image for image in re.split(r'[,\s]+', value or '')
+                if image]
+
     @staticmethod
     def kill_job(job_pid, term_signal):
         """Kill job
@@ -718,6 +840,23 @@ class SGEWNController(CgroupsWNController):
                            % e.message)
                 raise exceptions.BatchException(message=message)
 
+    def is_job_alive(self, job_info):
+        """Check whether the SGE job is still running in the node.
+
+        The job is alive while its spool directory or its
+        cgroup exist.
+
+        :param job_info: job information stored in the token
+        :return: True or False, None if it cannot be known
+        """
+        spool = job_info.get("spool")
+        if spool and os.path.isdir(spool):
+            return True
+        alive = super(SGEWNController, self).is_job_alive(job_info)
+        if alive is None and spool:
+            return False
+        return alive
+
     def create_accounting_register(self, accounting_source):
         """Create a accounting register in SGE bath system format.
 
@@ -765,6 +904,27 @@ class SGEWNController(CgroupsWNController):
                 "Job accounting file malformed: %s. " % e.message
             )
 
+    def get_load_report(self, images, host_name=None):
+        """Get the load sensor report of the images in the node.
+
+        The tags of the images are published as a string complex,
+        named by the images_complex option, so jobs can request
+        a node with an image, e.g. -l bdocker_images="*ubuntu:16.04*".
+
+        :param images: list of images with their tags
+        :param host_name: name of the node
+        :return: list of report lines
+        """
+        if not host_name:
+            host_name = socket.gethostname()
+        complex_name = self.conf.get('images_complex', IMAGES_COMPLEX)
+        tags = sorted(set(tag for image in images
+                          for tag in image.get('tags', [])))
+        return ["begin",
+                "%s:%s:%s" % (host_name, complex_name,
+                              ",".join(tags) or "none"),
+                "end"]
+
     def get_job_info(self):
         """Get job information.
 
@@ -788,6 +948,9 @@ class SGEWNController(CgroupsWNController):
                         'spool': spool_dir,
                         }
             job_info.update(self._get_job_configuration(spool_dir))
+            images = self._get_job_images(spool_dir)
+            if images:
+                job_info['images'] = images
             return job_info
         except BaseException as e:
             raise exceptions.BatchException("Get job information", e=e)
@@ -14,11 +14,21 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import errno
+import os
+import re
+import threading
+
 from cgroupspy import trees
 
 from bdocker import exceptions
 from bdocker import utils
 
+# Root of the cgroup hierarchies.
+ROOT_CGROUP = "/sys/fs/cgroup"
+# Mount table of the process, with the cgroup hierarchies.
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+
 
 def get_pids_from_cgroup(cgroup):
     """Get PIDs to a cgroup.
@@ -66,25 +76,142 @@ def remove_tasks(cgroup_name, cgroup_parent):
         task_to_cgroup(cgroup_parent, pid)
 
 
-def parse_cgroup_name(name):
-    """Clean especial cgroup extensions.
+class CgroupManager(object):
+    """Cgroup hierarchies mounted under a root.
 
-    It is needed because cgroupspy remove the extension of
-    some of the cgroups.
+    The hierarchies are resolved once, from the cgroup mounts of
+    the mount table, or from the directories of the root when it
+    has none, and the cgroups are created, deleted and given tasks
+    by their path, without walking the hierarchies.
+    """
 
-    :param name: cgroup name
-    :return: name without extension
+    def __init__(self, root_parent=ROOT_CGROUP,
+                 mountinfo=MOUNTINFO_PATH):
+        self.root_parent = os.path.normpath(root_parent)
+        self.mountinfo = mountinfo
+        self._hierarchies = None
+
+    @staticmethod
+    def _unescape(field):
+        return re.sub(r'\\([0-7]{3})',
+                      lambda m: chr(int(m.group(1), 8)), field)
+
+    def _read_mounts(self):
+        mounts = []
+        try:
+            with open(self.mountinfo) as mount_file:
+                for line in mount_file:
+                    fields = line.split()
+                    try:
+                        fs_type = fields[fields.index('-') + 1]
+                    except (ValueError, IndexError):
+                        continue
+                    if fs_type == 'cgroup':
+                        mounts.append(self._unescape(fields[4]))
+        except IOError:
+            pass
+        return mounts
+
+    @property
+    def hierarchies(self):
+        """Mount points of the hierarchies under the root."""
+        if self._hierarchies is None:
+            prefix = os.path.join(self.root_parent, '')
+            hierarchies = [path for path in self._read_mounts()
+                           if path.startswith(prefix)]
+            if not hierarchies:
+                hierarchies = [os.path.join(self.root_parent, name)
+                               for name in os.listdir(self.root_parent)]
+            real_paths = set()
+            self._hierarchies = []
+            for path in sorted(hierarchies):
+                # Links such as cpu -> cpu,cpuacct share a hierarchy.
+                real_path = os.path.realpath(path)
+                if os.path.isdir(path) and real_path not in real_paths:
+                    real_paths.add(real_path)
+                    self._hierarchies.append(path)
+        return self._hierarchies
+
+    def parent_paths(self, parent_group_dir):
+        """Paths of a cgroup in the hierarchies which have it.
+
+        :param parent_group_dir: cgroup path in the hierarchies
+        :return: list of paths
+        """
+        relative = parent_group_dir.strip('/')
+        paths = [os.path.join(path, relative) if relative else path
+                 for path in self.hierarchies]
+        return [path for path in paths if os.path.isdir(path)]
+
+    def create(self, group_name, parent_group_dir, pid=None):
+        """Create a cgroup in every hierarchy of the parent.
+
+        :param group_name: cgroup name
+        :param parent_group_dir: parent cgroup
+        :param pid: pid to move into the cgroup
+        """
+        parent_paths = self.parent_paths(parent_group_dir)
+        if not parent_paths:
+            raise exceptions.BatchException(
+                "Not found cgroup parent: %s,"
+                " in root: %s"
+                % (parent_group_dir, self.root_parent))
+        for parent_path in parent_paths:
+            group_path = os.path.join(parent_path, group_name)
+            try:
+                os.mkdir(group_path)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise e
+                exceptions.make_log("warning", str(e), group_name)
+            if pid:
+                task_to_cgroup(group_path, pid)
+
+    def delete(self, group_name, parent_group_dir):
+        """Delete a cgroup from every hierarchy of the parent.
+
+        Its tasks are moved to the parent first.
+
+        :param group_name: cgroup name
+        :param parent_group_dir: parent cgroup
+        """
+        parent_paths = self.parent_paths(parent_group_dir)
+        if not parent_paths:
+            raise exceptions.BatchException(
+                "Not found cgroup parent: %s,"
+                " in root: %s"
+                % (parent_group_dir, self.root_parent))
+        for parent_path in parent_paths:
+            try:
+                remove_tasks(group_name, parent_path)
+                os.rmdir(os.path.join(parent_path, group_name))
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise e
+                exceptions.make_log("warning", str(e), group_name)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(root_parent=ROOT_CGROUP):
+    """Get the cgroup manager of a root, shared by the process.
+
+    :param root_parent: root cgroup ("sys/fs/cgroup" by default)
+    :return: CgroupManager
     """
-    extensions = ['.slice', '.scope', '.partition']
-    new_name = str(name)
-    for ex in extensions:
-        new_name = new_name.replace(ex, "")
-    return new_name
+    with _managers_lock:
+        manager = _managers.get(root_parent)
+        if manager is None:
+            manager = CgroupManager(root_parent)
+            _managers[root_parent] = manager
+        return manager
 
 
 def create_tree_cgroups(group_name, parent_group_dir,
                         pid=None,
-                        root_parent="/sys/fs/cgroup"):
+                        root_parent=ROOT_CGROUP):
     """Create a full tree group.
 
     Create a cgroup with name "group_name" in every cgroup of the
@@ -97,26 +224,8 @@ def create_tree_cgroups(group_name, parent_group_dir,
     """
 
     try:
-        c_trees = trees.GroupedTree(root_path=root_parent)
-        parent_group = parse_cgroup_name(parent_group_dir)
-        parent_node = c_trees.get_node_by_path(parent_group)
-        if parent_node:
-            for node in parent_node.nodes:
-                try:
-                    new_node = node.create_cgroup(group_name)
-                    if pid:
-                        task_to_cgroup(new_node.full_path, pid)
-                except OSError as e:
-                    if e.errno == 17:
-                        exceptions.make_log("warning", e.message,
-                                            group_name)
-                    else:
-                        raise e
-        else:
-            raise exceptions.BatchException(
-                "Not found cgroup parent: %s,"
-                " in root: %s"
-                % (parent_group_dir, root_parent))
+        get_manager(root_parent).create(group_name, parent_group_dir,
+                                        pid=pid)
     except BaseException as e:
         exc = exceptions.CgroupException(e)
         exceptions.make_log("exception", "CGROUPS creation problem. %s"
@@ -125,7 +234,7 @@ def create_tree_cgroups(group_name, parent_group_dir,
 
 
 def delete_tree_cgroups(group_name, parent_group_dir,
-                        root_parent="/sys/fs/cgroup"):
+                        root_parent=ROOT_CGROUP):
     """Delete the full tree group.
 
     Delete every group with name "group_name" from every cgroup of the
@@ -136,19 +245,7 @@ def delete_tree_cgroups(group_name, parent_group_dir,
     :param root_parent: root cgroup ("sys/fs/cgroup" by default)
     """
     try:
-        c_trees = trees.GroupedTree(root_path=root_parent)
-        parent_group = parse_cgroup_name(parent_group_dir)
-        parent_node = c_trees.get_node_by_path(parent_group)
-        for node in parent_node.nodes:
-            try:
-                remove_tasks(group_name, node.full_path)
-                node.delete_cgroup(group_name)
-            except IOError as e:
-                if e.errno == 2:
-                    exceptions.make_log("warning", e.message,
-                                        group_name)
-                else:
-                    raise e
+        get_manager(root_parent).delete(group_name, parent_group_dir)
     except BaseException as e:
         exc = exceptions.CgroupException(e)
         exceptions.make_log("exception", "CGROUPS delete problem. %s"
@@ -14,6 +14,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import contextlib
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
 import uuid
 
 from bdocker import exceptions
@@ -21,37 +28,302 @@ from bdocker import utils
 
 # sys.tracebacklimit = 0
 
+# Token of the administration record.
+ADMIN_TOKEN = "admin"
+# Suffix of the lock file written next to the token store.
+LOCK_SUFFIX = ".lock"
+# Suffix of the journal file written next to the token store.
+JOURNAL_SUFFIX = ".journal"
+# Minimum number of journal entries before compacting the token store.
+JOURNAL_COMPACT_THRESHOLD = 1000
+# Seconds a SQLite connection waits for a lock held by other process.
+SQLITE_TIMEOUT = 30
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tokens (
+    token TEXT PRIMARY KEY,
+    job_id TEXT,
+    last_seen INTEGER,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tokens_job_id ON tokens (job_id);
+CREATE TABLE IF NOT EXISTS containers (
+    token TEXT NOT NULL,
+    container_id TEXT NOT NULL,
+    PRIMARY KEY (token, container_id)
+);
+CREATE INDEX IF NOT EXISTS containers_id ON containers (container_id);
+CREATE TABLE IF NOT EXISTS images (
+    token TEXT NOT NULL,
+    image_id TEXT NOT NULL,
+    PRIMARY KEY (token, image_id)
+);
+"""
+
 
 class TokenController(object):
 
-    def __init__(self, path):
+    def __init__(self, path, store_format='yaml'):
         # TODO(jorgesece): control refresh token
         self.path = path
+        self.store_format = store_format
+        self.lock_path = "%s%s" % (path, LOCK_SUFFIX)
+        self._container_index = {}
+        self._lock_owner = threading.local()
+        self._transaction_state = threading.local()
+        self._signature = None
         try:
-            self.token_store = utils.read_yaml_file(path)
+            self._load_store()
         except IOError:
             raise exceptions.UserCredentialsException(
                 "Unable to open file %s " % path
             )
 
+    @contextlib.contextmanager
+    def _locked(self, shared=False):
+        """Hold the lock of the token store.
+
+        Writers hold an exclusive lock over their read-modify-write
+        cycle, readers hold a shared one while they reload the file.
+        The lock is reentrant in the thread holding it.
+        """
+        if getattr(self._lock_owner, "depth", 0):
+            self._lock_owner.depth += 1
+            try:
+                yield
+            finally:
+                self._lock_owner.depth -= 1
+            return
+        with utils.file_lock(self.lock_path, shared=shared):
+            self._lock_owner.depth = 1
+            try:
+                yield
+            finally:
+                self._lock_owner.depth = 0
+
+    def _load_store(self):
+        """Load the token store file and remember its signature.
+
+        """
+        signature = utils.get_file_signature(self.path)
+        self.token_store = utils.read_data_file(self.path,
+                                                self.store_format)
+        self._signature = signature
+
+    def _refresh(self):
+        """Reload the token store if the file has changed.
+
+        A stat of the file is enough to know whether the cached
+        copy is still valid, so the file is only parsed after
+        other process changes it.
+        """
+        if utils.get_file_signature(self.path) != self._signature:
+            with self._locked(shared=True):
+                self._load_store()
+
     def save_token_file(self):
         """Save token store in the file
 
         """
-        utils.write_yaml_file(self.path, self.token_store)
+        utils.write_data_file(self.path, self.token_store,
+                              self.store_format)
+        self._signature = utils.get_file_signature(self.path)
+
+    @contextlib.contextmanager
+    def _isolated(self, shared=False):
+        """Hold the lock of the token store over a block.
+
+        The store is revalidated once the lock is held, so the
+        records read in the block are the current ones and no other
+        process writes them until the block ends. Read-only blocks
+        hold a shared lock. In a transaction, the changes are only
+        collected, so nothing is done.
+
+        :param shared: hold a shared lock instead of an exclusive one
+        """
+        if self._pending_changes() is not None:
+            yield
+            return
+        with self._locked(shared=shared):
+            self._refresh()
+            try:
+                yield
+            except BaseException:
+                self._discard_cache()
+                raise
+
+    def _pending_changes(self):
+        """Return the changes of the transaction of the thread.
+
+        :return: dict of token records, or None out of a transaction
+        """
+        return getattr(self._transaction_state, "changes", None)
+
+    def _discard_cache(self):
+        """Forget the cached token store.
+
+        The records of an aborted transaction could have been
+        changed in place, so the store is loaded again in the
+        next read.
+        """
+        self._signature = None
+
+    @contextlib.contextmanager
+    def transaction(self, token=None, read_only=False):
+        """Group several changes of the token store in one write.
+
+        The record of the token is loaded once and shared by the
+        methods called in the block, which do not write the store
+        but collect their changes. The changes, and the yielded
+        record if the block modified it, are stored at once when
+        the block ends. Nothing is stored if the block raises an
+        exception. Nested transactions join the outer one.
+
+        The store is locked during the whole transaction, so the
+        records written at the end are not older than the ones of
+        other processes. Read-only transactions only hold a shared
+        lock, and fail if the block changes any record.
+
+        :param token: token whose record is yielded
+        :param read_only: the block only reads records
+        """
+        with self._isolated(shared=read_only):
+            with self._collect_changes(token, read_only) as record:
+                yield record
+
+    @contextlib.contextmanager
+    def _collect_changes(self, token, read_only=False):
+        """Collect the changes made in a transaction and store them.
+
+        :param token: token whose record is yielded
+        :param read_only: fail instead of storing the changes
+        """
+        state = self._transaction_state
+        outer = self._pending_changes() is None
+        if outer:
+            state.records = {}
+            state.changes = {}
+            state.snapshots = {}
+            state.read_only = read_only
+        changes = None
+        try:
+            record = None
+            if token:
+                record = self._get_token_from_cache(token)
+                if token not in state.snapshots:
+                    state.snapshots[token] = copy.deepcopy(record)
+            yield record
+            if outer:
+                changes = state.changes
+                for key, snapshot in state.snapshots.items():
+                    current = state.records.get(key)
+                    if key not in changes and current != snapshot:
+                        changes[key] = current
+                if changes and state.read_only:
+                    raise exceptions.UserCredentialsException(
+                        "Token store changed in a read-only transaction")
+        except BaseException:
+            if outer:
+                self._discard_cache()
+            raise
+        finally:
+            if outer:
+                state.records = None
+                state.changes = None
+                state.snapshots = None
+        if changes:
+            self._write_records(changes)
+
+    def _write_records(self, changes):
+        """Persist token records in the token store
+
+        It stamps the time of the change in every record
+        before storing them. In a transaction, the records
+        are kept until it finishes.
+
+        :param changes: dict of token records, None deletes the token
+        """
+        pending = self._pending_changes()
+        if pending is not None:
+            pending.update(changes)
+            self._transaction_state.records.update(changes)
+            return
+        now = int(time.time())
+        for token, record in changes.items():
+            if record is not None and token != ADMIN_TOKEN:
+                record["last_seen"] = now
+        self._store_records(changes)
+
+    def _store_records(self, changes):
+        """Store token records in the token store file
+
+        It revalidates the token store file, applies the changes
+        and rewrites the whole file while it holds the lock,
+        so changes of other processes are not lost. The file is
+        not parsed again if the caller already revalidated it
+        holding the lock.
+
+        :param changes: dict of token records, None deletes the token
+        """
+        with self._locked():
+            self._refresh()
+            for token, record in changes.items():
+                if record is None:
+                    self.token_store.pop(token, None)
+                else:
+                    self.token_store[token] = record
+            self.save_token_file()
 
     def _get_token_from_cache(self, token):
         """Get token from token store
 
+        In a transaction, the record is read once and the
+        same record is returned until it finishes.
+
+        :param token: token looked for
+        """
+        records = getattr(self._transaction_state, "records", None)
+        if records is not None and token in records:
+            token_info = records[token]
+            if token_info is None:
+                raise exceptions.UserCredentialsException(
+                    "User token not found")
+            return token_info
+        token_info = self._load_token(token)
+        if records is not None:
+            records[token] = token_info
+        return token_info
+
+    def _load_token(self, token):
+        """Read a token record from the token store
+
         :param token: token looked for
         """
-        # TODO(jorgesece): should we update from file?
-        # self.token_store = utils.read_yaml_file(self.path)
+        self._refresh()
         if token not in self.token_store:
             raise exceptions.UserCredentialsException(
                 "User token not found")
         return self.token_store[token]
 
+    def _get_container_index(self, token, token_info):
+        """Get the prefix index of the containers of a token.
+
+        The index is rebuilt when the container list of the
+        record is replaced, for instance when the store is
+        reloaded.
+
+        :param token: token
+        :param token_info: token record
+        """
+        containers = token_info.get("containers", [])
+        cached = self._container_index.get(token)
+        if (cached and cached[0] is containers and
+                len(cached[1]) == len(containers)):
+            return cached[1]
+        index = utils.PrefixIndex(containers)
+        self._container_index[token] = (containers, index)
+        return index
+
     def _set_token(self, user_info):
         """Storage token and user information in token store
 
@@ -61,19 +333,15 @@ class TokenController(object):
         token_content = {
             'uid': user_info['uid'],
             'gid': user_info['gid'],
-            'home': user_info['home']
+            'home': user_info['home'],
+            'created': int(time.time())
         }
         if 'job' in user_info:
             token_content['job'] = {
                 "job_id": user_info['job']['job_id'],
                 "spool": user_info['job']['spool']
             }
-        new_token = {token: token_content}
-        self.token_store = utils.read_yaml_file(
-            self.path
-        )
-        self.token_store.update(new_token)
-        self.save_token_file()
+        self._write_records({token: token_content})
         return token
 
     def _update_token(self, token, fields):
@@ -85,11 +353,7 @@ class TokenController(object):
         current_token = self._get_token_from_cache(token)
         for key, value in fields.items():
             current_token[key] = value
-        self.token_store = utils.read_yaml_file(
-            self.path
-        )
-        self.token_store.update({token: current_token})
-        self.save_token_file()
+        self._write_records({token: current_token})
 
     def get_token(self, token):
         """Return the token information from a token
@@ -144,14 +408,38 @@ class TokenController(object):
 
         :param token: token looked for
         """
-        if token not in self.token_store:
-            raise exceptions.UserCredentialsException(
-                "Token not found")
-        self.token_store = utils.read_yaml_file(
-            self.path
-        )
-        del self.token_store[token]
-        self.save_token_file()
+        with self._isolated():
+            try:
+                self._get_token_from_cache(token)
+            except exceptions.UserCredentialsException:
+                raise exceptions.UserCredentialsException(
+                    "Token not found")
+            self._write_records({token: None})
+
+    def list_sessions(self):
+        """Return the user sessions of the token store.
+
+        :return: list of (token, token record) tuples
+        """
+        self._refresh()
+        return [(token, token_info)
+                for token, token_info in self.token_store.items()
+                if token != ADMIN_TOKEN]
+
+    def remove_tokens(self, tokens):
+        """Remove several tokens from token store at once.
+
+        :param tokens: list of tokens
+        """
+        self._write_records(dict((token, None) for token in tokens))
+
+    def compact(self):
+        """Compact the token store.
+
+        The token store file is rewritten in every change,
+        so it is always compacted.
+        """
+        pass
 
     def add_image(self, token, image_id):
         """Add image to the token record.
@@ -160,12 +448,30 @@ class TokenController(object):
         :param image_id: image id from dockers
         """
         # todo: test this method
-        current_token = self._get_token_from_cache(token)
-        if "images" not in current_token:
-            current_token["images"] = []
-        if image_id not in current_token["images"]:
-            current_token["images"].append(image_id)
-            self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            if "images" not in current_token:
+                current_token["images"] = []
+            if image_id not in current_token["images"]:
+                current_token["images"].append(image_id)
+                self._update_token(token, current_token)
+
+    def add_image_name(self, token, name):
+        """Add the name of an image used by the job to the token record.
+
+        The names are kept apart from the images, which are ids
+        authorized to the user, and the image collector does not
+        remove them while the job runs.
+
+        :param token: token
+        :param name: image name, with its tag
+        """
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            names = current_token.get("image_names", [])
+            if name not in names:
+                current_token["image_names"] = names + [name]
+                self._update_token(token, current_token)
 
     def remove_image(self, token, image_id):
         """Remove image to the token record.
@@ -173,12 +479,13 @@ class TokenController(object):
         :param token: token
         :param image_id: image id from dockers
         """
-        current_token = self._get_token_from_cache(token)
-        if current_token["images"].__len__() > 1:
-            current_token["images"].remove(image_id)
-        else:
-            del current_token["images"]
-        self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            if current_token["images"].__len__() > 1:
+                current_token["images"].remove(image_id)
+            else:
+                del current_token["images"]
+            self._update_token(token, current_token)
 
     def add_container(self, token, container_id):
         """Add container to the token record.
@@ -186,12 +493,17 @@ class TokenController(object):
         :param token: token
         :param container_id: container id from dockers
         """
-        current_token = self._get_token_from_cache(token)
-        if "containers" in current_token:
-            current_token["containers"].append(container_id)
-        else:
-            current_token["containers"] = [container_id]
-        self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            index = self._get_container_index(token, current_token)
+            if "containers" in current_token:
+                current_token["containers"].append(container_id)
+            else:
+                current_token["containers"] = [container_id]
+                self._container_index[token] = (
+                    current_token["containers"], index)
+            index.add(container_id)
+            self._update_token(token, current_token)
 
     def remove_container(self, token, container_id):
         """Remove container to the token record.
@@ -199,12 +511,16 @@ class TokenController(object):
         :param token: token
         :param container_id: container id from dockers
         """
-        current_token = self._get_token_from_cache(token)
-        if current_token["containers"].__len__() > 1:
-            current_token["containers"].remove(container_id)
-        else:
-            del current_token["containers"]
-        self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            index = self._get_container_index(token, current_token)
+            if current_token["containers"].__len__() > 1:
+                current_token["containers"].remove(container_id)
+                index.remove(container_id)
+            else:
+                del current_token["containers"]
+                self._container_index.pop(token, None)
+            self._update_token(token, current_token)
 
     def list_containers(self, token):
         """Return containers from a token record.
@@ -216,6 +532,18 @@ class TokenController(object):
             return []
         return token_info['containers']
 
+    def get_container_token(self, container_id):
+        """Return the token whose record has a container.
+
+        :param container_id: full container id
+        :return: token, or None if no record has the container
+        """
+        self._refresh()
+        for token, token_info in self.token_store.items():
+            if container_id in (token_info.get("containers") or []):
+                return token
+        return None
+
     def authorize_container(self, token, container_id):
         """Check user authorization to the container.
 
@@ -227,16 +555,28 @@ class TokenController(object):
             raise exceptions.UserCredentialsException(
                 "No container related to %s"
                 % token)
-        if container_id not in token_info['containers']:
-            num_containers = container_id.__len__()
-            for c in token_info['containers']:
-                if container_id == c[:num_containers]:
-                    return c
+        index = self._get_container_index(token, token_info)
+        return self._resolve_container(index.matches(container_id),
+                                       container_id)
+
+    @staticmethod
+    def _resolve_container(matches, container_id):
+        """Return the container matching an id or a short id.
+
+        :param matches: containers starting with the container id
+        :param container_id: container id
+        """
+        if not matches:
             raise exceptions.UserCredentialsException(
                 message="No such container:"
                         " %s " % container_id,
                 code=404)
-        return container_id
+        if len(matches) > 1:
+            raise exceptions.UserCredentialsException(
+                message="Multiple IDs found with provided prefix:"
+                        " %s " % container_id,
+                code=400)
+        return matches[0]
 
     def authorize_image(self, token, image_id):
         """Check user authorization to the container.
@@ -297,12 +637,13 @@ class TokenController(object):
         :param job: job information
         """
 
-        current_token = self._get_token_from_cache(token)
-        if "job" not in current_token:
-            raise exceptions.UserCredentialsException(
-                "Job not found in token %s" % token)
-        current_token["job"] = job
-        self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            if "job" not in current_token:
+                raise exceptions.UserCredentialsException(
+                    "Job not found in token %s" % token)
+            current_token["job"] = job
+            self._update_token(token, current_token)
         return current_token
 
     def set_token_batch_info(self, token, batch_info):
@@ -311,9 +652,10 @@ class TokenController(object):
         :param token: token
         :param batch_info: information from the bath env
         """
-        current_token = self._get_token_from_cache(token)
-        current_token["job"].update(batch_info)
-        self._update_token(token, current_token)
+        with self._isolated():
+            current_token = self._get_token_from_cache(token)
+            current_token["job"].update(batch_info)
+            self._update_token(token, current_token)
 
     def get_admin_token(self):
         """Get admin token from token store
@@ -325,3 +667,515 @@ class TokenController(object):
         except BaseException:
             raise exceptions.UserCredentialsException(
                 "Token not found")
+
+
+class JournalTokenController(TokenController):
+    """Token controller backed by an append-only journal.
+
+    The token store file is the last snapshot of the store. Every
+    mutation appends the new record of the token to the journal
+    file, so it costs one write instead of a full rewrite of the
+    store. The journal is replayed on top of the snapshot when the
+    controller is loaded, and it is compacted into a new snapshot
+    once it grows bigger than the store itself.
+    """
+
+    def __init__(self, path, store_format='yaml',
+                 compact_threshold=JOURNAL_COMPACT_THRESHOLD):
+        self.journal_path = "%s%s" % (path, JOURNAL_SUFFIX)
+        self.compact_threshold = compact_threshold
+        self._journal_offset = 0
+        self._journal_entries = 0
+        super(JournalTokenController, self).__init__(path, store_format)
+        self._replay_journal()
+
+    def _load_store(self):
+        """Load the token store snapshot and reset the journal position.
+
+        """
+        super(JournalTokenController, self)._load_store()
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _refresh(self):
+        """Apply the changes made by other processes.
+
+        A new snapshot means that the journal was compacted, so
+        the snapshot is loaded again. Otherwise, only the new
+        journal entries are read.
+        """
+        if utils.get_file_signature(self.path) != self._signature:
+            with self._locked(shared=True):
+                self._load_store()
+        self._replay_journal()
+
+    def _replay_journal(self):
+        """Apply the journal entries not read yet to the token store.
+
+        Entries are read from the last known offset. An incomplete
+        last line, being written or left by a crash, is skipped.
+        """
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            size = 0
+        if size < self._journal_offset:
+            self._load_store()
+        if size == self._journal_offset:
+            return
+        with open(self.journal_path, 'rb') as journal:
+            journal.seek(self._journal_offset)
+            while True:
+                line = journal.readline()
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # The journal was compacted while it was read.
+                    self._load_store()
+                    return self._replay_journal()
+                if entry["record"] is None:
+                    self.token_store.pop(entry["token"], None)
+                else:
+                    self.token_store[entry["token"]] = entry["record"]
+                self._journal_offset += len(line)
+                self._journal_entries += 1
+
+    def _repair_journal(self):
+        """Discard an incomplete last entry left by a crash.
+
+        It must be called holding the exclusive lock, when no
+        other process is writing in the journal.
+        """
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return
+        if self._journal_offset < size:
+            exceptions.make_log("warning",
+                                "Discarding incomplete entry in %s"
+                                % self.journal_path)
+            with open(self.journal_path, 'ab') as journal:
+                journal.truncate(self._journal_offset)
+
+    def _store_records(self, changes):
+        """Append token records to the journal
+
+        The records are applied to the store by replaying the
+        journal, which also picks up entries appended by other
+        processes.
+
+        :param changes: dict of token records, None deletes the token
+        """
+        with self._locked():
+            self._refresh()
+            self._repair_journal()
+            lines = [json.dumps({"token": token, "record": record})
+                     for token, record in changes.items()]
+            data = ("\n".join(lines) + "\n").encode("utf-8")
+            with open(self.journal_path, 'ab') as journal:
+                journal.write(data)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._replay_journal()
+            if self._journal_entries > max(self.compact_threshold,
+                                           len(self.token_store)):
+                self.compact()
+
+    def save_token_file(self):
+        """Save token store in the file
+
+        """
+        self.compact()
+
+    def compact(self):
+        """Write a new snapshot and truncate the journal.
+
+        The snapshot replaces the token store file atomically
+        before the journal is truncated, so a crash between both
+        steps only replays entries already included in it.
+        """
+        with self._locked():
+            self._refresh()
+            utils.write_data_file_atomic(self.path, self.token_store,
+                                         self.store_format)
+            self._signature = utils.get_file_signature(self.path)
+            with open(self.journal_path, 'ab') as journal:
+                journal.truncate(0)
+            self._journal_offset = 0
+            self._journal_entries = 0
+
+
+class SQLiteTokenController(TokenController):
+    """Token controller backed by a SQLite database.
+
+    Tokens, containers and images are stored in indexed tables,
+    so every request reads or writes just the rows it needs. The
+    database runs in WAL mode, which allows several server workers
+    to read while another one writes, and every change is made in
+    a short transaction.
+    """
+
+    def __init__(self, path, store_format=None):
+        # The records are stored in tables, so store_format, given
+        # by token_store_format for the file stores, is ignored.
+        self.path = path
+        self._local = threading.local()
+        self._transaction_state = threading.local()
+        self._container_index = {}
+        try:
+            self._connect().executescript(SQLITE_SCHEMA)
+        except sqlite3.Error:
+            raise exceptions.UserCredentialsException(
+                "Unable to open database %s " % path
+            )
+
+    def _connect(self):
+        """Return the connection of the current thread and process.
+
+        Connections are not shared between threads, nor inherited
+        by forked processes.
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = conn
+            self._local.pid = pid
+        return self._local.connection
+
+    @contextlib.contextmanager
+    def _write_transaction(self, begin="BEGIN IMMEDIATE"):
+        """Run the statements of the block in a database transaction.
+
+        Write transactions lock the database when they begin. Read
+        transactions begin deferred, so they read a snapshot of the
+        database without blocking other processes. Blocks nested in
+        the transaction of the thread join it.
+
+        :param begin: statement that begins the transaction
+        """
+        conn = self._connect()
+        if getattr(self._local, "writing", False):
+            yield conn
+            return
+        conn.execute(begin)
+        self._local.writing = True
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._local.writing = False
+        conn.execute("COMMIT")
+
+    @contextlib.contextmanager
+    def _isolated(self, shared=False):
+        """Run a block in a database transaction.
+
+        The records are read once the database is locked, so no
+        other process writes them until the block ends. Read-only
+        blocks run in a deferred transaction.
+
+        :param shared: run a read transaction instead of a write one
+        """
+        if self._in_transaction():
+            yield
+            return
+        with self._write_transaction("BEGIN" if shared
+                                     else "BEGIN IMMEDIATE"):
+            yield
+
+    def save_token_file(self):
+        """Save token store in the file
+
+        Changes are committed when they are made, so there is
+        nothing to save.
+        """
+        pass
+
+    def _discard_cache(self):
+        """Forget the cached token store.
+
+        Records are not cached, so there is nothing to forget.
+        """
+        pass
+
+    def _in_transaction(self):
+        """Check whether the thread runs a transaction.
+
+        In a transaction, records are changed in memory by the
+        generic methods and stored at once when it finishes.
+        """
+        return self._pending_changes() is not None
+
+    def _load_token(self, token):
+        """Read a token record from the database
+
+        :param token: token looked for
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT record, last_seen FROM tokens"
+                           " WHERE token = ?", (token,)).fetchone()
+        if row is None:
+            raise exceptions.UserCredentialsException(
+                "User token not found")
+        token_info = json.loads(row[0])
+        if row[1] is not None:
+            token_info["last_seen"] = row[1]
+        containers = self._select_column(
+            conn,
+            "SELECT container_id FROM containers WHERE token = ?"
+            " ORDER BY rowid", token)
+        if containers:
+            token_info["containers"] = containers
+        images = self._select_column(
+            conn,
+            "SELECT image_id FROM images WHERE token = ?"
+            " ORDER BY rowid", token)
+        if images:
+            token_info["images"] = images
+        return token_info
+
+    @staticmethod
+    def _select_column(conn, query, *args):
+        return [row[0] for row in conn.execute(query, args)]
+
+    def _store_records(self, changes):
+        """Store token records in the database
+
+        Containers and images of each record are synchronized
+        with their tables. The records of a transaction are read
+        in the same write transaction, so they already include the
+        rows inserted by other processes.
+
+        :param changes: dict of token records, None deletes the token
+        """
+        with self._write_transaction() as conn:
+            for token, record in changes.items():
+                if record is None:
+                    self._delete_token(conn, token)
+                    continue
+                record = dict(record)
+                containers = record.pop("containers", [])
+                images = record.pop("images", [])
+                last_seen = record.pop("last_seen", None)
+                job_id = record.get("job", {}).get("job_id")
+                conn.execute("INSERT OR REPLACE INTO tokens"
+                             " (token, job_id, last_seen, record)"
+                             " VALUES (?, ?, ?, ?)",
+                             (token, job_id, last_seen, json.dumps(record)))
+                self._sync_column(conn, "containers", "container_id",
+                                  token, containers)
+                self._sync_column(conn, "images", "image_id",
+                                  token, images)
+
+    def _sync_column(self, conn, table, column, token, values):
+        current = self._select_column(
+            conn, "SELECT %s FROM %s WHERE token = ?" % (column, table),
+            token)
+        removed = set(current) - set(values)
+        conn.executemany(
+            "DELETE FROM %s WHERE token = ? AND %s = ?" % (table, column),
+            [(token, value) for value in removed])
+        conn.executemany(
+            "INSERT OR IGNORE INTO %s (token, %s) VALUES (?, ?)"
+            % (table, column),
+            [(token, value) for value in values])
+
+    @staticmethod
+    def _touch(conn, token):
+        conn.execute("UPDATE tokens SET last_seen = ? WHERE token = ?",
+                     (int(time.time()), token))
+
+    @staticmethod
+    def _delete_token(conn, token):
+        conn.execute("DELETE FROM containers WHERE token = ?", (token,))
+        conn.execute("DELETE FROM images WHERE token = ?", (token,))
+        conn.execute("DELETE FROM tokens WHERE token = ?", (token,))
+
+    def import_token_store(self, token_store):
+        """Import the records of a token store.
+
+        :param token_store: dict of token records
+        """
+        self._store_records(token_store)
+
+    def list_sessions(self):
+        """Return the user sessions of the token store.
+
+        :return: list of (token, token record) tuples
+        """
+        tokens = self._select_column(
+            self._connect(),
+            "SELECT token FROM tokens WHERE token != ?", ADMIN_TOKEN)
+        sessions = []
+        for token in tokens:
+            try:
+                sessions.append((token, self._get_token_from_cache(token)))
+            except exceptions.UserCredentialsException:
+                # removed since it was listed
+                pass
+        return sessions
+
+    def compact(self):
+        """Compact the token store.
+
+        It moves the WAL file content into the database and
+        truncates it.
+        """
+        self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def remove_token_from_cache(self, token):
+        """Remove token from token store
+
+        :param token: token looked for
+        """
+        with self._write_transaction() as conn:
+            row = conn.execute("SELECT 1 FROM tokens WHERE token = ?",
+                               (token,)).fetchone()
+            if row is None:
+                raise exceptions.UserCredentialsException(
+                    "Token not found")
+            self._delete_token(conn, token)
+
+    def add_image(self, token, image_id):
+        """Add image to the token record.
+
+        :param token: token
+        :param image_id: image id from dockers
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).add_image(
+                token, image_id)
+        self._get_token_from_cache(token)
+        with self._write_transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO images"
+                         " (token, image_id) VALUES (?, ?)",
+                         (token, image_id))
+            self._touch(conn, token)
+
+    def remove_image(self, token, image_id):
+        """Remove image to the token record.
+
+        :param token: token
+        :param image_id: image id from dockers
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).remove_image(
+                token, image_id)
+        with self._write_transaction() as conn:
+            conn.execute("DELETE FROM images"
+                         " WHERE token = ? AND image_id = ?",
+                         (token, image_id))
+            self._touch(conn, token)
+
+    def add_container(self, token, container_id):
+        """Add container to the token record.
+
+        :param token: token
+        :param container_id: container id from dockers
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).add_container(
+                token, container_id)
+        self._get_token_from_cache(token)
+        with self._write_transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO containers"
+                         " (token, container_id) VALUES (?, ?)",
+                         (token, container_id))
+            self._touch(conn, token)
+
+    def remove_container(self, token, container_id):
+        """Remove container to the token record.
+
+        :param token: token
+        :param container_id: container id from dockers
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).remove_container(
+                token, container_id)
+        with self._write_transaction() as conn:
+            conn.execute("DELETE FROM containers"
+                         " WHERE token = ? AND container_id = ?",
+                         (token, container_id))
+            self._touch(conn, token)
+
+    def list_containers(self, token):
+        """Return containers from a token record.
+
+        :param token: token
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).list_containers(token)
+        conn = self._connect()
+        row = conn.execute("SELECT 1 FROM tokens WHERE token = ?",
+                           (token,)).fetchone()
+        if row is None:
+            raise exceptions.UserCredentialsException(
+                "User token not found")
+        return self._select_column(
+            conn,
+            "SELECT container_id FROM containers WHERE token = ?"
+            " ORDER BY rowid", token)
+
+    def get_container_token(self, container_id):
+        """Return the token whose record has a container.
+
+        The container is looked up by its index.
+
+        :param container_id: full container id
+        :return: token, or None if no record has the container
+        """
+        row = self._connect().execute(
+            "SELECT token FROM containers WHERE container_id = ?"
+            " LIMIT 1", (container_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def authorize_container(self, token, container_id):
+        """Check user authorization to the container.
+
+        :param token: user token
+        :param container_id: container id
+        """
+        if self._in_transaction():
+            return super(SQLiteTokenController, self).authorize_container(
+                token, container_id)
+        containers = self._select_column(
+            self._connect(),
+            "SELECT container_id FROM containers"
+            " WHERE token = ? AND container_id >= ?"
+            " ORDER BY container_id LIMIT 2", token, container_id)
+        matches = utils.PrefixIndex(containers).matches(container_id)
+        return self._resolve_container(matches, container_id)
+
+
+def migrate_token_store(source, destination, source_format='yaml',
+                        destination_format='yaml'):
+    """Convert a token store to other format.
+
+    The journal of the source store, if any, is applied before
+    the conversion. The destination can be a token store file
+    in any of the data formats, or a SQLite database.
+
+    :param source: path of the token store
+    :param destination: path of the converted token store
+    :param source_format: yaml, json or msgpack
+    :param destination_format: yaml, json, msgpack or sqlite
+    :return: number of records converted
+    """
+    token_store = JournalTokenController(source,
+                                         store_format=source_format
+                                         ).token_store
+    if destination_format == "sqlite":
+        SQLiteTokenController(destination).import_token_store(token_store)
+    else:
+        utils.write_data_file_atomic(destination, token_store,
+                                     destination_format)
+    return len(token_store)
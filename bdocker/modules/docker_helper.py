@@ -13,38 +13,1104 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import collections
+import errno
+import hashlib
+import os
+import re
+import stat
+import threading
+import time
+
 import docker as docker_py
 
 from bdocker import exceptions
 from bdocker import parsers
 from bdocker import utils
 
+# Directory of the pull locks and records shared by the workers.
+PULL_CACHE_DIR = "/var/lib/bdocker"
+# Seconds during which a pulled image is not pulled again.
+PULL_CACHE_TTL = 60
+# Lock files of the pulls in the pull cache directory.
+PULL_LOCK_PATTERN = re.compile(r'^[0-9a-f]{40}\.lock$')
+# Seconds during which the list of images of the node is reused.
+IMAGE_INVENTORY_TTL = 30
+# Containers inspected or deleted at once.
+WORKERS = 8
+# Order in which the image collector evicts images.
+GC_POLICIES = ('lru', 'largest')
+# Image ids, short or complete.
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{12,64}$')
+# Label with the job of the containers.
+JOB_LABEL = 'bdocker.job_id'
+# API version used when the daemon does not report its version.
+DOCKER_API_VERSION = '1.20'
+# Newest API version known by the docker client library.
+MAX_DOCKER_API_VERSION = docker_py.constants.DEFAULT_DOCKER_API_VERSION
+# API version from which each capability of the daemon is available.
+API_CAPABILITIES = {
+    'labels': '1.18',
+    'label_filter': '1.18',
+    'stats_one_shot': '1.19',
+    'id_filter': '1.22',
+}
+
+# Label of the containers created ahead by the warm pool.
+POOL_LABEL = 'bdocker.warm_pool'
+# Run specs with containers kept by the warm pool.
+WARM_POOL_SPECS = 8
+# Seconds before subscribing again to the docker events.
+EVENTS_RETRY_INTERVAL = 5
+# Container state after each docker event.
+EVENT_STATES = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+}
+
+# Docker clients shared in the process, by pid and daemon url.
+_clients = {}
+# Container state tables and event listeners, by pid and daemon url.
+_container_states = {}
+_listeners = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(url):
+    """Return the docker client of the process for a daemon.
+
+    The client, and its pool of connections, is shared by the
+    controllers of the worker. Its API version is negotiated
+    with the daemon once, up to the newest version known by the
+    library. When the daemon does not answer, a client of the
+    default version is returned, and the negotiation is tried
+    again the next time the client is requested.
+
+    :param url: docker daemon url
+    :return: docker client
+    """
+    key = (os.getpid(), url)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+        try:
+            client = docker_py.Client(base_url=url, version='auto')
+        except docker_py.errors.DockerException as e:
+            exceptions.make_log("warning",
+                                "Docker API version not negotiated: %s" % e)
+            return docker_py.Client(base_url=url,
+                                    version=DOCKER_API_VERSION)
+        if docker_py.utils.version_lt(MAX_DOCKER_API_VERSION,
+                                      client.api_version):
+            client = docker_py.Client(base_url=url,
+                                      version=MAX_DOCKER_API_VERSION)
+        _clients[key] = client
+        return client
+
+
+def is_negotiated(url, client):
+    """Check if a client is the negotiated client of the process.
+
+    :param url: docker daemon url
+    :param client: docker client returned by get_client
+    """
+    return _clients.get((os.getpid(), url)) is client
+
+
+def get_container_states(url):
+    """Return the container state table of the process for a daemon.
+
+    :param url: docker daemon url
+    :return: ContainerStates
+    """
+    key = (os.getpid(), url)
+    with _clients_lock:
+        return _container_states.setdefault(key, ContainerStates())
+
+
+def start_event_listener(url, on_die=None):
+    """Start the docker events listener of the process for a daemon.
+
+    There is one listener per process, so it is only started
+    the first time.
+
+    :param url: docker daemon url
+    :param on_die: function called with the container id and its
+                   state when a container dies
+    :return: EventListener
+    """
+    states = get_container_states(url)
+    key = (os.getpid(), url)
+    with _clients_lock:
+        listener = _listeners.get(key)
+        if listener is None or not listener.is_alive():
+            listener = EventListener(url, states, on_die)
+            listener.start()
+            _listeners[key] = listener
+        return listener
+
+
+class ContainerStates(object):
+    """In-memory state of the containers, kept by the docker events.
+
+    Besides the status, exit code and finished time of each
+    container, it keeps the listing row and the details of the
+    exited containers, which do not change until the container
+    is started or destroyed. The table is only used while the
+    listener receives the events, and it is emptied when the
+    listener loses them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self.active = False
+
+    def activate(self):
+        """Start using the table."""
+        with self._lock:
+            self.active = True
+
+    def deactivate(self):
+        """Stop using the table and forget its states."""
+        with self._lock:
+            self.active = False
+            self._states.clear()
+
+    def update(self, event):
+        """Update the state of a container from a docker event.
+
+        :param event: decoded docker event
+        :return: new state of the container, or None
+        """
+        if event.get('Type', 'container') != 'container':
+            return None
+        action = event.get('Action') or event.get('status')
+        actor = event.get('Actor') or {}
+        container_id = event.get('id') or actor.get('ID')
+        if not container_id:
+            return None
+        with self._lock:
+            if action == 'destroy':
+                self._states.pop(container_id, None)
+                return None
+            if action not in EVENT_STATES:
+                return None
+            state = {'status': EVENT_STATES[action]}
+            if action == 'die':
+                exit_code = (actor.get('Attributes') or {}).get('exitCode')
+                state['exit_code'] = (int(exit_code)
+                                      if exit_code is not None else None)
+                state['finished_at'] = event.get('time')
+            self._states[container_id] = state
+            return dict(state)
+
+    def get(self, container_id):
+        """Return the state of a container.
+
+        :param container_id: container id
+        :return: dict with the state, or None if it is unknown
+        """
+        with self._lock:
+            state = self._states.get(container_id)
+            if not self.active or state is None:
+                return None
+            return dict(state)
+
+    def cache(self, container_id, key, value):
+        """Keep data of an exited container.
+
+        :param container_id: container id
+        :param key: name of the data, row or details
+        :param value: data
+        """
+        with self._lock:
+            state = self._states.get(container_id)
+            if self.active and state and state['status'] == 'exited':
+                state[key] = value
+
+
+class EventListener(threading.Thread):
+    """Background subscriber to the docker events.
+
+    It keeps the container state table, and calls on_die when
+    a container dies. The subscription is done again when it
+    fails, from the time of the last event received.
+    """
+
+    def __init__(self, url, states, on_die=None,
+                 retry_interval=EVENTS_RETRY_INTERVAL):
+        super(EventListener, self).__init__(name="docker_events")
+        self.daemon = True
+        self.url = url
+        self.states = states
+        self.on_die = on_die
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+    def _subscribe(self, since):
+        # The events are read without timeout, by a client which
+        # does not take a connection of the shared one.
+        client = docker_py.Client(base_url=self.url,
+                                  version=get_client(self.url).api_version,
+                                  timeout=None)
+        return client.events(since=since, decode=True)
+
+    def handle(self, event):
+        """Update the state table with an event.
+
+        :param event: decoded docker event
+        """
+        state = self.states.update(event)
+        if state and state['status'] == 'exited' and self.on_die:
+            container_id = event.get('id') or event['Actor']['ID']
+            try:
+                self.on_die(container_id, state)
+            except Exception as e:
+                exceptions.make_log("exception",
+                                    "Container %s died, handler failed:"
+                                    " %s" % (container_id, e))
+
+    def run(self):
+        """Receive the events until the listener is stopped.
+
+        """
+        since = None
+        while not self._stopped.is_set():
+            try:
+                events = self._subscribe(since)
+                self.states.activate()
+                for event in events:
+                    since = event.get('time', since)
+                    self.handle(event)
+                    if self._stopped.is_set():
+                        break
+            except Exception as e:
+                exceptions.make_log("warning",
+                                    "Docker events not received: %s" % e)
+            self.states.deactivate()
+            self._stopped.wait(self.retry_interval)
+
+    def stop(self):
+        """Stop the listener after the next event.
+
+        """
+        self._stopped.set()
+
+
+def _make_dirs(path):
+    """Create a private directory of the server if it does not exist.
+
+    The directory keeps locks and records trusted by the server, so
+    an existing one must be a real directory owned by the user of
+    the server, without access for other users.
+
+    :param path: directory path
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or
+            stat.S_IMODE(st.st_mode) & 0o077):
+        raise exceptions.ConfigurationException(
+            "%s must be a directory owned by uid %s with mode 0700"
+            % (path, os.geteuid()))
+
+
+class PullCache(object):
+    """Pulls of the images shared by the workers of a node.
+
+    Every image has a lock file, so concurrent pulls of an image
+    wait for the one in flight, from any worker or thread, and a
+    record of its last pull with the image id. Both files are
+    removed by prune once the record expires.
+    """
+
+    def __init__(self, path=PULL_CACHE_DIR, ttl=PULL_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def _entry_path(self, name):
+        key = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key)
+
+    def ensure_dir(self):
+        """Create the directory of the cache.
+
+        """
+        _make_dirs(self.path)
+
+    def lock(self, name):
+        """Lock the pulls of an image.
+
+        :param name: image name with its tag
+        """
+        self.ensure_dir()
+        return utils.removable_file_lock("%s.lock" % self._entry_path(name))
+
+    def get(self, name):
+        """Get the image id of a recent pull.
+
+        :param name: image name with its tag
+        :return: image id, or None if it is not recent
+        """
+        try:
+            record = utils.read_data_file(self._entry_path(name),
+                                          data_format='json')
+        except Exception:
+            return None
+        if not record or time.time() - record["time"] >= self.ttl:
+            return None
+        return record["image_id"]
+
+    def set(self, name, image_id):
+        """Record the pull of an image.
+
+        :param name: image name with its tag
+        :param image_id: image id after the pull
+        """
+        utils.write_data_file_atomic(self._entry_path(name),
+                                     {"time": time.time(),
+                                      "image_id": image_id},
+                                     data_format='json')
+
+    def prune(self, now=None):
+        """Remove the locks and records of the pulls older than ttl.
+
+        The entries of the pulls in flight, whose lock is held,
+        are kept.
+
+        :param now: current time
+        :return: number of removed entries
+        """
+        if now is None:
+            now = time.time()
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return 0
+        removed = 0
+        for name in names:
+            if not PULL_LOCK_PATTERN.match(name):
+                continue
+            lock_path = os.path.join(self.path, name)
+            record_path = lock_path[:-len(".lock")]
+            try:
+                changed = max(os.path.getmtime(path)
+                              for path in (lock_path, record_path)
+                              if os.path.exists(path))
+            except (OSError, ValueError):
+                continue
+            if now - changed < self.ttl:
+                continue
+            if utils.remove_locked_files(lock_path, [record_path]):
+                removed += 1
+        return removed
+
+
+class ImageUsage(object):
+    """Last use of the images of the node.
+
+    The workers append a line to a log for every use, which does
+    not need a lock, and the image collector merges the log in a
+    record file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = "%s.log" % path
+
+    def touch(self, name, now=None):
+        """Record the use of an image.
+
+        :param name: image name or id
+        :param now: time of the use
+        """
+        if now is None:
+            now = time.time()
+        with open(self.log_path, 'a') as log:
+            log.write("%d %s\n" % (now, name))
+
+    def _read_log(self, path, usage):
+        try:
+            with open(path) as log:
+                for line in log:
+                    try:
+                        last_used, name = line.rstrip("\n").split(" ", 1)
+                        usage[name] = max(usage.get(name, 0),
+                                          int(last_used))
+                    except ValueError:
+                        continue
+        except IOError:
+            pass
+
+    def load(self):
+        """Get the last use of the images.
+
+        :return: dict with the last use time of every image
+        """
+        try:
+            usage = utils.read_data_file(self.path, data_format='json')
+        except Exception:
+            usage = {}
+        self._read_log(self.log_path, usage)
+        return usage
+
+    def compact(self, forget=()):
+        """Merge the log in the record file.
+
+        :param forget: images which are not in the node anymore
+        :return: dict with the last use time of every image
+        """
+        with utils.file_lock("%s.lock" % self.path):
+            pending = "%s.%s" % (self.log_path, os.getpid())
+            try:
+                os.rename(self.log_path, pending)
+            except OSError:
+                pending = None
+            try:
+                usage = utils.read_data_file(self.path, data_format='json')
+            except Exception:
+                usage = {}
+            if pending:
+                self._read_log(pending, usage)
+            for name in forget:
+                usage.pop(name, None)
+            utils.write_data_file_atomic(self.path, usage,
+                                         data_format='json')
+            if pending:
+                os.remove(pending)
+        return usage
+
+
+class ImageInventory(object):
+    """Images present in the node.
+
+    The list is taken from docker when it is older than ttl
+    seconds, or after a pull or a removal invalidates it.
+    """
+
+    def __init__(self, get_control, ttl=IMAGE_INVENTORY_TTL):
+        self.get_control = get_control
+        self.ttl = ttl
+        self._images = None
+        self._updated = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Take the list from docker in the next request."""
+        self._images = None
+
+    def refresh(self):
+        """Take the list of images from docker.
+
+        :return: list of dicts with id, tags, size and created
+        """
+        images = []
+        for image in self.get_control().images():
+            tags = [tag for tag in image.get('RepoTags') or []
+                    if tag != '<none>:<none>']
+            images.append({"id": image['Id'],
+                           "tags": tags,
+                           "size": image.get('Size'),
+                           "created": image.get('Created')})
+        self._images = images
+        self._updated = time.time()
+        return images
+
+    def list(self):
+        """List the images of the node.
+
+        :return: list of dicts with id, tags, size and created
+        """
+        with self._lock:
+            images = self._images
+            if images is None or time.time() - self._updated >= self.ttl:
+                images = self.refresh()
+            return images
+
+
+class CopyManifests(object):
+    """Manifests of the delta copies of the jobs of the node.
+
+    Every job has a record, shared by the workers, with the entries
+    of the host files hashed for it, so a file is hashed again only
+    when it changes, and the manifests of the trees copied to its
+    containers, by container and destination in the container.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _job_path(self, job_id):
+        key = hashlib.sha1(str(job_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, key)
+
+    def load(self, job_id):
+        """Get the record of a job.
+
+        :param job_id: job id
+        :return: dict with the hashes and copies of the job
+        """
+        try:
+            record = utils.read_data_file(self._job_path(job_id),
+                                          data_format='json')
+        except Exception:
+            record = None
+        return record or {"hashes": {}, "copies": {}}
+
+    @staticmethod
+    def _overlaps(path, other):
+        return (path == other or
+                path.startswith(other.rstrip('/') + '/') or
+                other.startswith(path.rstrip('/') + '/'))
+
+    def update(self, job_id, hashes, container_id, destination, copy):
+        """Record a copy to a container.
+
+        The copies to the same container which overlap with the
+        destination are forgotten, as their files may be replaced.
+
+        :param job_id: job id
+        :param hashes: entries of the host files by path
+        :param container_id: container id
+        :param destination: path of the tree in the container
+        :param copy: dict with the start time of the container and
+                     the manifest of the tree
+        """
+        _make_dirs(self.path)
+        path = self._job_path(job_id)
+        with utils.file_lock("%s.lock" % path):
+            record = self.load(job_id)
+            record["hashes"].update(hashes)
+            copies = record["copies"].setdefault(container_id, {})
+            for other in list(copies):
+                if self._overlaps(destination, other):
+                    del copies[other]
+            copies[destination] = copy
+            utils.write_data_file_atomic(path, record, data_format='json')
+
+    def forget(self, job_id):
+        """Delete the record of a job.
+
+        :param job_id: job id
+        """
+        path = self._job_path(job_id)
+        for file_path in (path, "%s.lock" % path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+
+class TransferProgress(object):
+    """Bytes transferred by a copy.
+
+    It counts the chunks of a generator, or the data read from
+    its stream, as a file-like object.
+    """
+
+    def __init__(self, stream=None):
+        self.bytes = 0
+        self.stream = stream
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        return data
+
+    def count(self, chunks):
+        """Count the chunks of a generator.
+
+        :param chunks: generator of data chunks
+        """
+        for chunk in chunks:
+            self.bytes += len(chunk)
+            yield chunk
+
+
+class WarmPool(object):
+    """Containers created ahead for the runs of the jobs.
+
+    The containers are created, not started, with the same run
+    spec (image, command, binds, working dir, cgroup and job) as
+    a recent run, so the next run with that spec takes one of
+    them instead of creating its container. It keeps up to size
+    containers for each of the last max_specs specs.
+    """
+
+    def __init__(self, size, create, delete, max_specs=WARM_POOL_SPECS):
+        """Initialize the pool.
+
+        :param size: containers kept for each run spec
+        :param create: function that creates a container of a spec
+        :param delete: function that deletes a container
+        :param max_specs: run specs kept
+        """
+        self.size = size
+        self.max_specs = max_specs
+        self._create = create
+        self._delete = delete
+        self._lock = threading.Lock()
+        # run spec -> created container ids, least recently used first
+        self._containers = collections.OrderedDict()
+        self._filling = set()
+
+    def take(self, spec):
+        """Take a container created for a run spec.
+
+        :param spec: run spec
+        :return: container id, or None if there is not any
+        """
+        with self._lock:
+            containers = self._containers.get(spec)
+            if containers:
+                return containers.pop(0)
+        return None
+
+    def fill(self, spec):
+        """Create the containers of a run spec in the background.
+
+        :param spec: run spec
+        :return: the thread that creates them, or None
+        """
+        with self._lock:
+            containers = self._containers.pop(spec, [])
+            self._containers[spec] = containers
+            evicted = []
+            while len(self._containers) > self.max_specs:
+                evicted.extend(self._containers.popitem(last=False)[1])
+            if spec in self._filling or len(containers) >= self.size:
+                spec = None
+            else:
+                self._filling.add(spec)
+        if spec is None and not evicted:
+            return None
+        thread = threading.Thread(target=self._fill,
+                                  args=(spec, evicted),
+                                  name="warm_pool")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _fill(self, spec, evicted):
+        self._delete_all(evicted)
+        if spec is None:
+            return
+        try:
+            while True:
+                with self._lock:
+                    containers = self._containers.get(spec)
+                    if containers is None or len(containers) >= self.size:
+                        return
+                container_id = self._create(spec)
+                with self._lock:
+                    containers = self._containers.get(spec)
+                    if containers is not None:
+                        containers.append(container_id)
+                        continue
+                # The spec was drained while the container was created.
+                self._delete_all([container_id])
+                return
+        except Exception as e:
+            exceptions.make_log("warning", "Warm pool not filled: %s" % e)
+        finally:
+            with self._lock:
+                self._filling.discard(spec)
+
+    def _delete_all(self, containers):
+        for container_id in containers:
+            try:
+                self._delete(container_id)
+            except Exception as e:
+                exceptions.make_log("warning",
+                                    "Warm container %s not deleted: %s"
+                                    % (container_id, e))
+
+    def drain(self, match=None):
+        """Delete the containers of some run specs, or all of them.
+
+        :param match: function that tells if a run spec is drained
+        :return: ids of the deleted containers
+        """
+        with self._lock:
+            removed = []
+            for spec in list(self._containers):
+                if match is None or match(spec):
+                    removed.extend(self._containers.pop(spec))
+        self._delete_all(removed)
+        return removed
+
 
 class DockerController(object):
 
-    def __init__(self, url, cgroup=None):
+    def __init__(self, url, cgroup=None,
+                 pull_progress_interval=parsers.PULL_PROGRESS_INTERVAL,
+                 pull_cache_dir=PULL_CACHE_DIR,
+                 pull_cache_ttl=PULL_CACHE_TTL,
+                 image_inventory_ttl=IMAGE_INVENTORY_TTL,
+                 workers=WORKERS, warm_pool_size=0,
+                 copy_compression='none', copy_compression_workers=None,
+                 copy_progress_interval=parsers.PULL_PROGRESS_INTERVAL,
+                 track_image_usage=True):
+        if copy_compression not in utils.TAR_COMPRESSIONS:
+            raise exceptions.ConfigurationException(
+                "copy_compression must be one of %s"
+                % ", ".join(utils.TAR_COMPRESSIONS))
+        self.copy_compression = copy_compression
+        self.copy_compression_workers = copy_compression_workers
+        self.copy_progress_interval = copy_progress_interval
+        self.pull_progress_interval = pull_progress_interval
+        self.workers = workers
+        self.track_image_usage = track_image_usage
+        self.pull_cache = PullCache(pull_cache_dir, pull_cache_ttl)
+        self.pull_cache.ensure_dir()
+        self.image_usage = ImageUsage(os.path.join(pull_cache_dir,
+                                                   "image_usage"))
+        self.copy_manifests = CopyManifests(os.path.join(pull_cache_dir,
+                                                         "copies"))
+        self.url = url
         try:
-            self.control = docker_py.Client(base_url=url, version='1.20')
+            self._control = get_client(url)
         except BaseException as e:
             message = ("Unable to connect to the docker server: %s" %
                        e.message)
             raise exceptions.DockerException(message=message)
+        self._negotiated = is_negotiated(url, self._control)
+        self.image_inventory = ImageInventory(lambda: self.control,
+                                              image_inventory_ttl)
+        self.container_states = get_container_states(url)
+        self.warm_pool = None
+        if warm_pool_size > 0:
+            self.warm_pool = WarmPool(
+                warm_pool_size,
+                lambda spec: self._create_container(*spec, pooled=True),
+                lambda c_id: self.delete_container(c_id, force=True))
+
+    def watch_events(self, on_die=None):
+        """Keep the state of the containers from the docker events.
+
+        :param on_die: function called with the container id and its
+                       state when a container dies
+        :return: EventListener
+        """
+        return start_event_listener(self.url, on_die)
+
+    @property
+    def control(self):
+        """Docker client of the daemon.
+
+        While the API version is not negotiated, because the daemon
+        did not answer, the client is requested again, so the
+        negotiated one is used once the daemon is available.
+        """
+        if not self._negotiated:
+            self._control = get_client(self.url)
+            self._negotiated = is_negotiated(self.url, self._control)
+        return self._control
+
+    @property
+    def capabilities(self):
+        """Capabilities of the daemon, by name."""
+        return dict((name, self.supports(name))
+                    for name in API_CAPABILITIES)
+
+    def supports(self, capability):
+        """Check if the API version of the daemon has a capability.
+
+        :param capability: name of the capability
+        """
+        return docker_py.utils.version_gte(self.control.api_version,
+                                           API_CAPABILITIES[capability])
+
+    @staticmethod
+    def _image_name(repo, tag):
+        if ':' in repo.rsplit('/', 1)[-1]:
+            return repo
+        return "%s:%s" % (repo, tag)
+
+    def _get_image_id(self, name):
+        try:
+            return self.control.inspect_image(name)['Id']
+        except Exception:
+            return None
+
+    def _is_pulled(self, name):
+        """Check if the image was pulled recently and did not change.
+
+        :param name: image name with its tag
+        """
+        image_id = self.pull_cache.get(name)
+        return image_id is not None and image_id == self._get_image_id(name)
+
+    def _set_pulled(self, name):
+        self.image_inventory.invalidate()
+        if self.warm_pool:
+            # The containers created ahead use the previous image.
+            self.warm_pool.drain(
+                lambda spec: self._image_name(str(spec[0]),
+                                              'latest') == name)
+        image_id = self._get_image_id(name)
+        if image_id:
+            self.pull_cache.set(name, image_id)
+
+    @classmethod
+    def _is_image(cls, image, ref):
+        """Check if a name or id refers to an image.
+
+        :param image: image of the inventory
+        :param ref: image name, with or without tag, or image id
+        """
+        if ref == image["id"] or ref in image["tags"]:
+            return True
+        if cls._image_name(ref, 'latest') in image["tags"]:
+            return True
+        ref_hex = ref.split(":")[-1]
+        return (IMAGE_ID_PATTERN.match(ref_hex) is not None and
+                image["id"].split(":")[-1].startswith(ref_hex))
+
+    def record_image_use(self, name):
+        """Record the use of an image for the image collector.
+
+        Errors are logged, they must not fail the request. Nothing
+        is recorded when the image collector is disabled, since it
+        is the one which compacts the records.
+
+        :param name: image name or id
+        """
+        if not self.track_image_usage:
+            return
+        try:
+            self.pull_cache.ensure_dir()
+            self.image_usage.touch(name)
+        except Exception as e:
+            exceptions.make_log("warning",
+                                "Image use not recorded: %s" % e)
+
+    def collect_images(self, budget, high_watermark, low_watermark,
+                       in_use=(), policy='lru'):
+        """Evict images when they exceed the disk budget.
+
+        When the images take more than high_watermark of the budget,
+        images are removed until they take low_watermark of it. The
+        images in use are never removed, and the rest are removed in
+        the order of the policy: least recently used first, or the
+        one which frees most disk first. The layers shared by several
+        images are counted once, and the removal of an image only
+        frees the layers that no other image uses.
+
+        :param budget: bytes of disk for the images
+        :param high_watermark: fraction of the budget that starts it
+        :param low_watermark: fraction of the budget that stops it
+        :param in_use: names and ids of the images in use
+        :param policy: lru or largest
+        :return: list of removed image ids
+        """
+        if policy not in GC_POLICIES:
+            raise exceptions.ConfigurationException(
+                "Unknown image collector policy: %s" % policy)
+        self.pull_cache.ensure_dir()
+        self.pull_cache.prune()
+        images = self.image_inventory.refresh()
+        usage = self.image_usage.compact()
+        # The sizes include the shared layers, so their sum is an
+        # upper bound of the disk used.
+        if sum(image.get("size") or 0 for image in images) <= (
+                budget * high_watermark):
+            return []
+        layers = dict((image["id"], self._image_layers(image))
+                      for image in images)
+        references = collections.Counter()
+        layer_sizes = {}
+        for image_layers in layers.values():
+            for key, size in image_layers:
+                references[key] += 1
+                layer_sizes[key] = size
+        total = sum(layer_sizes.values())
+        if total <= budget * high_watermark:
+            return []
+        in_use = set(in_use)
+        try:
+            for container in self.control.containers(all=True):
+                in_use.add(container.get('Image'))
+                in_use.add(container.get('ImageID'))
+        except BaseException as e:
+            raise exceptions.DockerException(e)
+        in_use.discard(None)
+        candidates = []
+        for image in images:
+            if any(self._is_image(image, ref) for ref in in_use):
+                continue
+            last_used = max([last for ref, last in usage.items()
+                             if self._is_image(image, ref)] +
+                            [image.get("created") or 0])
+            candidates.append((last_used, image))
+        if policy == 'lru':
+            candidates.sort(key=lambda c: c[0])
+        else:
+            candidates.sort(key=lambda c: -sum(
+                size for key, size in layers[c[1]["id"]]
+                if references[key] == 1))
+        removed = []
+        forget = []
+        for _last_used, image in candidates:
+            if total <= budget * low_watermark:
+                break
+            try:
+                self.delete_image(image["id"])
+            except exceptions.DockerException as e:
+                # In use by a container not known by bdocker.
+                exceptions.make_log("warning", "Image %s not removed: %s"
+                                    % (image["id"], e.message))
+                continue
+            for key, size in layers[image["id"]]:
+                references[key] -= 1
+                if not references[key]:
+                    total -= size
+            removed.append(image["id"])
+            forget.extend(ref for ref in usage
+                          if self._is_image(image, ref))
+        if forget:
+            self.image_usage.compact(forget)
+        return removed
+
+    def prune_pull_cache(self):
+        """Remove the expired entries of the pull cache.
+
+        :return: number of removed entries
+        """
+        return self.pull_cache.prune()
+
+    def _image_layers(self, image):
+        """Return the layers of an image with their sizes.
+
+        A layer is identified by the history of the image up to it,
+        so the layers of a base image have the same key in all the
+        images built on it. Without history, the image is taken as
+        a single layer.
+
+        :param image: image of the inventory
+        :return: list of (layer key, size) tuples
+        """
+        try:
+            history = self.control.history(image["id"])
+        except BaseException:
+            return [(image["id"], image.get("size") or 0)]
+        layers = []
+        key = hashlib.sha1()
+        for entry in reversed(history):
+            key.update(repr((entry.get("Created"), entry.get("CreatedBy"),
+                             entry.get("Size"))).encode("utf-8"))
+            if entry.get("Size"):
+                layers.append((key.hexdigest(), entry["Size"]))
+        return layers
+
+    def list_images(self):
+        """List the images present in the node.
+
+        :return: list of dicts with id, tags, size and created
+        """
+        try:
+            return self.image_inventory.list()
+        except BaseException as e:
+            raise exceptions.DockerException(e)
+
+    def prefetch_images(self, names):
+        """Pull images in the background.
+
+        Later pulls of the images wait for these ones, as any
+        concurrent pull, and so do the runs.
+
+        :param names: image names with their tags
+        :return: the thread that pulls them
+        """
+        def prefetch():
+            for name in names:
+                try:
+                    self.pull_image(name)
+                except Exception as e:
+                    exceptions.make_log("warning", "Prefetch of %s failed: %s"
+                                        % (name, e))
+        thread = threading.Thread(target=prefetch, name="prefetch_images")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait_pull(self, name):
+        """Wait for the pull of an image in flight.
 
-    def pull_image(self, repo, tag='latest'):
+        :param name: image name or id
+        """
+        name = self._image_name(str(name), 'latest')
+        try:
+            with self.pull_cache.lock(name):
+                pass
+        except Exception as e:
+            exceptions.make_log("warning", "Pull lock of %s failed: %s"
+                                % (name, e))
+
+    def pull_image(self, repo, tag='latest', stream=False):
         """Pull the image from a reporitory
 
+        Concurrent pulls of the same image on the node wait for
+        the one in flight, and an image pulled recently is not
+        pulled again while its id does not change.
+
         :param repo: image repository
         :param tag: tag for the image
-        :return: dict with the messages parsed like docker makes
+        :param stream: return the progress while the image is pulled
+        :return: list with a message per layer, or generator of
+                 progress snapshots
         """
+        name = self._image_name(repo, tag)
+        repo, tag = name.rsplit(':', 1)
+        self.record_image_use(name)
+        if stream:
+            return self._stream_pull(repo, tag, name)
         try:
-            docker_out = self.control.pull(repository=repo,
-                                           tag=tag, stream=True)
-            result = parsers.parse_docker_generator(docker_out)
+            with self.pull_cache.lock(name):
+                if self._is_pulled(name):
+                    return ["Status: Image is up to date for %s" % name]
+                docker_out = self.control.pull(repository=repo,
+                                               tag=tag, stream=True)
+                result = parsers.parse_docker_generator(docker_out)
+                self._set_pulled(name)
+        except exceptions.DockerException:
+            raise
         except BaseException as e:
             raise exceptions.DockerException(e)
         return result
 
+    def _stream_pull(self, repo, tag, name):
+        docker_out = None
+        try:
+            with self.pull_cache.lock(name):
+                if self._is_pulled(name):
+                    yield "Status: Image is up to date for %s\n" % name
+                    return
+                docker_out = self.control.pull(repository=repo,
+                                               tag=tag, stream=True)
+                for chunk in parsers.stream_docker_pull(
+                        docker_out, self.pull_progress_interval):
+                    yield chunk
+                self._set_pulled(name)
+        except exceptions.DockerException:
+            raise
+        except Exception as e:
+            raise exceptions.DockerException(e)
+        finally:
+            close = getattr(docker_out, "close", None)
+            if close:
+                close()
+
     def delete_image(self, image_id):
         """Remove an image from the docker cache.
 
@@ -52,10 +1118,12 @@ class DockerController(object):
         :return: return the docker api output
         """
         try:
-            docker_out = self.control.remove_image(container=image_id)
+            docker_out = self.control.remove_image(image=image_id)
             return docker_out
         except BaseException as e:
             raise exceptions.DockerException(e)
+        finally:
+            self.image_inventory.invalidate()
 
     def delete_container(self, container_id, force=False):
         """Remove a container from the docker cache.
@@ -72,45 +1140,131 @@ class DockerController(object):
         except BaseException as e:
             raise exceptions.DockerException(e)
 
+    def map_containers(self, function, containers):
+        """Apply a function to several containers at once.
+
+        :param function: function called with each container
+        :param containers: list of containers
+        :return: list of results or exceptions, in order
+        """
+        return utils.map_concurrently(function, containers or [],
+                                      self.workers)
+
+    def clean_warm_pool(self, job_id):
+        """Delete the containers created ahead for a job.
+
+        The containers created by the warm pools of the other
+        workers are found by their labels. Nothing is done when
+        the warm pool is disabled.
+
+        :param job_id: job id
+        :return: ids of the deleted containers
+        """
+        if not self.warm_pool:
+            return []
+        removed = self.warm_pool.drain(lambda spec: spec[-1] == job_id)
+        if not self.supports('label_filter'):
+            return removed
+        try:
+            pooled = self.control.containers(
+                all=True,
+                filters={'label': ['%s=%s' % (JOB_LABEL, job_id),
+                                   POOL_LABEL]})
+        except Exception as e:
+            exceptions.make_log("warning",
+                                "Warm containers of job %s not found: %s"
+                                % (job_id, e))
+            return removed
+        pooled = [d_c['Id'] for d_c in pooled if d_c['Id'] not in removed]
+        removed.extend(c_id for c_id in
+                       self.clean_containers(pooled, force=True)
+                       if c_id in pooled)
+        return removed
+
     def clean_containers(self, containers, force=True):
         """Delete all containers from the docker cache.
 
+        The containers are deleted concurrently.
+
         :param containers: list of containers
         :param force: boolean, force to stop containers
-        :return: message from delete each container
+        :return: container id, or error message, of each container
         """
         docker_out = []
-        if containers:
-            for c_id in containers:
-                try:
-                    self.delete_container(c_id, force=force)
-                    docker_out.append(c_id)
-                except exceptions.DockerException as e:
-                    docker_out.append(e.message)
-                except BaseException as e:
-                    raise exceptions.DockerException(e)
+        results = self.map_containers(
+            lambda c_id: self.delete_container(c_id, force=force),
+            containers)
+        for out in results:
+            if isinstance(out, exceptions.DockerException):
+                docker_out.append(out.message)
+            elif isinstance(out, Exception):
+                raise exceptions.DockerException(out)
+            else:
+                docker_out.append(out)
         return docker_out
 
+    def _inspect_container(self, container_id):
+        try:
+            docker_out = self.control.inspect_container(container_id)
+            return parsers.parse_list_container_details(docker_out)
+        except BaseException as e:
+            raise exceptions.DockerException(e)
+
     def list_containers_details(self, containers):
         """List the details of each container of a user.
 
-        Give the details of each container.
+        Give the details of each container. The containers are
+        inspected concurrently, and a container that fails gets
+        the error in its status column.
 
         :param containers: list of containers
         :return: list of container details
         """
+        results = self.map_containers(self._inspect_container,
+                                      containers)
+        errors = [out for out in results if isinstance(out, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
         result = []
-        try:
-            for container_id in containers:
-                docker_out = self.control.inspect_container(container_id)
-                container_row = parsers.parse_list_container_details(
-                    docker_out)
-                result.append(container_row)
-        except BaseException as e:
-            raise exceptions.DockerException(e)
+        for container_id, out in zip(containers, results):
+            if isinstance(out, Exception):
+                out = [container_id[:12], "", "", "", out.message, "", ""]
+            result.append(out)
         return result
 
-    def list_containers(self, containers, all=False):
+    def _find_containers(self, containers, all, job_id):
+        """Fetch from docker only the containers of a user.
+
+        The containers labeled with the job are taken in one call,
+        and the rest of them, created without label, by their ids.
+        Daemons without the id filter list all their containers.
+
+        :param containers: list of containers
+        :param all: indicates all conainers (finished too)
+        :param job_id: job of the containers
+        :return: dict of docker containers by id
+        """
+        by_id = {}
+        if job_id and self.supports('label_filter'):
+            labeled = self.control.containers(
+                all=all,
+                filters={'label': '%s=%s' % (JOB_LABEL, job_id)}
+            )
+            by_id.update((d_c["Id"], d_c) for d_c in labeled)
+        index = utils.PrefixIndex(by_id)
+        missing = [c for c in containers if not index.matches(c, limit=1)]
+        if missing:
+            if self.supports('id_filter'):
+                found = self.control.containers(
+                    all=all,
+                    filters={'id': missing}
+                )
+            else:
+                found = self.control.containers(all=all)
+            by_id.update((d_c["Id"], d_c) for d_c in found)
+        return by_id
+
+    def list_containers(self, containers, all=False, job_id=None):
         """List containers of a user.
 
         List brief description of each container, such as
@@ -118,42 +1272,82 @@ class DockerController(object):
 
         :param containers: list of containers
         :param all: indicates all conainers (finished too)
+        :param job_id: job of the containers
         :return:
         """
         result = []
         try:
-            docker_containers = self.control.containers(
-                all=all
-            )
+            exited = {}
+            for c in containers:
+                state = self.container_states.get(c)
+                if state and 'row' in state:
+                    exited[c] = state
+            by_id = self._find_containers(
+                [c for c in containers if c not in exited], all, job_id)
+            for d_id, d_c in by_id.items():
+                if str(d_c.get('Status')).startswith('Exited'):
+                    self.container_states.cache(d_id, 'row', d_c)
+            index = utils.PrefixIndex(by_id)
             for c in containers:
-                for d_c in docker_containers:
-                    if c in d_c["Id"]:
-                        d_c['Id'] = c[:12]
-                        # it set the short id like in docker
-                        container_row = parsers.parse_list_container(d_c)
-                        result.append(container_row)
+                if c in exited:
+                    if not all:
+                        continue
+                    d_c = self._exited_row(exited[c])
+                    d_c['Id'] = c[:12]
+                    result.append(parsers.parse_list_container(d_c))
+                    continue
+                if c in by_id:
+                    matches = [c]
+                else:
+                    matches = index.matches(c, limit=1)
+                for d_id in matches:
+                    d_c = dict(by_id[d_id])
+                    d_c['Id'] = c[:12]
+                    # it set the short id like in docker
+                    container_row = parsers.parse_list_container(d_c)
+                    result.append(container_row)
         except BaseException as e:
             raise exceptions.DockerException(e)
         return result
 
+    @staticmethod
+    def _exited_row(state):
+        d_c = dict(state['row'])
+        if state.get('exit_code') is not None and state.get('finished_at'):
+            d_c['Status'] = "Exited (%s) %s" % (
+                state['exit_code'],
+                parsers.get_date_diff(state['finished_at']))
+        return d_c
+
     def container_details(self, container_id):
         """Return the details of a specific container
 
         :param container_id:
         :return: container details
         """
+        state = self.container_states.get(container_id)
+        if state and 'details' in state:
+            return state['details']
         try:
             docker_out = self.control.inspect_container(container_id)
             details = parsers.parse_inspect_container(docker_out)
         except BaseException as e:
             raise exceptions.DockerException(e)
+        if (isinstance(docker_out, dict) and
+                not docker_out.get('State', {}).get('Running', True)):
+            self.container_states.cache(container_id, 'details', details)
         return details
 
-    def logs_container(self, container_id):
+    def logs_container(self, container_id, stream=False, tail='all',
+                       since=None, follow=False):
         """Return the log of a contanier.
 
         :param container_id:
-        :return: log information
+        :param stream: return the log chunks as they are produced
+        :param tail: number of lines from the end of the log, or all
+        :param since: unix timestamp from which the log is shown
+        :param follow: keep streaming until the container stops
+        :return: log information, or generator of log chunks
         """
         try:
             docker_out = self.control.logs(container=container_id,
@@ -161,14 +1355,30 @@ class DockerController(object):
                                            stderr=True,
                                            stream=True,
                                            timestamps=False,
-                                           tail='all',
-                                           since=None,
-                                           follow=None)
+                                           tail=tail,
+                                           since=since,
+                                           follow=follow)
+            if stream:
+                return self._stream_log(docker_out)
             out = parsers.parse_docker_log(docker_out)
         except BaseException as e:
             raise exceptions.DockerException(e)
         return out
 
+    @staticmethod
+    def _stream_log(docker_out):
+        try:
+            for chunk in parsers.stream_docker_log(docker_out):
+                yield chunk
+        except Exception as e:
+            raise exceptions.DockerException(e)
+        finally:
+            # A client that disconnects closes this generator,
+            # release the docker connection as well.
+            close = getattr(docker_out, "close", None)
+            if close:
+                close()
+
     def start_container(self, container_id, detach=False):
         """Start the container.
 
@@ -184,7 +1394,7 @@ class DockerController(object):
 
     def run_container(self, image_id, detach, command,
                       working_dir=None, host_dir=None, docker_dir=None,
-                      cgroup=None):
+                      cgroup=None, job_id=None):
         """Run script in the container.
 
         Run the script in the container already started.
@@ -196,8 +1406,25 @@ class DockerController(object):
         :param host_dir: container directory to bind
         :param docker_dir: host directory to bind
         :param cgroup: cgroup in which run the container
+        :param job_id: job with which the container is labeled
         :return: container id
         """
+        self.record_image_use(image_id)
+        if isinstance(command, list):
+            command = tuple(command)
+        spec = (image_id, command, detach, working_dir, host_dir,
+                docker_dir, cgroup, job_id)
+        if self.warm_pool:
+            container_id = self.warm_pool.take(spec)
+            self.warm_pool.fill(spec)
+            if container_id:
+                return container_id
+        self.wait_pull(image_id)
+        return self._create_container(*spec)
+
+    def _create_container(self, image_id, command, detach, working_dir,
+                          host_dir, docker_dir, cgroup, job_id,
+                          pooled=False):
         try:
             binds = None
             if host_dir:
@@ -206,12 +1433,18 @@ class DockerController(object):
                 binds=binds,
                 cgroup_parent=cgroup,
                 )
+            labels = None
+            if job_id and self.supports('labels'):
+                labels = {JOB_LABEL: str(job_id)}
+                if pooled:
+                    labels[POOL_LABEL] = 'true'
             container_info = self.control.create_container(
                 image=image_id,
                 command=command,
                 detach=detach,
                 host_config=host_config,
-                working_dir=working_dir
+                working_dir=working_dir,
+                labels=labels
                 # volumes=volumes
             )
             if 'Id' not in container_info:
@@ -222,49 +1455,166 @@ class DockerController(object):
             raise exceptions.DockerException(e)
         return container_id
 
+    def _stream_transfer(self, transfer, progress):
+        results = []
+        errors = []
+
+        def run():
+            try:
+                results.append(transfer())
+            except BaseException as e:
+                errors.append(e)
+
+        start = time.time()
+        thread = threading.Thread(target=run, name="copy_transfer")
+        thread.daemon = True
+        thread.start()
+        thread.join(self.copy_progress_interval)
+        while thread.is_alive():
+            yield parsers.format_transfer(progress.bytes,
+                                          time.time() - start)
+            thread.join(self.copy_progress_interval)
+        if errors:
+            raise exceptions.DockerException(errors[0])
+        yield parsers.format_transfer(progress.bytes, time.time() - start)
+
+    def _run_transfer(self, transfer, progress, stream):
+        if stream:
+            return self._stream_transfer(transfer, progress)
+        try:
+            return transfer()
+        except BaseException as e:
+            raise exceptions.DockerException(e)
+
     def copy_from_container(self, container_id, container_path,
-                            host_path, uid=None, gid=None):
+                            host_path, uid=None, gid=None, delta=False,
+                            stream=False):
         """Copy data from container to host
 
         Copy files from a path in container to a path in the
         HOME user directory. Set as owner of the file the
-        user uid and gid.
+        user uid and gid. The archive is extracted while it is
+        received from the docker daemon.
 
         :param container_id: container id
         :param container_path: container path
         :param host_path: host path
         :param uid: user uid
         :param gid: user gid
-        :return: stat retrieved from the docker api
+        :param delta: only write the files whose size or
+                      modification time differ in the host
+        :param stream: return the progress while the data is copied
+        :return: stat retrieved from the docker api, or generator
+                 of progress lines
         """
-        try:
+        progress = TransferProgress()
+
+        def transfer():
             docker_out, stat = self.control.get_archive(
                 container=container_id, path=container_path)
-            utils.write_tar_raw_data_stream(host_path,
-                                            docker_out.data,
-                                            uid, gid)
-        except BaseException as e:
-            raise exceptions.DockerException(e)
-        return stat
+            progress.stream = docker_out
+            try:
+                utils.write_tar_raw_data_stream(host_path,
+                                                progress,
+                                                uid, gid,
+                                                skip_unchanged=delta)
+            finally:
+                docker_out.close()
+            return stat
+
+        return self._run_transfer(transfer, progress, stream)
 
     def copy_to_container(self, container_id, container_path,
-                          host_path):
+                          host_path, delta=False, job_id=None,
+                          compression=None, stream=False):
         """Copy files from the host to a container.
 
+        The tar of the host path is streamed to docker while it is
+        written, compressed as copy_compression by default. The
+        pgzip compression compresses blocks of the tar in parallel.
+
+        In delta mode, the manifest of the host path is compared
+        with the one of the last copy of the job to the same path
+        of the container, and only the files whose content changed
+        are sent. The manifest is not trusted when the container
+        started since the last copy, as its processes may have
+        changed the files, nor while it runs.
+
         :param container_id: container id
         :param container_path: container path
         :param host_path: host path
-        :return: stat retrieved by the docker api
+        :param delta: only send the changed files
+        :param job_id: job of the copy, which keeps the manifests
+        :param compression: none, gzip or pgzip
+        :param stream: return the progress while the data is copied
+        :return: stat retrieved by the docker api, or generator of
+                 progress lines
         """
-        try:
-            data = utils.read_tar_raw_data_stream(host_path)
-            stat = self.control.put_archive(
-                container=container_id, path=container_path,
-                data=data)
-        except BaseException as e:
-            raise exceptions.DockerException(e)
+        compression = compression or self.copy_compression
+        if compression not in utils.TAR_COMPRESSIONS:
+            raise exceptions.ParseException(
+                "Copy compression must be one of %s"
+                % ", ".join(utils.TAR_COMPRESSIONS))
+        progress = TransferProgress()
+
+        def transfer():
+            if delta:
+                return self._copy_delta(container_id, container_path,
+                                        host_path, job_id, compression,
+                                        progress)
+            return self._put_archive(container_id, container_path,
+                                     host_path, compression, progress)
+
+        return self._run_transfer(transfer, progress, stream)
+
+    def _put_archive(self, container_id, container_path, host_path,
+                     compression, progress, members=None):
+        data = utils.read_tar_raw_data_stream(
+            host_path, compression=compression, members=members,
+            workers=self.copy_compression_workers)
+        return self.control.put_archive(
+            container=container_id, path=container_path,
+            data=progress.count(data))
+
+    def _copy_delta(self, container_id, container_path, host_path,
+                    job_id, compression, progress):
+        state = self.control.inspect_container(container_id)['State']
+        started_at = None
+        if not state.get('Running'):
+            started_at = state.get('StartedAt')
+        destination = os.path.normpath(
+            os.path.join(container_path, os.path.basename(host_path)))
+        record = self.copy_manifests.load(job_id)
+        copy = record["copies"].get(container_id, {}).get(destination)
+        copied = {}
+        if copy and started_at and copy["started_at"] == started_at:
+            copied = copy["files"]
+        hashes = record["hashes"]
+        manifest = utils.tree_manifest(host_path, hashes)
+        members = None
+        if copied:
+            members = [name for name, entry in manifest.items()
+                       if name not in copied or
+                       copied[name][2] != entry[2]]
+        stat = True
+        if members is None or members:
+            stat = self._put_archive(container_id, container_path,
+                                     host_path, compression, progress,
+                                     members)
+        if started_at:
+            copied.update(manifest)
+            self.copy_manifests.update(
+                job_id, hashes, container_id, destination,
+                {"started_at": started_at, "files": copied})
         return stat
 
+    def forget_copies(self, job_id):
+        """Delete the manifests of the delta copies of a job.
+
+        :param job_id: job id
+        """
+        self.copy_manifests.forget(job_id)
+
     def stop_container(self, container_id):
         try:
             # timeout - Seconds to wait for stop before killing it. Default: 10
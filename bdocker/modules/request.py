@@ -15,8 +15,10 @@
 # under the License.
 
 import json
+import socket
 
 import six
+from six.moves import http_client
 import six.moves.urllib.parse as urlparse
 import webob
 
@@ -61,6 +63,73 @@ def make_body(parameters):
     return json.dumps(body)
 
 
+def iter_lines(app_iter):
+    """Split the chunks of a response body in lines.
+
+    :param app_iter: iterable of byte chunks
+    :return: generator of lines
+    """
+    pending = b''
+    for chunk in app_iter:
+        pending += chunk
+        while b'\n' in pending:
+            line, pending = pending.split(b'\n', 1)
+            yield line
+    if pending:
+        yield pending
+
+
+def send_stream_request(environ, start_response):
+    """Send a request and return the response body as it is read.
+
+    webob.client reads the whole body before returning it, which
+    would hold the output of a streaming request until the end.
+
+    :param environ: WSGI environment of the request
+    :param start_response: WSGI start_response
+    """
+    if environ['wsgi.url_scheme'] == 'https':
+        conn_class = http_client.HTTPSConnection
+    else:
+        conn_class = http_client.HTTPConnection
+    conn = conn_class(environ['SERVER_NAME'], int(environ['SERVER_PORT']))
+    path = (urlparse.quote(environ.get('SCRIPT_NAME', '')) +
+            urlparse.quote(environ.get('PATH_INFO', '')))
+    if environ.get('QUERY_STRING'):
+        path += '?' + environ['QUERY_STRING']
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    body = environ['wsgi.input'].read(length) if length else None
+    headers = {}
+    if environ.get('CONTENT_TYPE'):
+        headers['Content-Type'] = environ['CONTENT_TYPE']
+    try:
+        conn.request(environ['REQUEST_METHOD'], path, body, headers)
+        res = conn.getresponse()
+    except (socket.error, http_client.HTTPException) as e:
+        conn.close()
+        resp = webob.exc.HTTPBadGateway("%s" % e)
+        return resp(environ, start_response)
+    start_response('%s %s' % (res.status, res.reason),
+                   [(k, v) for k, v in res.getheaders()
+                    if k.lower() != 'transfer-encoding'])
+    return _read_response(conn, res)
+
+
+def _read_response(conn, res):
+    try:
+        for line in iter(res.readline, b''):
+            yield line
+    finally:
+        conn.close()
+
+
+class StreamRequest(webob.Request):
+    """Request sent with send_stream_request by default."""
+
+    def make_default_send_app(self):
+        return send_stream_request
+
+
 class RequestController(object):
     resource = None
 
@@ -92,7 +161,8 @@ class RequestController(object):
     def _get_req(self, path, method,
                  content_type="application/json",
                  body=None,
-                 query_string=""):
+                 query_string="",
+                 request_class=webob.Request):
         """Return a new Request object to interact with Bdocker Server.
 
         :param path: new path for the request
@@ -101,11 +171,12 @@ class RequestController(object):
         :param body: new body for the request
         :param query_string: query string for the request, defaults to an empty
                              query if not specified
+        :param request_class: class of the request
         :returns: a Request object
         """
         server = self.endpoint
         environ = {}
-        new_req = webob.Request.blank(path=path,
+        new_req = request_class.blank(path=path,
                                       environ=environ,
                                       base_url=server)
         new_req.query_string = query_string
@@ -175,6 +246,54 @@ class RequestController(object):
         json_response = self._get_from_response(response)
         return json_response
 
+    def execute_stream(self, path, parameters, method="GET"):
+        """Execute a request with a streaming response.
+
+        The response body is newline-delimited JSON, which is
+        read while the server writes it.
+
+        :param path: path of the request
+        :param parameters: parameters to include in the request
+        :param method: GET, PUT or POST
+        :return: generator of the chunks of the response
+        """
+        try:
+            if method == "GET":
+                req = self._get_req(path, method=method,
+                                    query_string=get_query_string(
+                                        parameters),
+                                    request_class=StreamRequest)
+            else:
+                req = self._get_req(path, method=method,
+                                    body=make_body(parameters),
+                                    request_class=StreamRequest)
+            response = req.get_response()
+        except Exception as e:
+            response = webob.Response(status=500, body=str(e))
+        if response.status_int not in [200, 201, 202]:
+            raise exceptions.exception_from_response(response)
+        return self._read_stream(response)
+
+    @staticmethod
+    def _read_stream(response):
+        """Read the chunks of a streaming response.
+
+        :param response: response with newline-delimited JSON
+        """
+        try:
+            for line in iter_lines(response.app_iter):
+                if not line.strip():
+                    continue
+                entry = json.loads(line.decode('utf-8'))
+                if "error" in entry:
+                    raise exceptions.manage_http_exception(
+                        entry.get("status_code", 500), entry["error"])
+                yield entry["log"]
+        finally:
+            close = getattr(response.app_iter, "close", None)
+            if close:
+                close()
+
     def execute_put(self, path, parameters):
         """Execute PUT request.
 
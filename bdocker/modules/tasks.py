@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2016 LIP - INDIGO-DataCloud
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from bdocker import exceptions
+
+
+class PeriodicTask(threading.Thread):
+    """Background thread that runs a function periodically."""
+
+    def __init__(self, interval, function, *args, **kwargs):
+        """Initialize the task.
+
+        :param interval: seconds between executions
+        :param function: function to execute
+        :param args: positional arguments of the function
+        :param kwargs: keyword arguments of the function
+        """
+        super(PeriodicTask, self).__init__(name=function.__name__)
+        self.daemon = True
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self._stopped = threading.Event()
+
+    def run(self):
+        """Execute the function until the task is stopped.
+
+        Errors are logged, and they do not stop the task.
+        """
+        while not self._stopped.wait(self.interval):
+            try:
+                self.function(*self.args, **self.kwargs)
+            except Exception as e:
+                exceptions.make_log("exception",
+                                    "Task %s failed: %s" % (self.name, e))
+
+    def stop(self):
+        """Stop the task after the current execution.
+
+        """
+        self._stopped.set()
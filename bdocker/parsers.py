@@ -13,12 +13,17 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import codecs
+import collections
 import datetime
 import json
 import re
+import time
 
 from bdocker import exceptions
 
+PULL_PROGRESS_INTERVAL = 1.0
+
 
 def parse_docker_log(gen_data):
     """Parse log message from dockerpy.
@@ -32,30 +37,128 @@ def parse_docker_log(gen_data):
     return dict_data
 
 
+def stream_docker_log(gen_data):
+    """Decode log chunks from dockerpy as they arrive.
+
+    A character split between two chunks is kept until
+    the next one.
+
+    :param gen_data: generator within data
+    :return: generator of text chunks
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for chunk in gen_data:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    chunk = decoder.decode(b'', final=True)
+    if chunk:
+        yield chunk
+
+
+def _read_pull_rows(gen_data):
+    """Read the rows of a pull output from dockerpy.
+
+    :param gen_data: generator within data
+    :return: generator of (layer id, status, progress detail)
+    """
+    for row in gen_data:
+        try:
+            json_row = json.loads(row)
+        except ValueError:
+            raise exceptions.ParseException('Pull output error',
+                                            code=406)
+        error = json_row.get('error') or json_row.get('errorDetail')
+        if error:
+            if isinstance(error, dict):
+                error = error.get('message')
+            raise exceptions.DockerException(message=error, code=404)
+        if 'status' not in json_row:
+            raise exceptions.ParseException('Pull output error',
+                                            code=406)
+        yield (json_row.get('id'), json_row['status'],
+               json_row.get('progressDetail') or {})
+
+
+def _format_pull_status(layer_id, status, detail=None):
+    if layer_id is None:
+        return status
+    message = "%s: %s" % (layer_id, status)
+    if detail and detail.get('total'):
+        message = "%s %d%%" % (message,
+                               100 * detail.get('current', 0) //
+                               detail['total'])
+    return message
+
+
 def parse_docker_generator(gen_data):
     """Parse pull message form dockerpy.
 
+    The progress of each layer is coalesced in its last status,
+    so the summary has a line per layer instead of one per
+    progress event.
+
     :param gen_data: generator within data
-    :return:
+    :return: list of messages
     """
     out_data = []
-    try:
-        for row in gen_data:
-            json_row = json.loads(row)
-            if 'id' in json_row:
-                message = "%s: %s" % (
-                    json_row['id'],
-                    json_row['status']
-                )
-            elif 'status' in json_row:
-                message = json_row['status']
-            else:
-                message = json_row['error']
+    layers = {}
+    for layer_id, status, _detail in _read_pull_rows(gen_data):
+        message = _format_pull_status(layer_id, status)
+        if layer_id is None:
             out_data.append(message)
-        return out_data
-    except KeyError:
-        raise exceptions.ParseException('Pull output error',
-                                        code=406)
+        elif layer_id in layers:
+            out_data[layers[layer_id]] = message
+        else:
+            layers[layer_id] = len(out_data)
+            out_data.append(message)
+    return out_data
+
+
+def stream_docker_pull(gen_data, interval=PULL_PROGRESS_INTERVAL,
+                       clock=time.time):
+    """Coalesce the pull progress from dockerpy in snapshots.
+
+    Messages without a layer are sent as they arrive, after the
+    pending progress. The progress of the layers is sent every
+    interval seconds, with a line for each layer updated since
+    the last snapshot.
+
+    :param gen_data: generator within data
+    :param interval: seconds between progress snapshots
+    :param clock: function returning the current time
+    :return: generator of text chunks
+    """
+    pending = collections.OrderedDict()
+    last_sent = clock()
+    for layer_id, status, detail in _read_pull_rows(gen_data):
+        if layer_id is None:
+            # Flush the progress first, to keep the order of docker.
+            yield "".join("%s\n" % m for m in pending.values()) + (
+                "%s\n" % status)
+            pending.clear()
+            continue
+        pending[layer_id] = _format_pull_status(layer_id, status, detail)
+        now = clock()
+        if now - last_sent >= interval:
+            yield "".join("%s\n" % m for m in pending.values())
+            pending.clear()
+            last_sent = now
+    if pending:
+        yield "".join("%s\n" % m for m in pending.values())
+
+
+def format_transfer(size, elapsed):
+    """Format the progress of a copy.
+
+    :param size: bytes transferred
+    :param elapsed: seconds since the copy started
+    :return: text line
+    """
+    megabytes = size / (1024.0 * 1024)
+    return "Transferred %.1f MB in %.1fs (%.1f MB/s)\n" % (
+        megabytes, elapsed, megabytes / max(elapsed, 0.001))
 
 
 def parse_docker_generator1(gen_data, key='Status'):  # unused
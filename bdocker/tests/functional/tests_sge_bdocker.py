@@ -18,8 +18,6 @@ import copy
 import os
 import uuid
 
-from cgroupspy import nodes
-from cgroupspy import trees
 from click import testing
 import docker as docker_py
 import mock
@@ -29,6 +27,7 @@ import webob
 from bdocker.api import working_node
 from bdocker.client import cli
 from bdocker.modules import batch
+from bdocker.modules import cgroups_utils
 import bdocker.tests.fakes as fakes
 
 
@@ -42,6 +41,7 @@ class TestBdockerSgeWn(testtools.TestCase):
         self.token_store = copy.deepcopy(fakes.token_store)
         self.admin_token = self.token_store["admin"]["token"]
         self.app = working_node.app
+        working_node.server_holder.reset()
         self.runner = testing.CliRunner()
 
     @mock.patch("os.getenv")
@@ -145,7 +145,7 @@ class TestBdockerSgeWn(testtools.TestCase):
 
         def create_log():
             for l in logs:
-                yield(l)
+                yield("%s\n" % l)
         m_logs.return_value = create_log()
         orig = webob.Request.get_response
         app = self.app
@@ -283,7 +283,7 @@ class TestBdockerSgeWn(testtools.TestCase):
 
         def create_log():
             for l in logs:
-                yield(l)
+                yield("%s\n" % l)
         m_log.return_value = create_log()
 
         token = "--token=%s" % token
@@ -420,8 +420,8 @@ class TestBdockerSgeWn(testtools.TestCase):
     @mock.patch("bdocker.utils.write_yaml_file")
     @mock.patch("bdocker.utils.read_yaml_file")
     @mock.patch("bdocker.utils.read_file")
-    @mock.patch.object(nodes.Node, "create_cgroup")
-    @mock.patch.object(trees.GroupedTree, "get_node_by_path")
+    @mock.patch.object(cgroups_utils.CgroupManager, "create")
+    @mock.patch.object(cgroups_utils.CgroupManager, "parent_paths")
     @mock.patch("os.fork")
     @mock.patch("bdocker.utils.update_yaml_file")
     @mock.patch("os.setsid")
@@ -501,7 +501,7 @@ class TestBdockerSgeWn(testtools.TestCase):
     @mock.patch("os.getenv")
     @mock.patch.object(batch.SGEWNController, "get_job_info")
     @mock.patch("os.remove")
-    @mock.patch.object(nodes.Node, "delete_cgroup")
+    @mock.patch.object(cgroups_utils.CgroupManager, "delete")
     @mock.patch("bdocker.utils.read_file")
     @mock.patch("bdocker.utils.add_to_file")
     @mock.patch("bdocker.utils.delete_file")
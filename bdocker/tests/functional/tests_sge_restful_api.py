@@ -19,8 +19,6 @@ import json
 import os
 import uuid
 
-from cgroupspy import nodes
-from cgroupspy import trees
 import docker as docker_py
 import mock
 import testtools
@@ -28,6 +26,7 @@ import webob
 
 from bdocker.api import accounting
 from bdocker.api import working_node
+from bdocker.modules import cgroups_utils
 from bdocker.modules import request
 import bdocker.tests.fakes as fakes
 
@@ -53,6 +52,7 @@ class TestSgeRestApiAccounting(testtools.TestCase):
                     "spool": "/baa"}
             }}
         self.app = accounting.app
+        accounting.server_holder.reset()
 
     @mock.patch("bdocker.utils.add_to_file")
     def test_set_job(self, m_add):
@@ -92,14 +92,15 @@ class TestSgeRestApiWn(testtools.TestCase):
         self.token_store = copy.deepcopy(fakes.token_store)
         self.admin_token = self.token_store["admin"]["token"]
         self.app = working_node.app
+        working_node.server_holder.reset()
 
     @mock.patch("pwd.getpwuid")
     @mock.patch("os.path.realpath")
     @mock.patch("bdocker.utils.write_yaml_file")
     @mock.patch("bdocker.utils.read_yaml_file")
     @mock.patch("bdocker.utils.read_file")
-    @mock.patch.object(nodes.Node, "create_cgroup")
-    @mock.patch.object(trees.GroupedTree, "get_node_by_path")
+    @mock.patch.object(cgroups_utils.CgroupManager, "create")
+    @mock.patch.object(cgroups_utils.CgroupManager, "parent_paths")
     @mock.patch("os.fork")
     @mock.patch("bdocker.utils.update_yaml_file")
     @mock.patch("os.setsid")
@@ -168,8 +169,8 @@ class TestSgeRestApiWn(testtools.TestCase):
         self.assertIn(user_token_conf, self.token_store)
         self.assertEqual(2, m_kill.call_count)
 
-    @mock.patch.object(nodes.Node, "delete_cgroup")
-    @mock.patch.object(trees.GroupedTree, "get_node_by_path")
+    @mock.patch.object(cgroups_utils.CgroupManager, "delete")
+    @mock.patch.object(cgroups_utils.CgroupManager, "parent_paths")
     @mock.patch("bdocker.utils.read_file")
     @mock.patch("bdocker.utils.add_to_file")
     @mock.patch("bdocker.utils.delete_file")
@@ -184,10 +185,10 @@ class TestSgeRestApiWn(testtools.TestCase):
             {}, 204)
         m_rq.return_value.get_response.return_value = out
         m_r.return_value = "2222\n3333"
+        # The token store is not read again, since it did not change.
         m_ry.side_effect = [
-            fakes.token_store,
+            self.token_store,
             self.token_store[token]['job'],
-            self.token_store
         ]
         parameters = {"admin_token": fakes.admin_token,
                       "token": token}
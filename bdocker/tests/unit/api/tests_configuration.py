@@ -15,8 +15,12 @@
 # under the License.
 
 import copy
+import operator
 import os
+import shutil
+import tempfile
 
+import mock
 import testtools
 
 from bdocker import exceptions
@@ -50,6 +54,50 @@ class TestConfigurationWorkingNode(testtools.TestCase):
                           file_name
                           )
 
+    def test_load_config_file_typed(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 'fake_configure_file.cfg')
+        conf = utils.load_configuration_from_file(file_name)
+        self.assertEqual(5000, conf['server']['port'])
+        self.assertIs(True, conf.batch['only_docker_accounting'])
+        self.assertEqual("/foo", conf.credentials['token_store'])
+        self.assertEqual("working", conf.role)
+        self.assertEqual(file_name, conf.path)
+
+    def test_config_read_only(self):
+        file_name = os.path.join(os.path.dirname(__file__),
+                                 'fake_configure_file.cfg')
+        conf = utils.load_configuration_from_file(file_name)
+        self.assertRaises(TypeError, operator.setitem, conf['server'],
+                          'port', 1)
+        self.assertRaises(AttributeError, setattr, conf, 'server', {})
+        self.assertRaises(AttributeError, setattr, conf['server'],
+                          'port', 1)
+
+    def test_config_wrong_type(self):
+        conf = copy.deepcopy(fakes.conf_sge)
+        conf['server']['port'] = 'port'
+        self.assertRaises(ValueError, utils.Configuration, conf)
+
+    def test_load_config_file_cached(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        file_name = os.path.join(directory, 'bdocker.cfg')
+        shutil.copy(os.path.join(os.path.dirname(__file__),
+                                 'fake_configure_file.cfg'), file_name)
+        conf = utils.load_configuration_from_file(file_name)
+        with mock.patch("bdocker.utils.validate_config") as m_val:
+            self.assertIs(conf,
+                          utils.load_configuration_from_file(file_name))
+            self.assertFalse(m_val.called)
+        with open(file_name) as f:
+            data = f.read()
+        with open(file_name, 'w') as f:
+            f.write(data.replace("port = 5000", "port = 15000"))
+        new_conf = utils.load_configuration_from_file(file_name)
+        self.assertEqual(15000, new_conf['server']['port'])
+        self.assertEqual(5000, conf['server']['port'])
+
     def test_validation(self):
         out = utils.validate_config(fakes.conf_sge)
         self.assertIsNone(out)
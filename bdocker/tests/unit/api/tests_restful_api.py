@@ -14,16 +14,26 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
 import uuid
 
 import flask_testing as flask_tests
 import mock
+import testtools
 
+from bdocker import api
 from bdocker.api import accounting
 from bdocker.api import controller
 from bdocker.api import working_node
 from bdocker import exceptions
+from bdocker import middleware
 from bdocker.modules import request
+from bdocker import utils
 
 
 class TestConfiguration(object):
@@ -32,6 +42,229 @@ class TestConfiguration(object):
     HASH_ROUNDS = 1
 
 
+class TestServerControllerHolder(testtools.TestCase):
+    """Test the process-wide server controller."""
+
+    def setUp(self):
+        super(TestServerControllerHolder, self).setUp()
+        self.m_conf = mock.MagicMock()
+        self.m_class = mock.MagicMock()
+        self.holder = api.ServerControllerHolder(self.m_conf, self.m_class)
+
+    def test_built_once(self):
+        controller = self.holder.get_controller()
+        self.assertIs(controller, self.holder.get_controller())
+        self.assertIs(self.m_conf.return_value, self.holder.get_conf())
+        self.m_conf.assert_called_once_with()
+        self.m_class.assert_called_once_with(self.m_conf.return_value)
+
+    def test_reload(self):
+        self.m_class.side_effect = [mock.MagicMock(), mock.MagicMock()]
+        controller = self.holder.get_controller()
+        reloaded = self.holder.reload()
+        self.assertIsNot(controller, reloaded)
+        self.assertIs(reloaded, self.holder.get_controller())
+        self.assertEqual(2, self.m_conf.call_count)
+
+    def test_reset(self):
+        self.holder.get_controller()
+        self.holder.reset()
+        self.holder.get_controller()
+        self.assertEqual(2, self.m_class.call_count)
+
+    @mock.patch("os.getpid")
+    def test_built_again_after_fork(self, m_pid):
+        m_pid.return_value = 1
+        self.holder.get_controller()
+        self.holder.get_controller()
+        m_pid.return_value = 2
+        self.holder.get_controller()
+        self.assertEqual(2, self.m_class.call_count)
+
+    def test_handle_hup(self):
+        self.m_class.side_effect = [mock.MagicMock(), mock.MagicMock()]
+        controller = self.holder.get_controller()
+        self.holder.handle_hup(signal.SIGHUP, None).join()
+        self.assertIsNot(controller, self.holder.get_controller())
+
+    def test_handle_hup_wrong_configuration(self):
+        controller = self.holder.get_controller()
+        self.m_conf.side_effect = exceptions.ConfigurationException("")
+        self.holder.handle_hup(signal.SIGHUP, None).join()
+        self.assertIs(controller, self.holder.get_controller())
+
+    def test_post_fork(self):
+        m_init = mock.MagicMock()
+        holder = api.ServerControllerHolder(self.m_conf, self.m_class,
+                                            m_init)
+        holder.post_fork(None, None)
+        self.m_class.assert_called_once_with(self.m_conf.return_value)
+        m_init.assert_called_once_with()
+
+    @mock.patch("signal.signal")
+    def test_post_worker_init(self, m_signal):
+        self.holder.post_worker_init(None)
+        m_signal.assert_called_once_with(signal.SIGHUP,
+                                         self.holder.handle_hup)
+
+    def test_on_reload(self):
+        self.holder.get_controller()
+        self.holder.on_reload(None)
+        self.assertEqual(1, self.m_class.call_count)
+        self.holder.get_controller()
+        self.assertEqual(2, self.m_class.call_count)
+
+    def test_reload_arbiter(self):
+        m_arbiter = mock.MagicMock()
+        middleware.ReloadArbiter.handle_hup(m_arbiter)
+        m_arbiter.cfg.on_reload.assert_called_once_with(m_arbiter)
+        m_arbiter.kill_workers.assert_called_once_with(signal.SIGHUP)
+
+    def test_threads_share_controller(self):
+        controllers = []
+
+        def get_controller():
+            controllers.append(self.holder.get_controller())
+
+        threads = [threading.Thread(target=get_controller)
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.m_class.call_count)
+        self.assertEqual(8, controllers.count(self.m_class.return_value))
+
+
+class TestImageCollectorTask(testtools.TestCase):
+    """Test the background image collector of the working node."""
+
+    @mock.patch.object(working_node, "get_conf")
+    def test_disabled(self, m_conf):
+        m_conf.return_value = {"dockerAPI": {"base_url": "x"}}
+        self.assertIsNone(working_node.start_image_collector())
+        self.assertEqual([], working_node.collect_images())
+
+    @mock.patch.object(working_node, "get_conf")
+    def test_bad_policy(self, m_conf):
+        m_conf.return_value = {"dockerAPI": {"gc_budget": 10,
+                                             "gc_policy": "fifo"}}
+        self.assertRaises(exceptions.ConfigurationException,
+                          working_node.start_image_collector)
+
+    @mock.patch.object(working_node, "get_conf")
+    def test_bad_watermarks(self, m_conf):
+        m_conf.return_value = {"dockerAPI": {"gc_budget": 10,
+                                             "gc_high_watermark": 0.5,
+                                             "gc_low_watermark": 0.8}}
+        self.assertRaises(exceptions.ConfigurationException,
+                          working_node.start_image_collector)
+
+    @mock.patch.object(working_node, "get_server_controller")
+    @mock.patch.object(working_node, "get_conf")
+    def test_collect_images(self, m_conf, m_contr):
+        m_conf.return_value = {"dockerAPI": {"gc_budget": 10,
+                                             "gc_policy": "largest"}}
+        working_node.collect_images()
+        m_contr.return_value.collect_images.assert_called_once_with(
+            10 * 1024 * 1024,
+            working_node.DEFAULT_GC_HIGH_WATERMARK,
+            working_node.DEFAULT_GC_LOW_WATERMARK,
+            "largest")
+
+
+class TestLeader(testtools.TestCase):
+    """Test the election of the leader of the working node."""
+
+    def setUp(self):
+        super(TestLeader, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        patcher = mock.patch.dict(working_node._leader_locks, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(working_node, "get_conf")
+        self.m_conf = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.m_conf.return_value = {"credentials": {
+            "token_store": os.path.join(self.dir, "token_store.yml")}}
+
+    def test_leader(self):
+        self.assertTrue(working_node.is_leader())
+        self.assertTrue(working_node.is_leader())
+        self.assertTrue(os.path.exists(os.path.join(
+            self.dir, "token_store.yml" + working_node.LEADER_SUFFIX)))
+        working_node._leader_locks[os.getpid()].close()
+
+    @mock.patch("bdocker.utils.acquire_process_lock", return_value=None)
+    def test_not_leader(self, m_lock):
+        self.assertFalse(working_node.is_leader())
+        self.assertFalse(working_node.is_leader())
+        m_lock.assert_called_once_with(
+            os.path.join(self.dir, "token_store.yml.leader"))
+
+    @mock.patch.object(working_node, "start_background_tasks")
+    @mock.patch.object(working_node, "start_event_listener")
+    def test_init_worker_leader(self, m_listener, m_tasks):
+        working_node.init_worker()
+        self.assertTrue(m_listener.called)
+        m_tasks.assert_called_once_with()
+        working_node._leader_locks[os.getpid()].close()
+
+    @mock.patch("bdocker.utils.acquire_process_lock", return_value=None)
+    @mock.patch.object(working_node, "start_background_tasks")
+    @mock.patch.object(working_node, "start_event_listener")
+    def test_init_worker_not_leader(self, m_listener, m_tasks, m_lock):
+        working_node.init_worker()
+        self.assertTrue(m_listener.called)
+        self.assertFalse(m_tasks.called)
+
+    def test_lock_held_by_other_process(self):
+        path = os.path.join(self.dir, "leader")
+        lock_file = utils.acquire_process_lock(path)
+        self.addCleanup(lock_file.close)
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if utils.acquire_process_lock(path) is None else 1)
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+
+
+class TestEventListenerTask(testtools.TestCase):
+    """Test the docker events listener of the working node."""
+
+    @mock.patch.object(working_node, "get_server_controller")
+    @mock.patch.object(working_node, "get_conf")
+    def test_disabled(self, m_conf, m_contr):
+        m_conf.return_value = {"dockerAPI": {"watch_events": False}}
+        self.assertIsNone(working_node.start_event_listener())
+        self.assertFalse(m_contr.called)
+
+    @mock.patch.object(working_node, "is_leader", return_value=True)
+    @mock.patch.object(working_node, "get_server_controller")
+    @mock.patch.object(working_node, "get_conf")
+    def test_start(self, m_conf, m_contr, m_leader):
+        m_conf.return_value = {"dockerAPI": {}}
+        working_node.start_event_listener()
+        watch_events = m_contr.return_value.docker_module.watch_events
+        watch_events.assert_called_once_with(
+            on_die=working_node.container_died)
+
+    @mock.patch.object(working_node, "is_leader", return_value=False)
+    @mock.patch.object(working_node, "get_server_controller")
+    @mock.patch.object(working_node, "get_conf")
+    def test_start_not_leader(self, m_conf, m_contr, m_leader):
+        m_conf.return_value = {"dockerAPI": {}}
+        working_node.start_event_listener()
+        watch_events = m_contr.return_value.docker_module.watch_events
+        watch_events.assert_called_once_with(on_die=None)
+
+    @mock.patch.object(working_node, "get_server_controller")
+    def test_container_died(self, m_contr):
+        working_node.container_died("c1", {"status": "exited"})
+        m_contr.return_value.container_died.assert_called_once_with(
+            "c1", {"status": "exited"})
+
+
 class TestAccRESTAPI(flask_tests.TestCase):
     """Test REST request mapping."""
 
@@ -40,6 +273,7 @@ class TestAccRESTAPI(flask_tests.TestCase):
         return accounting.app
 
     def setUp(self):
+        accounting.server_holder.reset()
         with mock.patch.object(controller.AccountingServerController,
                                "__init__",
                                return_value=None):
@@ -97,6 +331,7 @@ class TestWorkingNodeRESTAPI(flask_tests.TestCase):
         return working_node.app
 
     def setUp(self):
+        working_node.server_holder.reset()
         with mock.patch.object(controller.ServerController,
                                "__init__",
                                return_value=None):
@@ -177,6 +412,40 @@ class TestWorkingNodeRESTAPI(flask_tests.TestCase):
                                       data=body)
         self.assertEqual(201, result.status_code)
 
+    @mock.patch.object(controller.ServerController, "pull")
+    def test_pull_stream(self, md):
+        md.return_value = iter([u"f1e4b055fb65: Downloading 50%\n"])
+        parameters = {"token": "tokennnnnn",
+                      "source": 'repoooo',
+                      "stream": True}
+        body = request.make_body(parameters)
+        with self.app_context:
+            result = self.client.post("/pull",
+                                      content_type="application/json",
+                                      data=body)
+        self.assertEqual(201, result.status_code)
+        self.assertEqual(api.STREAM_MIMETYPE, result.mimetype)
+        self.assertEqual({"log": u"f1e4b055fb65: Downloading 50%\n"},
+                         json.loads(result.data))
+
+    @mock.patch.object(controller.ServerController, "list_images")
+    def test_list_images(self, md):
+        images = [{"id": "sha256:aaa", "tags": ["ubuntu:16.04"]}]
+        md.return_value = images
+        query = request.get_query_string({"admin_token": "tokennnnnn"})
+        with self.app_context:
+            result = self.client.get("/images?%s" % query)
+        self.assertEqual(200, result.status_code)
+        self.assertEqual(images, result.json["results"])
+
+    @mock.patch.object(controller.ServerController, "list_images")
+    def test_list_images_401(self, md):
+        md.side_effect = exceptions.UserCredentialsException("")
+        query = request.get_query_string({"admin_token": "tokennnnnn"})
+        with self.app_context:
+            result = self.client.get("/images?%s" % query)
+        self.assertEqual(401, result.status_code)
+
     @mock.patch.object(controller.ServerController, "pull")
     def test_pull_405(self, m):
         parameters = {"token": "tokennnnnn",
@@ -342,6 +611,39 @@ class TestWorkingNodeRESTAPI(flask_tests.TestCase):
                                      )
         self.assertEqual(200, result.status_code)
 
+    @mock.patch.object(controller.ServerController, "logs")
+    def test_logs_stream(self, md):
+        md.return_value = iter([u"root\n", u"home\n"])
+        parameters = {"token": "tokennnnnn",
+                      "container_id": 'containerrrrr',
+                      "stream": True}
+        query = request.get_query_string(parameters)
+        with self.app_context:
+            result = self.client.get("/logs?%s" % query,
+                                     )
+        self.assertEqual(200, result.status_code)
+        self.assertEqual(api.STREAM_MIMETYPE, result.mimetype)
+        lines = [json.loads(line) for line in result.data.splitlines()]
+        self.assertEqual([{"log": u"root\n"}, {"log": u"home\n"}], lines)
+
+    @mock.patch.object(controller.ServerController, "logs")
+    def test_logs_stream_error(self, md):
+        def chunks():
+            yield u"root\n"
+            raise exceptions.DockerException(message="lost", code=404)
+        md.return_value = chunks()
+        parameters = {"token": "tokennnnnn",
+                      "container_id": 'containerrrrr',
+                      "stream": True}
+        query = request.get_query_string(parameters)
+        with self.app_context:
+            result = self.client.get("/logs?%s" % query,
+                                     )
+        lines = [json.loads(line) for line in result.data.splitlines()]
+        self.assertEqual({"log": u"root\n"}, lines[0])
+        self.assertEqual(404, lines[1]["status_code"])
+        self.assertIn("lost", lines[1]["error"])
+
     @mock.patch.object(controller.ServerController, "logs")
     def test_logs_401(self, m):
         m.side_effect = exceptions.UserCredentialsException("")
@@ -14,6 +14,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import time
 import uuid
 
 import mock
@@ -21,6 +22,7 @@ import testtools
 
 from bdocker.api import controller
 from bdocker import exceptions
+from bdocker.tests import fakes
 
 
 class TestAccountingServerController(testtools.TestCase):
@@ -53,10 +55,11 @@ class TestServerController(testtools.TestCase):
     def setUp(self):
         super(TestServerController, self).setUp()
 
+    @mock.patch("bdocker.utils.check_user_credentials")
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.modules.load_docker_module")
-    def test_configuration(self, m_dock, m_batch, m_cre):
+    def test_configuration(self, m_dock, m_batch, m_cre, m_check):
         token = uuid.uuid4().hex
         m_class_cre = mock.MagicMock()
         m_class_cre.authenticate.return_value = token
@@ -71,6 +74,155 @@ class TestServerController(testtools.TestCase):
         result = contr.configuration(data)
 
         self.assertEqual(token, result)
+        m_check.assert_called_once_with(data["user_credentials"])
+
+    @mock.patch("bdocker.utils.check_user_credentials")
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_configuration_out_of_transaction(self, m_dock, m_batch, m_cre,
+                                              m_check):
+        batch_info = {"cgroup": "/foo"}
+        m_class_cre = mock.MagicMock()
+        m_cre.return_value = m_class_cre
+        m_class_batch = mock.MagicMock()
+
+        def conf_environment(*args):
+            self.assertFalse(m_class_cre.transaction.called)
+            return batch_info
+
+        m_class_batch.conf_environment.side_effect = conf_environment
+        m_batch.return_value = m_class_batch
+        contr = controller.ServerController(None)
+        data = {"admin_token": uuid.uuid4().hex,
+                "user_credentials": {"job": {"id": uuid.uuid4().hex}}}
+        token = contr.configuration(data)
+
+        m_class_cre.authorize_admin.assert_called_once_with(
+            data["admin_token"])
+        m_class_cre.transaction.assert_called_once_with()
+        m_class_cre.set_token_batch_info.assert_called_once_with(
+            token, batch_info)
+
+    @mock.patch("bdocker.utils.check_user_credentials")
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_configuration_images(self, m_dock, m_batch, m_cre, m_check):
+        token = uuid.uuid4().hex
+        images = ["ubuntu:16.04", "centos"]
+        m_class_cre = mock.MagicMock()
+        m_class_cre.authenticate.return_value = token
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        data = {"admin_token": uuid.uuid4().hex,
+                "user_credentials": {"job": {
+                    "id": uuid.uuid4().hex,
+                    "spool": "/foo",
+                    "images": images
+                }}
+                }
+        result = contr.configuration(data)
+
+        self.assertEqual(token, result)
+        m_class_cre.add_image_name.assert_has_calls(
+            [mock.call(token, "ubuntu:16.04"), mock.call(token, "centos")])
+        self.assertFalse(m_class_cre.add_image.called)
+        m_class_dock.prefetch_images.assert_called_once_with(images)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_clean(self, m_dock, m_batch, m_cre):
+        token = uuid.uuid4().hex
+        admin_token = uuid.uuid4().hex
+        containers = [uuid.uuid4().hex]
+        token_info = {"job": {"job_id": "1"}, "containers": containers}
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_containers.return_value = containers
+        m_class_cre.get_token.return_value = token_info
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        m_class_batch = mock.MagicMock()
+        m_batch.return_value = m_class_batch
+        contr = controller.ServerController(None)
+        result = contr.clean({"admin_token": admin_token, "token": token})
+        self.assertEqual(token, result)
+        m_class_dock.clean_containers.assert_called_once_with(containers,
+                                                              True)
+        m_class_dock.clean_warm_pool.assert_called_once_with("1")
+        m_class_batch.clean_environment.assert_called_once_with(
+            token_info, admin_token)
+        m_class_cre.remove_token_from_cache.assert_called_once_with(token)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_sweep_sessions(self, m_dock, m_batch, m_cre):
+        containers = [uuid.uuid4().hex]
+        sessions = [
+            ("dead", {"job": {"spool": "/dead", "job_id": "1"},
+                      "containers": containers}),
+            ("alive", {"job": {"spool": "/alive"}}),
+            ("unknown", {"job": {"spool": "/unknown"}}),
+            ("recent", {"job": {"spool": "/dead"},
+                        "last_seen": time.time()}),
+            ("no_job", {"last_seen": 1}),
+        ]
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_sessions.return_value = sessions
+        m_cre.return_value = m_class_cre
+        m_class_batch = mock.MagicMock()
+        m_class_batch.is_job_alive.side_effect = (
+            lambda job: {"/alive": True, "/dead": False}.get(job["spool"]))
+        m_batch.return_value = m_class_batch
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        result = contr.sweep_sessions(60)
+        self.assertEqual(["dead", "no_job"], result)
+        m_class_dock.clean_containers.assert_called_once_with(containers,
+                                                              True)
+        m_class_dock.clean_warm_pool.assert_called_once_with("1")
+        m_class_cre.remove_tokens.assert_called_once_with(result)
+        self.assertTrue(m_class_cre.compact.called)
+        self.assertTrue(m_class_dock.prune_pull_cache.called)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_sweep_sessions_empty(self, m_dock, m_batch, m_cre):
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_sessions.return_value = []
+        m_cre.return_value = m_class_cre
+        contr = controller.ServerController(None)
+        self.assertEqual([], contr.sweep_sessions(60))
+        self.assertFalse(m_class_cre.remove_tokens.called)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_container_died(self, m_dock, m_batch, m_cre):
+        job = {"job_id": uuid.uuid4().hex, "acc_file": "/foo"}
+        state = {"status": "exited", "exit_code": 0}
+        m_class_cre = mock.MagicMock()
+        m_class_cre.get_container_token.side_effect = (
+            lambda c_id: "t2" if c_id == "c1" else None)
+        m_class_cre.get_token.return_value = {"job": job,
+                                              "containers": ["c1"]}
+        m_cre.return_value = m_class_cre
+        m_class_batch = mock.MagicMock()
+        m_batch.return_value = m_class_batch
+        contr = controller.ServerController(None)
+        contr.container_died("c1", state)
+        m_class_batch.record_container_accounting.assert_called_once_with(
+            job, "c1", state)
+        m_class_cre.get_token.assert_called_once_with("t2")
+        self.assertIsNone(contr.container_died("c3", state))
+        self.assertFalse(m_class_cre.list_sessions.called)
 
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
@@ -80,11 +232,16 @@ class TestServerController(testtools.TestCase):
         im_id = uuid.uuid4().hex
         m_class_dock.pull_image.return_value = im_id
         m_dock.return_value = m_class_dock
+        m_class_cre = mock.MagicMock()
+        m_cre.return_value = m_class_cre
         contr = controller.ServerController(None)
         parameters = {"token": "tokennnnnn",
                       "source": 'repoooo'}
         result = contr.pull(parameters)
         self.assertEqual(im_id, result)
+        m_class_cre.add_image_name.assert_called_once_with("tokennnnnn",
+                                                           'repoooo')
+        self.assertFalse(m_class_cre.add_image.called)
 
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
@@ -121,6 +278,44 @@ class TestServerController(testtools.TestCase):
         results = contr.list_containers(parameters)
         self.assertEqual(results.__len__(), info_containers.__len__())
 
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_list_job(self, m_dock, m_batch, m_cre):
+        containers = [uuid.uuid4().hex]
+        job_id = uuid.uuid4().hex
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_containers.return_value = containers
+        m_class_cre.get_token.return_value = {"job": {"job_id": job_id}}
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex, "all": True}
+        contr.list_containers(parameters)
+        m_class_dock.list_containers.assert_called_once_with(
+            containers, all=True, job_id=job_id)
+        m_class_cre.transaction.assert_called_once_with(
+            parameters["token"], read_only=True)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_list_no_job(self, m_dock, m_batch, m_cre):
+        containers = [uuid.uuid4().hex]
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_containers.return_value = containers
+        m_class_cre.get_token.return_value = {"uid": 1, "gid": 1}
+        m_class_cre.get_job_from_token.side_effect = (
+            exceptions.UserCredentialsException("Job not found"))
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        contr.list_containers({"token": uuid.uuid4().hex})
+        m_class_dock.list_containers.assert_called_once_with(
+            containers, all=None, job_id=None)
+
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.modules.load_docker_module")
@@ -199,6 +394,41 @@ class TestServerController(testtools.TestCase):
         results = contr.logs(parameters)
         self.assertEqual(info_containers, results)
 
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_logs_stream(self, m_dock, m_batch, m_cre):
+        c1 = uuid.uuid4().hex
+        m_class_cre = mock.MagicMock()
+        m_class_cre.authorize_container.return_value = c1
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex,
+                      "container_id": c1,
+                      "stream": "True",
+                      "follow": "True",
+                      "tail": "10",
+                      "since": "1458231723"}
+        contr.logs(parameters)
+        m_class_dock.logs_container.assert_called_once_with(
+            c1, stream=True, tail=10, since=1458231723, follow=True)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_logs_bad_tail(self, m_dock, m_batch, m_cre):
+        m_cre.return_value = mock.MagicMock()
+        m_dock.return_value = mock.MagicMock()
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex,
+                      "container_id": uuid.uuid4().hex,
+                      "tail": "last"}
+        self.assertRaises(exceptions.ParseException,
+                          contr.logs,
+                          parameters)
+
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.modules.load_docker_module")
@@ -223,6 +453,9 @@ class TestServerController(testtools.TestCase):
         m_class_cre = mock.MagicMock()
         m_class_cre.authorize_container.return_value = c1
         m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.side_effect = lambda ids, force: ids
+        m_dock.return_value = m_class_dock
         contr = controller.ServerController(None)
         parameters = {"token": uuid.uuid4().hex,
                       "container_id": c1}
@@ -237,6 +470,9 @@ class TestServerController(testtools.TestCase):
         m_class_cre = mock.MagicMock()
         m_class_cre.authorize_container.return_value = c1
         m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.side_effect = lambda ids, force: ids
+        m_dock.return_value = m_class_dock
         contr = controller.ServerController(None)
         force = True
         parameters = {"token": uuid.uuid4().hex,
@@ -245,7 +481,7 @@ class TestServerController(testtools.TestCase):
         results = contr.delete_container(parameters)
         self.assertEqual([c1], results)
         self.assertEqual(force, m_dock.mock_calls[1][1][1])
-        self.assertEqual(c1, m_dock.mock_calls[1][1][0])
+        self.assertEqual([c1], m_dock.mock_calls[1][1][0])
 
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
@@ -256,6 +492,9 @@ class TestServerController(testtools.TestCase):
         m_class_cre = mock.MagicMock()
         m_class_cre.authorize_container.side_effect = [c1, c2]
         m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.side_effect = lambda ids, force: ids
+        m_dock.return_value = m_class_dock
         contr = controller.ServerController(None)
         parameters = {"token": uuid.uuid4().hex,
                       "container_id": [c1, c2]}
@@ -271,6 +510,9 @@ class TestServerController(testtools.TestCase):
         m_class_cre = mock.MagicMock()
         m_class_cre.authorize_container.side_effect = expected
         m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.side_effect = lambda ids, force: ids
+        m_dock.return_value = m_class_dock
         contr = controller.ServerController(None)
         parameters = {"token": uuid.uuid4().hex,
                       "container_id": c1}
@@ -291,6 +533,9 @@ class TestServerController(testtools.TestCase):
         m_class_cre = mock.MagicMock()
         m_class_cre.authorize_container.side_effect = expected
         m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.side_effect = lambda ids, force: ids
+        m_dock.return_value = m_class_dock
         contr = controller.ServerController(None)
         parameters = {"token": uuid.uuid4().hex,
                       "container_id": [c1, c2, c3]}
@@ -299,6 +544,30 @@ class TestServerController(testtools.TestCase):
         self.assertIn("Exception", results[0])
         self.assertEqual(c2, results[1])
         self.assertEqual(c3, results[2])
+        m_class_cre.remove_container.assert_has_calls(
+            [mock.call(parameters["token"], c2),
+             mock.call(parameters["token"], c3)])
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_delete_several_docker_error(self, m_dock, m_batch, m_cre):
+        c1 = uuid.uuid4().hex
+        c2 = uuid.uuid4().hex
+        m_class_cre = mock.MagicMock()
+        m_class_cre.authorize_container.side_effect = [c1, c2]
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.clean_containers.return_value = [
+            "Error: Not Found", c2]
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex,
+                      "container_id": [c1, c2]}
+        results = contr.delete_container(parameters)
+        self.assertEqual(["Error: Not Found", c2], results)
+        m_class_cre.remove_container.assert_called_once_with(
+            parameters["token"], c2)
 
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
@@ -306,7 +575,8 @@ class TestServerController(testtools.TestCase):
     def test_run_full(self, m_dock, m_batch, m_cre):
         m_class_cre = mock.MagicMock()
         cgroup = uuid.uuid4().hex
-        expected_job = {"cgroup": cgroup}
+        job_id = uuid.uuid4().hex
+        expected_job = {"cgroup": cgroup, "job_id": job_id}
         m_class_cre.get_job_from_token.return_value = expected_job
         log_info = "logsssss"
         m_cre.return_value = m_class_cre
@@ -334,7 +604,10 @@ class TestServerController(testtools.TestCase):
                       }
         results = contr.run(parameters)
         self.assertEqual(log_info, results)
-        self.assertEqual((token, host_dir), m_cre.mock_calls[1][1])
+        m_class_cre.transaction.assert_called_once_with(token,
+                                                        read_only=True)
+        m_class_cre.authorize_directory.assert_called_once_with(token,
+                                                                host_dir)
         expected_run_call = (image_id,
                              detach,
                              script)
@@ -343,13 +616,15 @@ class TestServerController(testtools.TestCase):
             "host_dir": host_dir,
             "docker_dir": docker_dir,
             "working_dir": working_dir,
-            "cgroup": cgroup
+            "cgroup": cgroup,
+            "job_id": job_id
         }
         self.assertEqual(expected_run_call,
                          m_dock.mock_calls[1][1])
         self.assertEqual(expected_run_dict,
                          m_dock.mock_calls[1][2])
-        self.assertEqual((token, container_id), m_cre.mock_calls[3][1])
+        m_class_cre.add_container.assert_called_once_with(token,
+                                                          container_id)
         self.assertIn(container_id,
                       m_dock.mock_calls[2][1])
         self.assertIn(container_id,
@@ -534,6 +809,46 @@ class TestServerController(testtools.TestCase):
         self.assertIn('().copy_to_container', m_dock.mock_calls[1])
         self.assertEqual(info_containers, results)
 
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_copy_to_container_delta(self, m_dock, m_batch, m_cre):
+        c1 = uuid.uuid4().hex
+        m_class_cre = mock.MagicMock()
+        m_class_cre.get_job_from_token.return_value = fakes.job_info
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex,
+                      "container_id": c1,
+                      "container_path": "/foo",
+                      "host_path": "/foo",
+                      "host_to_container": True,
+                      "delta": True}
+        contr.copy(parameters)
+        m_class_dock.copy_to_container.assert_called_with(
+            c1, "/foo", "/foo", delta=True, job_id=fakes.job_id)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_copy_to_container_stream(self, m_dock, m_batch, m_cre):
+        c1 = uuid.uuid4().hex
+        m_class_dock = mock.MagicMock()
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        parameters = {"token": uuid.uuid4().hex,
+                      "container_id": c1,
+                      "container_path": "/foo",
+                      "host_path": "/foo",
+                      "host_to_container": True,
+                      "compression": "pgzip",
+                      "stream": True}
+        contr.copy(parameters)
+        m_class_dock.copy_to_container.assert_called_with(
+            c1, "/foo", "/foo", stream=True, compression="pgzip")
+
     @mock.patch("bdocker.modules.load_credentials_module")
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.modules.load_docker_module")
@@ -572,3 +887,53 @@ class TestServerController(testtools.TestCase):
         self.assertRaises(exceptions.UserCredentialsException,
                           contr.copy,
                           parameters)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_list_images(self, m_dock, m_batch, m_cre):
+        m_class_cre = mock.MagicMock()
+        m_cre.return_value = m_class_cre
+        images = [{"id": "sha256:aaa", "tags": ["ubuntu:16.04"]}]
+        m_class_dock = mock.MagicMock()
+        m_class_dock.list_images.return_value = images
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        admin_token = uuid.uuid4().hex
+        results = contr.list_images({"admin_token": admin_token})
+        self.assertEqual(images, results)
+        m_class_cre.authorize_admin.assert_called_once_with(admin_token)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_list_images_unauthorized(self, m_dock, m_batch, m_cre):
+        m_class_cre = mock.MagicMock()
+        m_class_cre.authorize_admin.side_effect = (
+            exceptions.UserCredentialsException(""))
+        m_cre.return_value = m_class_cre
+        contr = controller.ServerController(None)
+        self.assertRaises(exceptions.UserCredentialsException,
+                          contr.list_images,
+                          {"admin_token": uuid.uuid4().hex})
+        self.assertFalse(m_dock.return_value.list_images.called)
+
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_docker_module")
+    def test_collect_images(self, m_dock, m_batch, m_cre):
+        m_class_cre = mock.MagicMock()
+        m_class_cre.list_sessions.return_value = [
+            ("t1", {"images": ["sha256:bbb"],
+                    "image_names": ["ubuntu:16.04"]}),
+            ("t2", {"containers": ["c1"]})]
+        m_cre.return_value = m_class_cre
+        m_class_dock = mock.MagicMock()
+        m_class_dock.collect_images.return_value = ["sha256:aaa"]
+        m_dock.return_value = m_class_dock
+        contr = controller.ServerController(None)
+        removed = contr.collect_images(1000, 0.9, 0.7, 'largest')
+        self.assertEqual(["sha256:aaa"], removed)
+        m_class_dock.collect_images.assert_called_once_with(
+            1000, 0.9, 0.7, in_use={"sha256:bbb", "ubuntu:16.04"},
+            policy='largest')
@@ -23,6 +23,8 @@ import testtools
 from bdocker.client import cli
 from bdocker.client import commands
 from bdocker.client import decorators
+from bdocker.client import load_sensor
+from bdocker.client import token_store
 
 
 class TestCaseCommandLine(testtools.TestCase):
@@ -108,6 +110,21 @@ class TestCommandProject(TestCaseCommandLine):
         self.assertEqual(result.exit_code, 0)
         self.assertIsNone(result.exception)
 
+    @mock.patch.object(commands.CommandController, "__init__")
+    @mock.patch.object(commands.CommandController, "container_pull")
+    def test_docker_pull_progress(self, m_l, m_ini):
+        m_ini.return_value = None
+        m_l.return_value = iter([u"f1e4b055fb65: Downloading 50%\n",
+                                 u"f1e4b055fb65: Pull complete\n"])
+        source = uuid.uuid4().hex
+        result = self.runner.invoke(
+            cli.bdocker, ['pull', source]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(u"f1e4b055fb65: Downloading 50%\n"
+                         u"f1e4b055fb65: Pull complete\n", result.output)
+        m_l.assert_called_with(None, source, stream=True)
+
     @mock.patch.object(commands.CommandController, "__init__")
     @mock.patch.object(commands.CommandController, "container_pull")
     def test_docker_pull_no_token(self, m_l, m_ini):
@@ -145,6 +162,21 @@ class TestCommandProject(TestCaseCommandLine):
         self.assertEqual(result.exit_code, 0)
         self.assertIsNone(result.exception)
 
+    @mock.patch.object(commands.CommandController, "__init__")
+    @mock.patch.object(commands.CommandController, "container_logs")
+    def test_docker_log_follow(self, m_l, m_ini):
+        m_ini.return_value = None
+        m_l.return_value = iter([u"root\n", u"home\n"])
+        container_id = uuid.uuid4().hex
+        result = self.runner.invoke(
+            cli.bdocker, ['logs', '-f', '--tail=5', '--since=10',
+                          container_id]
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(u"root\nhome\n", result.output)
+        m_l.assert_called_with(None, container_id, stream=True,
+                               follow=True, tail=5, since=10)
+
     @mock.patch.object(commands.CommandController, "__init__")
     @mock.patch.object(commands.CommandController, "container_logs")
     def test_docker_log_no_token(self, m_l, m_ini):
@@ -407,6 +439,20 @@ class TestCommandProject(TestCaseCommandLine):
         self.assertEqual(0, result.exit_code)
         self.assertIsNone(result.exception)
 
+    @mock.patch.object(commands.CommandController, "__init__")
+    @mock.patch.object(commands.CommandController, "copy_to_from_container")
+    def test_docker_copy_compression(self, m_l, m_ini):
+        m_ini.return_value = None
+        m_l.return_value = iter(["Transferred 1.0 MB\n"])
+        container_id = uuid.uuid4().hex
+        result = self.runner.invoke(
+            cli.bdocker, ['cp', '--compression=pgzip', "/foo",
+                          "%s:/foo" % container_id]
+        )
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual("Transferred 1.0 MB\n", result.output)
+        self.assertTrue(m_l.call_args[1]["stream"])
+
     @mock.patch.object(commands.CommandController, "__init__")
     @mock.patch.object(commands.CommandController, "copy_to_from_container")
     def test_docker_copy_to_container(self, m_l, m_ini):
@@ -465,3 +511,72 @@ class TestCommandProject(TestCaseCommandLine):
     # clean
     # notify_accounting
     # more....
+
+
+class TestTokenStoreCommand(testtools.TestCase):
+
+    def setUp(self):
+        super(TestTokenStoreCommand, self).setUp()
+        self.runner = testing.CliRunner()
+
+    @mock.patch("bdocker.modules.credentials.migrate_token_store")
+    def test_migrate(self, m_migrate):
+        m_migrate.return_value = 3
+        with self.runner.isolated_filesystem():
+            open("token_store.yml", "w").close()
+            result = self.runner.invoke(token_store.token_store,
+                                        ["migrate", "token_store.yml",
+                                         "token_store.db", "--to",
+                                         "sqlite"])
+        self.assertEqual(0, result.exit_code)
+        m_migrate.assert_called_once_with("token_store.yml",
+                                          "token_store.db",
+                                          "yaml", "sqlite")
+        self.assertIn("3 records written", result.output)
+
+    def test_migrate_bad_format(self):
+        with self.runner.isolated_filesystem():
+            open("token_store.yml", "w").close()
+            result = self.runner.invoke(token_store.token_store,
+                                        ["migrate", "token_store.yml",
+                                         "token_store.db", "--to",
+                                         "xml"])
+        self.assertNotEqual(0, result.exit_code)
+
+
+class TestLoadSensorCommand(testtools.TestCase):
+
+    def setUp(self):
+        super(TestLoadSensorCommand, self).setUp()
+        self.runner = testing.CliRunner()
+
+    @mock.patch.object(commands.CommandController, "__init__")
+    @mock.patch.object(commands.CommandController, "list_node_images")
+    def test_load_sensor(self, m_list, m_ini):
+        m_ini.return_value = None
+        m_list.return_value = [{"id": "1", "tags": ["ubuntu:16.04"]}]
+        batch_module = mock.MagicMock()
+        batch_module.get_load_report.return_value = ["begin",
+                                                     "wn:images:x",
+                                                     "end"]
+        with mock.patch.object(commands.CommandController, "batch_module",
+                               batch_module, create=True):
+            result = self.runner.invoke(load_sensor.load_sensor,
+                                        input="\n\nquit\n")
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual("begin\nwn:images:x\nend\n" * 2, result.output)
+        batch_module.get_load_report.assert_called_with(
+            m_list.return_value)
+
+    @mock.patch.object(commands.CommandController, "__init__")
+    @mock.patch.object(commands.CommandController, "list_node_images")
+    def test_load_sensor_no_daemon(self, m_list, m_ini):
+        m_ini.return_value = None
+        m_list.side_effect = Exception("Connection refused")
+        batch_module = mock.MagicMock()
+        with mock.patch.object(commands.CommandController, "batch_module",
+                               batch_module, create=True):
+            result = self.runner.invoke(load_sensor.load_sensor,
+                                        input="\n")
+        self.assertEqual(0, result.exit_code)
+        batch_module.get_load_report.assert_called_once_with([])
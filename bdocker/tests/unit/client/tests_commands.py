@@ -101,6 +101,23 @@ class TestCommands(testtools.TestCase):
         m_del.assert_called_with(path='/clean',
                                  parameters=expected)
 
+    @mock.patch('bdocker.utils.load_configuration_from_file')
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.modules.load_credentials_module")
+    @mock.patch.object(request.RequestController, "execute_get")
+    def test_list_node_images(self, m_get, m_cre, m_batch, m_conf):
+        m_conf.return_value = fakes.conf_sge
+        m_class_cre = mock.MagicMock()
+        m_class_cre.get_admin_token.return_value = fakes.admin_token
+        m_cre.return_value = m_class_cre
+        m_get.return_value = [{"id": "1", "tags": ["ubuntu:16.04"]}]
+        controller = commands.CommandController()
+        result = controller.list_node_images()
+        self.assertEqual(m_get.return_value, result)
+        m_get.assert_called_with(path='/images',
+                                 parameters={"admin_token":
+                                             fakes.admin_token})
+
     @mock.patch('bdocker.utils.load_configuration_from_file')
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.modules.load_credentials_module")
@@ -182,6 +199,29 @@ class TestCommands(testtools.TestCase):
         m_post.assert_called_with(path='/pull',
                                   parameters=expected_param)
 
+    @mock.patch('bdocker.utils.load_configuration_from_file')
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.client.commands.token_parse")
+    @mock.patch.object(request.RequestController, "execute_stream")
+    def test_container_pull_stream(self, m_stream, m_token, m_batch,
+                                   m_conf):
+        m_token.return_value = fakes.user_token
+        m_conf.return_value = fakes.conf_sge
+        job_info = {'home': "/foo", 'job_id': uuid.uuid4().hex,
+                    'user_name': 'peter', 'spool': "/foo"}
+        m_class_batch = mock.MagicMock()
+        m_class_batch.get_job_info.return_value = job_info
+        m_batch.return_value = m_class_batch
+        source = uuid.uuid4().hex
+        controller = commands.CommandController()
+        controller.container_pull(None, source, stream=True)
+        expected_param = {"token": fakes.user_token,
+                          "source": source,
+                          "stream": True}
+        m_stream.assert_called_with(path='/pull',
+                                    parameters=expected_param,
+                                    method="POST")
+
     @mock.patch('bdocker.utils.load_configuration_from_file')
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.client.commands.token_parse")
@@ -205,6 +245,33 @@ class TestCommands(testtools.TestCase):
         results = controller.container_run(None, image_id, False, 'ls')
         self.assertEqual(expected, results)
 
+    @mock.patch('bdocker.utils.load_configuration_from_file')
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.client.commands.token_parse")
+    @mock.patch.object(request.RequestController, "execute_stream")
+    def test_container_run_stream(self, m_stream, m_token, m_batch, m_conf):
+        m_token.return_value = fakes.user_token
+        m_conf.return_value = fakes.conf_sge
+        job_info = {'home': "/foo", 'job_id': uuid.uuid4().hex,
+                    'user_name': 'peter', 'spool': "/foo"}
+        m_class_batch = mock.MagicMock()
+        m_class_batch.get_job_info.return_value = job_info
+        m_batch.return_value = m_class_batch
+        m_stream.return_value = iter(["root\n"])
+        controller = commands.CommandController()
+        image_id = uuid.uuid4().hex
+        results = controller.container_run(None, image_id, False, 'ls',
+                                           stream=True)
+        self.assertEqual(["root\n"], list(results))
+        expected = {"token": fakes.user_token,
+                    "image_id": image_id,
+                    "script": 'ls',
+                    "detach": False,
+                    "stream": True}
+        m_stream.assert_called_with(path='/run',
+                                    parameters=expected,
+                                    method="PUT")
+
     @mock.patch('bdocker.utils.load_configuration_from_file')
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.client.commands.token_parse")
@@ -312,6 +379,36 @@ class TestCommands(testtools.TestCase):
         m_put.assert_called_with(path='/copy',
                                  parameters=expected)
 
+    @mock.patch('bdocker.utils.load_configuration_from_file')
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.client.commands.token_parse")
+    @mock.patch.object(request.RequestController, "execute_stream")
+    def test_copy_to_container_stream(self, m_stream, m_token, m_batch,
+                                      m_conf):
+        m_token.return_value = fakes.user_token
+        m_conf.return_value = fakes.conf_sge
+        job_info = {'home': "/foo", 'job_id': uuid.uuid4().hex,
+                    'user_name': 'peter', 'spool': "/foo"}
+        m_class_batch = mock.MagicMock()
+        m_class_batch.get_job_info.return_value = job_info
+        m_batch.return_value = m_class_batch
+        controller = commands.CommandController()
+        container_id = uuid.uuid4().hex
+        controller.copy_to_from_container(fakes.user_token, container_id,
+                                          "/baa", "/foo", True,
+                                          compression="pgzip",
+                                          stream=True)
+        expected = {"token": fakes.user_token,
+                    "container_id": container_id,
+                    "container_path": "/baa",
+                    "host_path": "/foo",
+                    "host_to_container": True,
+                    "compression": "pgzip",
+                    "stream": True}
+        m_stream.assert_called_with(path='/copy',
+                                    parameters=expected,
+                                    method="PUT")
+
     @mock.patch('bdocker.utils.load_configuration_from_file')
     @mock.patch("bdocker.modules.load_batch_module")
     @mock.patch("bdocker.client.commands.token_parse")
@@ -414,3 +511,27 @@ class TestCommands(testtools.TestCase):
                     "container_id": container_id}
         m_get.assert_called_with(path='/logs',
                                  parameters=expected)
+
+    @mock.patch('bdocker.utils.load_configuration_from_file')
+    @mock.patch("bdocker.modules.load_batch_module")
+    @mock.patch("bdocker.client.commands.token_parse")
+    @mock.patch.object(request.RequestController, "execute_stream")
+    def test_logs_container_follow(self, m_stream, m_token, m_batch, m_conf):
+        m_token.return_value = fakes.user_token
+        m_conf.return_value = fakes.conf_sge
+        job_info = {'home': "/foo", 'job_id': uuid.uuid4().hex,
+                    'user_name': 'peter', 'spool': "/foo"}
+        m_class_batch = mock.MagicMock()
+        m_class_batch.get_job_info.return_value = job_info
+        m_batch.return_value = m_class_batch
+        controller = commands.CommandController()
+        container_id = uuid.uuid4().hex
+        controller.container_logs(None, container_id, stream=True,
+                                  follow=True, tail=10)
+        expected = {"token": fakes.user_token,
+                    "container_id": container_id,
+                    "tail": 10,
+                    "stream": True,
+                    "follow": True}
+        m_stream.assert_called_with(path='/logs',
+                                    parameters=expected)
@@ -14,6 +14,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import shutil
+import tempfile
 import uuid
 
 import mock
@@ -23,6 +26,7 @@ from bdocker import exceptions
 from bdocker.modules import batch
 from bdocker.modules import request
 from bdocker.tests import fakes
+from bdocker import utils
 
 
 class TestBacthNotificationController(testtools.TestCase):
@@ -79,6 +83,52 @@ class TestSGEAccController(testtools.TestCase):
 
 class TestWNController(testtools.TestCase):
 
+    @mock.patch("bdocker.modules.cgroups_utils.get_accounting")
+    def test_record_container_accounting(self, m_acc):
+        acc_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, acc_dir)
+        acc_path = os.path.join(acc_dir, "acc")
+        with open(acc_path, "w") as f:
+            f.write("job_id: '1'\ncontainers:\n  c1: {exit_code: 1}\n")
+        m_acc.return_value = {"memory_usage": "99", "cpu_usage": "111"}
+        conf = {"cgroups_dir": "/foo",
+                "enable_cgroups": True,
+                "parent_cgroup": "/bdocker.test",
+                "only_docker_accounting": False,
+                "accounting_endpoint": mock.MagicMock()
+                }
+        controller = batch.CgroupsWNController(conf)
+        out = controller.record_container_accounting(
+            {"job_id": "1", "acc_file": acc_path}, "c2",
+            {"status": "exited", "exit_code": 0, "finished_at": 33})
+        expected = {"exit_code": 0, "finished_at": 33,
+                    "cpu_usage": "111", "memory_usage": "99"}
+        self.assertEqual(expected, out)
+        acc = utils.read_yaml_file(acc_path)
+        self.assertEqual({"c1": {"exit_code": 1}, "c2": expected},
+                         acc["containers"])
+        self.assertEqual("111", acc["cpu_usage"])
+
+    def test_record_container_accounting_nocgroup(self):
+        conf = {"cgroups_dir": "/foo",
+                "enable_cgroups": False,
+                "parent_cgroup": "/bdocker.test",
+                "accounting_endpoint": mock.MagicMock()}
+        controller = batch.CgroupsWNController(conf)
+        self.assertIsNone(controller.record_container_accounting(
+            {"job_id": "1", "acc_file": "/foo"}, "c1", {}))
+
+    @mock.patch("bdocker.utils.update_yaml_file")
+    def test_record_container_accounting_no_acc_file(self, m_up):
+        conf = {"cgroups_dir": "/foo",
+                "enable_cgroups": True,
+                "parent_cgroup": "/bdocker.test",
+                "accounting_endpoint": mock.MagicMock()}
+        controller = batch.CgroupsWNController(conf)
+        self.assertIsNone(controller.record_container_accounting(
+            {"job_id": "1"}, "c1", {}))
+        self.assertFalse(m_up.called)
+
     @mock.patch("os.fork")
     @mock.patch("os.setsid")
     @mock.patch("time.sleep")
@@ -593,6 +643,29 @@ class TestSGEController(testtools.TestCase):
         out = batch.SGEWNController(conf).get_job_info()
         self.assertEqual(expected, out)
 
+    def test_get_job_images(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        with open(os.path.join(spool_dir, "environment"), "w") as f:
+            f.write("HOME=/home/rrr\n"
+                    "BDOCKER_IMAGES=ubuntu:16.04, centos\n")
+        with mock.patch.dict(os.environ, clear=False):
+            os.environ.pop(batch.JOB_IMAGES_VARIABLE, None)
+            out = batch.SGEWNController._get_job_images(spool_dir)
+        self.assertEqual(["ubuntu:16.04", "centos"], out)
+
+    def test_get_job_images_environ(self):
+        with mock.patch.dict(os.environ,
+                             {batch.JOB_IMAGES_VARIABLE: "busybox"}):
+            out = batch.SGEWNController._get_job_images("/foo")
+        self.assertEqual(["busybox"], out)
+
+    def test_get_job_images_none(self):
+        with mock.patch.dict(os.environ, clear=False):
+            os.environ.pop(batch.JOB_IMAGES_VARIABLE, None)
+            out = batch.SGEWNController._get_job_images("/foo")
+        self.assertEqual([], out)
+
     @mock.patch.object(batch.SGEWNController, "create_accounting_register")
     @mock.patch.object(batch.BatchNotificationController, "notify_accounting")
     def test_notify_accounting(self, m_ba_not, m_acc):
@@ -711,3 +784,63 @@ class TestSGEController(testtools.TestCase):
         self.assertEqual(account, info["account_name"])
         self.assertEqual(cpu_parsed, info["max_cpu"])
         self.assertEqual(max_mem, info["max_memory"])
+
+    @mock.patch("os.path.isdir")
+    def test_is_job_alive_spool(self, m_dir):
+        conf = {"enable_cgroups": True,
+                "accounting_endpoint": self.acc_conf}
+        controller = batch.SGEWNController(conf)
+        m_dir.side_effect = lambda path: path == "/spool"
+        job = {"spool": "/spool", "cgroup": "/user/1"}
+        self.assertTrue(controller.is_job_alive(job))
+
+    @mock.patch("os.path.isdir")
+    def test_is_job_alive_cgroup(self, m_dir):
+        conf = {"enable_cgroups": True,
+                "cgroups_dir": "/foo",
+                "accounting_endpoint": self.acc_conf}
+        controller = batch.SGEWNController(conf)
+        m_dir.side_effect = lambda path: path == "/foo/cpuacct/user/1"
+        job = {"spool": "/spool", "cgroup": "/user/1"}
+        self.assertTrue(controller.is_job_alive(job))
+
+    @mock.patch("os.path.isdir")
+    def test_is_job_alive_finished(self, m_dir):
+        conf = {"enable_cgroups": True,
+                "accounting_endpoint": self.acc_conf}
+        controller = batch.SGEWNController(conf)
+        m_dir.return_value = False
+        self.assertFalse(controller.is_job_alive(
+            {"spool": "/spool", "cgroup": "/user/1"}))
+        self.assertFalse(controller.is_job_alive({"id": "1"}))
+
+    @mock.patch("os.path.isdir")
+    def test_is_job_alive_nocgroup(self, m_dir):
+        conf = {"enable_cgroups": False,
+                "accounting_endpoint": self.acc_conf}
+        controller = batch.SGEWNController(conf)
+        m_dir.return_value = False
+        self.assertIsNone(controller.is_job_alive({"cgroup": "/user/1"}))
+        self.assertFalse(controller.is_job_alive(
+            {"spool": "/spool", "cgroup": "/user/1"}))
+        self.assertIsNone(controller.is_job_alive({"id": "1"}))
+
+    def test_get_load_report(self):
+        conf = {"accounting_endpoint": self.acc_conf}
+        controller = batch.SGEWNController(conf)
+        images = [{"id": "1", "tags": ["ubuntu:16.04", "ubuntu:latest"]},
+                  {"id": "2", "tags": []},
+                  {"id": "3", "tags": ["busybox:latest"]}]
+        report = controller.get_load_report(images, "wn01")
+        self.assertEqual(
+            ["begin",
+             "wn01:bdocker_images:busybox:latest,ubuntu:16.04,ubuntu:latest",
+             "end"],
+            report)
+
+    def test_get_load_report_empty(self):
+        conf = {"accounting_endpoint": self.acc_conf,
+                "images_complex": "images"}
+        controller = batch.SGEWNController(conf)
+        report = controller.get_load_report([], "wn01")
+        self.assertEqual("wn01:images:none", report[1])
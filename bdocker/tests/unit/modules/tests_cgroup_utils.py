@@ -14,6 +14,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import shutil
+import tempfile
 import uuid
 
 import cgroupspy
@@ -30,130 +33,112 @@ class TestCgroups(testtools.TestCase):
         super(TestCgroups, self).setUp()
         self.parent_path = "/systemd/user/"
 
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "get_node_by_path")
-    @mock.patch.object(cgroupspy.nodes.Node, "create_cgroup")
+    def _make_root(self, hierarchies):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        mountinfo = os.path.join(root, "mountinfo")
+        with open(mountinfo, "w") as f:
+            f.write("32 28 0:28 / %s rw - tmpfs tmpfs rw\n" % root)
+            for n, name in enumerate(hierarchies):
+                os.makedirs(os.path.join(root, name,
+                                         self.parent_path.strip('/')))
+                f.write("%d 32 0:%d / %s/%s rw shared:9 - cgroup cgroup"
+                        " rw,%s\n" % (33 + n, 29 + n, root, name, name))
+        self.addCleanup(cgroups_utils._managers.clear)
+        manager = cgroups_utils.CgroupManager(root, mountinfo=mountinfo)
+        cgroups_utils._managers[root] = manager
+        return root
+
     @mock.patch("bdocker.modules.cgroups_utils.task_to_cgroup")
-    def test_create_tree_cgroup(self, m_add, m_cre, m_path, m_tree):
-        gnodes = cgroupspy.nodes.NodeControlGroup("na")
-        gnodes.nodes = [cgroupspy.nodes.Node]
-        m_path.side_effect = [gnodes]
-        m_tree.return_value = None
+    def test_create_tree_cgroup(self, m_add):
+        root = self._make_root(["memory"])
         out = cgroups_utils.create_tree_cgroups(
             "66",
             self.parent_path,
-            pid='19858'
+            pid='19858',
+            root_parent=root
         )
         self.assertIsNone(out)
-        self.assertEqual(
-            self.parent_path,
-            m_path.call_args_list[0][0][0]
-        )
-        self.assertEqual(1, m_add.call_count)
+        group_path = os.path.join(root, "memory/systemd/user/66")
+        self.assertTrue(os.path.isdir(group_path))
+        m_add.assert_called_once_with(group_path, '19858')
 
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "get_node_by_path")
-    @mock.patch.object(cgroupspy.nodes.Node, "create_cgroup")
     @mock.patch("bdocker.modules.cgroups_utils.task_to_cgroup")
-    def test_create_tree_cgroup_several(self, m_add, m_cre, m_path, m_tree):
-        gnodes = cgroupspy.nodes.NodeControlGroup("na")
-        gnodes.nodes = [cgroupspy.nodes.Node,
-                        cgroupspy.nodes.Node
-                        ]
-        m_path.side_effect = [gnodes]
-        m_tree.return_value = None
+    def test_create_tree_cgroup_several(self, m_add):
+        root = self._make_root(["memory", "cpuacct"])
+        os.symlink(os.path.join(root, "cpuacct"), os.path.join(root, "cpu"))
         out = cgroups_utils.create_tree_cgroups(
             "66",
             self.parent_path,
-            pid='19858'
+            pid='19858',
+            root_parent=root
         )
         self.assertIsNone(out)
-        self.assertEqual(
-            self.parent_path,
-            m_path.call_args_list[0][0][0]
-        )
         self.assertEqual(2, m_add.call_count)
+        self.assertTrue(os.path.isdir(
+            os.path.join(root, "cpuacct/systemd/user/66")))
 
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "get_node_by_path")
-    @mock.patch.object(cgroupspy.nodes.Node, "create_cgroup")
-    @mock.patch("bdocker.modules.cgroups_utils.task_to_cgroup")
-    def test_create_tree_cgroup_exception(self, m_add, m_cre, m_path, m_tree):
-        gnodes = cgroupspy.nodes.NodeControlGroup("na")
-        gnodes.nodes = [cgroupspy.nodes.Node]
-        m_path.side_effect = [gnodes,
-                              ]
-        m_cre.side_effect = OSError(13, "err", "file")
-        m_tree.return_value = None
+    def test_create_tree_cgroup_no_mounts(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.addCleanup(cgroups_utils._managers.clear)
+        os.makedirs(os.path.join(root, "cpu", "user"))
+        os.makedirs(os.path.join(root, "memory"))
+        manager = cgroups_utils.CgroupManager(root, mountinfo="/not/found")
+        manager.create("66", "/user")
+        self.assertTrue(os.path.isdir(os.path.join(root, "cpu/user/66")))
+        self.assertFalse(os.path.exists(os.path.join(root, "memory/user")))
+
+    def test_create_tree_cgroup_exception(self):
+        root = self._make_root(["memory"])
         self.assertRaises(bdocker_exceptions.CgroupException,
                           cgroups_utils.create_tree_cgroups,
                           "66",
-                          self.parent_path,
+                          "/not/found",
                           pid='19858',
+                          root_parent=root
                           )
 
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
-    @mock.patch.object(cgroupspy.trees.GroupedTree,
-                       "get_node_by_path")
-    @mock.patch.object(cgroupspy.nodes.Node, "delete_cgroup")
     @mock.patch("bdocker.modules.cgroups_utils.task_to_cgroup")
-    @mock.patch("bdocker.utils.read_file")
-    def test_delete_tree_cgroup(self, m_rad, m_task, m_del, m_path, m_tree):
-        gnodes = cgroupspy.nodes.NodeControlGroup("na")
-        parent_node = cgroupspy.nodes.Node("parent")
-        gnodes.nodes = [cgroupspy.nodes.Node("",
-                                             parent=parent_node)]
-        m_path.side_effect = [gnodes]
-        m_tree.return_value = None
+    def test_delete_tree_cgroup(self, m_task):
+        root = self._make_root(["memory", "cpuacct"])
         name = uuid.uuid4().hex
-        out = cgroups_utils.delete_tree_cgroups(
-            name,
-            self.parent_path
-        )
+        for hierarchy in ("memory", "cpuacct"):
+            group_path = os.path.join(root, hierarchy, "systemd/user", name)
+            os.mkdir(group_path)
+        with mock.patch("bdocker.utils.read_file",
+                        return_value="12\n"), mock.patch("os.rmdir") as m_rm:
+            out = cgroups_utils.delete_tree_cgroups(
+                name,
+                self.parent_path,
+                root_parent=root
+            )
         self.assertIsNone(out)
-        self.assertEqual(1, m_del.call_count)
-        self.assertEqual(
-            name,
-            m_del.call_args_list[0][0][0]
-        )
-        self.assertEqual(1, m_path.call_count)
-        self.assertEqual(
-            self.parent_path,
-            m_path.call_args_list[0][0][0]
-        )
+        self.assertEqual(2, m_rm.call_count)
+        m_task.assert_any_call(os.path.join(root, "memory/systemd/user"),
+                               "12")
 
-    @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
-    @mock.patch.object(cgroupspy.trees.GroupedTree,
-                       "get_node_by_path")
-    @mock.patch.object(cgroupspy.nodes.Node, "delete_cgroup")
     @mock.patch("bdocker.modules.cgroups_utils.task_to_cgroup")
-    @mock.patch("bdocker.utils.read_file")
-    def test_delete_tree_cgroup_several_nodes(self, m_rad,
-                                              m_task, m_del, m_path,
-                                              m_tree):
-        gnodes = cgroupspy.nodes.NodeControlGroup("na")
-        parent_node = cgroupspy.nodes.Node("parent")
-        gnodes.nodes = [cgroupspy.nodes.Node("", parent=parent_node),
-                        cgroupspy.nodes.Node("", parent=parent_node)]
-        m_path.side_effect = [gnodes,
-                              ]
-        m_tree.return_value = None
-        name = uuid.uuid4().hex
+    def test_delete_tree_cgroup_not_found(self, m_task):
+        root = self._make_root(["memory"])
         out = cgroups_utils.delete_tree_cgroups(
-            name,
-            self.parent_path
-        )
-        self.assertIsNone(out)
-        self.assertEqual(2, m_del.call_count)
-        self.assertEqual(
-            name,
-            m_del.call_args_list[0][0][0]
-        )
-        self.assertEqual(1, m_path.call_count)
-        self.assertEqual(
+            uuid.uuid4().hex,
             self.parent_path,
-            m_path.call_args_list[0][0][0]
+            root_parent=root
         )
+        self.assertIsNone(out)
+        self.assertFalse(m_task.called)
+
+    def test_hierarchies_resolved_once(self):
+        root = self._make_root(["memory"])
+        manager = cgroups_utils.get_manager(root)
+        with mock.patch.object(manager, "_read_mounts",
+                               wraps=manager._read_mounts) as m_read:
+            manager.parent_paths(self.parent_path)
+            manager.parent_paths(self.parent_path)
+        self.assertEqual(1, m_read.call_count)
+        self.assertEqual([os.path.join(root, "memory")],
+                         manager.hierarchies)
 
     @mock.patch.object(cgroupspy.trees.GroupedTree, "__init__")
     @mock.patch.object(cgroupspy.trees.Tree, "get_node_by_path")
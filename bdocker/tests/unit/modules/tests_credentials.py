@@ -15,14 +15,52 @@
 # under the License.
 
 import copy
+import os
+import shutil
+import tempfile
+import threading
 import uuid
 
 import mock
 import testtools
 
 from bdocker import exceptions
+from bdocker import modules
 from bdocker.modules import credentials
 from bdocker.tests import fakes
+from bdocker import utils
+
+
+def add_containers_concurrently(control, other, token):
+    """Add a container from other controller while control adds one.
+
+    The other controller writes after control has read the record
+    and before control stores it.
+    """
+    writer = threading.Thread(target=other.add_container,
+                              args=(token, "c_2"))
+    update_token = control._update_token
+
+    def interleave(*args):
+        writer.start()
+        writer.join(0.5)
+        update_token(*args)
+
+    with mock.patch.object(control, "_update_token",
+                           side_effect=interleave):
+        control.add_container(token, "c_1")
+    writer.join()
+
+
+def add_container_in_transaction(control, other, token):
+    """Add a container from other controller during a transaction."""
+    writer = threading.Thread(target=other.add_container,
+                              args=(token, "c_2"))
+    with control.transaction(token):
+        writer.start()
+        writer.join(0.5)
+        control.add_container(token, "c_1")
+    writer.join()
 
 
 class TestUserCredentials(testtools.TestCase):
@@ -30,6 +68,11 @@ class TestUserCredentials(testtools.TestCase):
 
     def setUp(self):
         super(TestUserCredentials, self).setUp()
+        for target, value in (("bdocker.utils.get_file_signature", None),
+                              ("bdocker.utils.file_lock", mock.DEFAULT)):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
         self.token_store = copy.deepcopy(fakes.token_store)
         with mock.patch("bdocker.utils.read_yaml_file",
                         return_value=self.token_store):
@@ -97,6 +140,8 @@ class TestUserCredentials(testtools.TestCase):
         u.update({'job': {'job_id': jobid,
                           'spool': spool}
                   })
+        # The token store file was changed by other process.
+        self.control._signature = "outdated"
         with mock.patch("bdocker.utils.read_yaml_file",
                         return_value=self.token_store) as m_r:
             with mock.patch("bdocker.utils.write_yaml_file"
@@ -144,6 +189,40 @@ class TestUserCredentials(testtools.TestCase):
         self.assertRaises(exceptions.UserCredentialsException,
                           self.control.authorize_container, t, c)
 
+    def test_authorize_container_short_id(self):
+        t = fakes.user_token
+        c = fakes.containers[1]
+        ath = self.control.authorize_container(
+            token=t,
+            container_id=c[:12])
+        self.assertEqual(c, ath)
+
+    def test_authorize_container_ambiguous(self):
+        token = fakes.user_token_no_container
+        with mock.patch("bdocker.utils.read_yaml_file",
+                        return_value=self.token_store):
+            with mock.patch("bdocker.utils.write_yaml_file"):
+                self.control.add_container(token, "abc1")
+                self.control.add_container(token, "abc2")
+                self.control.add_container(token, "abc")
+        self.assertEqual("abc1",
+                         self.control.authorize_container(token, "abc1"))
+        self.assertEqual("abc",
+                         self.control.authorize_container(token, "abc"))
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.authorize_container, token, "ab")
+
+    def test_authorize_container_after_remove(self):
+        token = fakes.user_token_no_container
+        with mock.patch("bdocker.utils.read_yaml_file",
+                        return_value=self.token_store):
+            with mock.patch("bdocker.utils.write_yaml_file"):
+                self.control.add_container(token, "abc1")
+                self.control.add_container(token, "abc2")
+                self.control.remove_container(token, "abc2")
+        self.assertEqual("abc1",
+                         self.control.authorize_container(token, "ab"))
+
     def test_add_container(self):
         token = fakes.user_token
         c_id = uuid.uuid4().hex
@@ -203,6 +282,20 @@ class TestUserCredentials(testtools.TestCase):
                 self.assertEqual(1,
                                  token_info['images'].__len__())
 
+    def test_add_image_name(self):
+        token = fakes.user_token_no_images
+        with mock.patch("bdocker.utils.read_yaml_file",
+                        return_value=self.token_store):
+            with mock.patch("bdocker.utils.write_yaml_file"):
+                self.control.add_image_name(token, "ubuntu:16.04")
+                self.control.add_image_name(token, "ubuntu:16.04")
+        token_info = self.control._get_token_from_cache(token)
+        self.assertEqual(["ubuntu:16.04"], token_info["image_names"])
+        self.assertNotIn("images", token_info)
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.authorize_image, token,
+                          "ubuntu:16.04")
+
     def test_remove_image(self):
         token = fakes.user_token
         c_id = fakes.images[0]
@@ -286,6 +379,8 @@ class TestUserCredentials(testtools.TestCase):
         token_info = self.control._get_token_from_cache(token)
         home = uuid.uuid4().hex
         token_info["home"] = home
+        # The token store file was changed by other process.
+        self.control._signature = "outdated"
         with mock.patch("bdocker.utils.read_yaml_file",
                         return_value=self.token_store) as m_r:
             with mock.patch("bdocker.utils.write_yaml_file"
@@ -313,6 +408,8 @@ class TestUserCredentials(testtools.TestCase):
                           "cgroup": cgroup,
                           "spool": spool}
                       }
+        # The token store file was changed by other process.
+        self.control._signature = "outdated"
         with mock.patch("bdocker.utils.read_yaml_file",
                         return_value=self.token_store) as m_r:
             with mock.patch("bdocker.utils.write_yaml_file"
@@ -379,3 +476,541 @@ class TestUserCredentials(testtools.TestCase):
         job.update(accounting)
         token_2 = self.control.update_job(token, job)
         self.assertEqual(accounting["cpu"], token_2['job']["cpu"])
+
+
+class TestTokenControllerFile(testtools.TestCase):
+    """Test Token controller shared by several processes."""
+
+    def setUp(self):
+        super(TestTokenControllerFile, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "token_store.yml")
+        utils.write_yaml_file(self.path, fakes.token_store)
+        self.control = credentials.TokenController(self.path)
+
+    def test_no_reload_if_unchanged(self):
+        with mock.patch("bdocker.utils.read_yaml_file") as m_r:
+            self.control.get_token(fakes.user_token)
+            self.control.authorize_admin(fakes.admin_token)
+        self.assertFalse(m_r.called)
+
+    def test_reload_changes_from_other_process(self):
+        other = credentials.TokenController(self.path)
+        c_id = uuid.uuid4().hex
+        other.add_container(fakes.user_token_no_container, c_id)
+        self.assertEqual([c_id], self.control.list_containers(
+            fakes.user_token_no_container))
+
+    def test_concurrent_writers_keep_changes(self):
+        other = credentials.TokenController(self.path)
+        self.control.add_image(fakes.user_token_no_images, "image")
+        other.add_container(fakes.user_token_no_container, "c_id")
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(["image"],
+                         store[fakes.user_token_no_images]["images"])
+        self.assertEqual(["c_id"],
+                         store[fakes.user_token_no_container]["containers"])
+
+    def test_concurrent_writers_same_token(self):
+        token = fakes.user_token_no_container
+        other = credentials.TokenController(self.path)
+        add_containers_concurrently(self.control, other, token)
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(["c_1", "c_2"],
+                         sorted(store[token]["containers"]))
+
+    def test_concurrent_writer_during_transaction(self):
+        token = fakes.user_token_no_container
+        other = credentials.TokenController(self.path)
+        add_container_in_transaction(self.control, other, token)
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(["c_1", "c_2"],
+                         sorted(store[token]["containers"]))
+
+    def test_write_parses_once(self):
+        token = fakes.user_token_no_container
+        other = credentials.TokenController(self.path)
+        other.add_image(fakes.user_token_no_images, "image")
+        with mock.patch("bdocker.utils.read_yaml_file",
+                        wraps=utils.read_yaml_file) as m_r:
+            self.control.add_container(token, "c_1")
+            self.assertEqual(1, m_r.call_count)
+            self.control.add_container(token, "c_2")
+            self.assertEqual(1, m_r.call_count)
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(["c_1", "c_2"], store[token]["containers"])
+        self.assertEqual(["image"],
+                         store[fakes.user_token_no_images]["images"])
+
+    def test_get_container_token(self):
+        token = fakes.user_token_no_container
+        c_id = uuid.uuid4().hex
+        other = credentials.TokenController(self.path)
+        other.add_container(token, c_id)
+        self.assertEqual(token, self.control.get_container_token(c_id))
+        self.assertIsNone(self.control.get_container_token("c_none"))
+
+    def test_remove_token_of_other_process(self):
+        other = credentials.TokenController(self.path)
+        token = other._set_token({"uid": 1, "gid": 1, "home": "/home"})
+        self.control.remove_token_from_cache(token)
+        self.assertNotIn(token, utils.read_yaml_file(self.path))
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.remove_token_from_cache, token)
+
+        token = self.control._set_token({"uid": 1, "gid": 1,
+                                         "home": "/home"})
+        token_info = utils.read_yaml_file(self.path)[token]
+        self.assertIn("created", token_info)
+        self.assertEqual(token_info["created"], token_info["last_seen"])
+
+    def test_list_sessions(self):
+        sessions = dict(self.control.list_sessions())
+        self.assertNotIn("admin", sessions)
+        self.assertEqual(fakes.token_store[fakes.user_token],
+                         sessions[fakes.user_token])
+
+    def test_remove_tokens(self):
+        tokens = [fakes.user_token, fakes.user_token_clean]
+        self.control.remove_tokens(tokens)
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(len(fakes.token_store) - 2, len(store))
+        self.assertIn("admin", store)
+
+    def test_write_holds_lock(self):
+        with mock.patch("bdocker.utils.file_lock") as m_lock:
+            self.control.add_image(fakes.user_token_no_images, "image")
+        m_lock.assert_called_once_with(self.control.lock_path,
+                                       shared=False)
+
+    @mock.patch('bdocker.utils.check_user_credentials')
+    def test_transaction_writes_once(self, m):
+        u = fakes.create_usercrentials()['user_credentials']
+        u['job'] = {'job_id': uuid.uuid4().hex, 'spool': "/spool"}
+        with mock.patch("bdocker.utils.write_yaml_file",
+                        wraps=utils.write_yaml_file) as m_w:
+            with self.control.transaction():
+                token = self.control.authenticate(fakes.admin_token, u)
+                self.control.set_token_batch_info(token, {"cgroup": "/c"})
+                self.control.add_container(token, "c1")
+                self.assertEqual(["c1"],
+                                 self.control.list_containers(token))
+                self.assertFalse(m_w.called)
+        self.assertEqual(1, m_w.call_count)
+        token_info = utils.read_yaml_file(self.path)[token]
+        self.assertEqual("/c", token_info["job"]["cgroup"])
+        self.assertEqual(["c1"], token_info["containers"])
+        self.assertIn("last_seen", token_info)
+
+    def test_transaction_yields_record(self):
+        token = fakes.user_token_no_images
+        with self.control.transaction(token) as token_info:
+            token_info["images"] = ["image"]
+            self.assertTrue(self.control.authorize_image(token, "image"))
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(["image"], store[token]["images"])
+
+    def test_transaction_no_changes(self):
+        with mock.patch("bdocker.utils.write_yaml_file") as m_w:
+            with self.control.transaction(fakes.user_token):
+                self.control.get_job_from_token(fakes.user_token)
+        self.assertFalse(m_w.called)
+
+    def test_transaction_read_only(self):
+        with mock.patch("bdocker.utils.read_yaml_file") as m_r:
+            with mock.patch("bdocker.utils.file_lock") as m_lock:
+                with self.control.transaction(fakes.user_token,
+                                              read_only=True):
+                    self.control.get_job_from_token(fakes.user_token)
+        m_lock.assert_called_once_with(self.control.lock_path,
+                                       shared=True)
+        self.assertFalse(m_r.called)
+
+    def test_transaction_read_only_changes(self):
+        token = fakes.user_token_no_container
+
+        def add_read_only():
+            with self.control.transaction(token, read_only=True):
+                self.control.add_container(token, "c1")
+
+        self.assertRaises(exceptions.UserCredentialsException,
+                          add_read_only)
+        self.assertEqual([], self.control.list_containers(token))
+        self.assertNotIn("containers",
+                         utils.read_yaml_file(self.path)[token])
+
+    def test_transaction_aborted(self):
+        token = fakes.user_token_no_container
+
+        def add_and_fail():
+            with self.control.transaction(token):
+                self.control.add_container(token, "c1")
+                raise exceptions.DockerException("fail")
+
+        self.assertRaises(exceptions.DockerException, add_and_fail)
+        self.assertEqual([], self.control.list_containers(token))
+        self.assertNotIn("containers",
+                         utils.read_yaml_file(self.path)[token])
+
+    def test_transaction_nested(self):
+        token = fakes.user_token_no_container
+        with mock.patch("bdocker.utils.write_yaml_file",
+                        wraps=utils.write_yaml_file) as m_w:
+            with self.control.transaction(token):
+                self.control.add_container(token, "c1")
+                with self.control.transaction(token):
+                    self.control.add_container(token, "c2")
+                self.assertFalse(m_w.called)
+        self.assertEqual(1, m_w.call_count)
+        self.assertEqual(["c1", "c2"],
+                         utils.read_yaml_file(self.path)[token]["containers"])
+
+
+class TestTokenStoreFormats(testtools.TestCase):
+    """Test token stores serialized in other formats."""
+
+    def setUp(self):
+        super(TestTokenStoreFormats, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "token_store.yml")
+        utils.write_yaml_file(self.path, fakes.token_store)
+
+    def test_json_store(self):
+        path = os.path.join(self.dir, "token_store.json")
+        utils.write_data_file(path, fakes.token_store, "json")
+        control = credentials.TokenController(path, store_format="json")
+        control.add_container(fakes.user_token_no_container, "c1")
+        other = credentials.TokenController(path, store_format="json")
+        self.assertEqual(["c1"], other.list_containers(
+            fakes.user_token_no_container))
+        self.assertEqual(fakes.admin_token, other.get_admin_token())
+
+    def test_journal_json_store(self):
+        path = os.path.join(self.dir, "token_store.json")
+        utils.write_data_file(path, fakes.token_store, "json")
+        control = credentials.JournalTokenController(path,
+                                                     store_format="json")
+        control.add_container(fakes.user_token_no_container, "c1")
+        control.compact()
+        store = utils.read_data_file(path, "json")
+        self.assertEqual(["c1"],
+                         store[fakes.user_token_no_container]["containers"])
+
+    def test_unsupported_format(self):
+        self.assertRaises(exceptions.ConfigurationException,
+                          credentials.TokenController,
+                          self.path, store_format="xml")
+
+    def test_migrate_token_store(self):
+        path = os.path.join(self.dir, "token_store.json")
+        records = credentials.migrate_token_store(self.path, path,
+                                                  "yaml", "json")
+        self.assertEqual(len(fakes.token_store), records)
+        self.assertEqual(fakes.token_store,
+                         utils.read_data_file(path, "json"))
+
+    def test_migrate_token_store_journal(self):
+        control = credentials.JournalTokenController(self.path)
+        control.add_container(fakes.user_token_no_container, "c1")
+        path = os.path.join(self.dir, "token_store.json")
+        credentials.migrate_token_store(self.path, path, "yaml", "json")
+        store = utils.read_data_file(path, "json")
+        self.assertEqual(["c1"],
+                         store[fakes.user_token_no_container]["containers"])
+
+    def test_migrate_token_store_sqlite(self):
+        path = os.path.join(self.dir, "token_store.db")
+        credentials.migrate_token_store(self.path, path, "yaml", "sqlite")
+        control = credentials.SQLiteTokenController(path)
+        self.assertEqual(fakes.token_store[fakes.user_token],
+                         control.get_token(fakes.user_token))
+
+
+class TestJournalTokenController(testtools.TestCase):
+    """Test Journal Token controller."""
+
+    def setUp(self):
+        super(TestJournalTokenController, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "token_store.yml")
+        utils.write_yaml_file_atomic(self.path, fakes.token_store)
+        self.control = credentials.JournalTokenController(self.path)
+
+    def _journal_lines(self):
+        with open(self.control.journal_path) as journal:
+            return journal.readlines()
+
+    def test_load_snapshot(self):
+        self.assertEqual(fakes.admin_token,
+                         self.control.get_admin_token())
+        self.assertEqual(fakes.containers,
+                         self.control.list_containers(fakes.user_token))
+
+    def test_add_container_appends_journal(self):
+        c_id = uuid.uuid4().hex
+        self.control.add_container(fakes.user_token_no_container, c_id)
+        self.assertEqual(1, len(self._journal_lines()))
+        self.assertEqual(fakes.token_store,
+                         utils.read_yaml_file(self.path))
+        self.assertEqual([c_id], self.control.list_containers(
+            fakes.user_token_no_container))
+
+    def test_replay_journal(self):
+        c_id = uuid.uuid4().hex
+        self.control.add_container(fakes.user_token_no_container, c_id)
+        self.control.remove_token_from_cache(fakes.user_token_delete)
+        control = credentials.JournalTokenController(self.path)
+        self.assertEqual([c_id], control.list_containers(
+            fakes.user_token_no_container))
+        self.assertRaises(exceptions.UserCredentialsException,
+                          control.get_token, fakes.user_token_delete)
+
+    def test_replay_journal_from_other_process(self):
+        other = credentials.JournalTokenController(self.path)
+        c_id = uuid.uuid4().hex
+        other.add_container(fakes.user_token_no_container, c_id)
+        self.control.add_image(fakes.user_token_no_images, "image")
+        self.assertEqual([c_id], self.control.list_containers(
+            fakes.user_token_no_container))
+
+    def test_incomplete_entry_discarded(self):
+        c_id = uuid.uuid4().hex
+        self.control.add_container(fakes.user_token_no_container, c_id)
+        with open(self.control.journal_path, 'a') as journal:
+            journal.write('{"token": "tor')
+        control = credentials.JournalTokenController(self.path)
+        self.assertEqual([c_id], control.list_containers(
+            fakes.user_token_no_container))
+        control.add_image(fakes.user_token_no_images, "image")
+        self.assertEqual(2, len(self._journal_lines()))
+        self.assertEqual(["image"], self.control.get_token(
+            fakes.user_token_no_images)["images"])
+
+    def test_reload_after_compaction_from_other_process(self):
+        other = credentials.JournalTokenController(self.path)
+        self.control.add_image(fakes.user_token_no_images, "image")
+        other.add_container(fakes.user_token_no_container, "c_1")
+        other.compact()
+        other.add_container(fakes.user_token_no_container, "c_2")
+        other.add_container(fakes.user_token_no_container, "c_3")
+        self.assertEqual(["c_1", "c_2", "c_3"], self.control.list_containers(
+            fakes.user_token_no_container))
+        self.assertEqual(["image"], self.control.get_token(
+            fakes.user_token_no_images)["images"])
+
+    def test_concurrent_writers_same_token(self):
+        token = fakes.user_token_no_container
+        other = credentials.JournalTokenController(self.path)
+        add_containers_concurrently(self.control, other, token)
+        control = credentials.JournalTokenController(self.path)
+        self.assertEqual(["c_1", "c_2"],
+                         sorted(control.list_containers(token)))
+
+    def test_remove_token_of_other_process(self):
+        other = credentials.JournalTokenController(self.path)
+        token = other._set_token({"uid": 1, "gid": 1, "home": "/home"})
+        self.control.remove_token_from_cache(token)
+        self.assertRaises(exceptions.UserCredentialsException,
+                          other.get_token, token)
+
+    def test_compact(self):
+        c_id = uuid.uuid4().hex
+        self.control.add_container(fakes.user_token_no_container, c_id)
+        self.control.compact()
+        self.assertEqual([], self._journal_lines())
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual([c_id],
+                         store[fakes.user_token_no_container]["containers"])
+
+    def test_compact_threshold(self):
+        control = credentials.JournalTokenController(self.path,
+                                                     compact_threshold=0)
+        for _ in range(len(fakes.token_store) + 1):
+            control.add_container(fakes.user_token_no_container,
+                                  uuid.uuid4().hex)
+        self.assertEqual([], self._journal_lines())
+        store = utils.read_yaml_file(self.path)
+        self.assertEqual(
+            len(fakes.token_store) + 1,
+            len(store[fakes.user_token_no_container]["containers"]))
+
+
+class TestSQLiteTokenController(testtools.TestCase):
+    """Test SQLite Token controller."""
+
+    def setUp(self):
+        super(TestSQLiteTokenController, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "token_store.db")
+        self.control = credentials.SQLiteTokenController(self.path)
+        self.control.import_token_store(fakes.token_store)
+
+    def test_get_token(self):
+        t = fakes.user_token
+        self.assertEqual(fakes.token_store[t],
+                         self.control.get_token(t))
+
+    def test_get_admin(self):
+        self.assertEqual(fakes.admin_token,
+                         self.control.get_admin_token())
+
+    def test_get_token_err(self):
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.get_token, "tokenerr")
+
+    @mock.patch('bdocker.utils.check_user_credentials')
+    def test_authenticate_with_job_batch_info(self, m):
+        jobid = uuid.uuid4().hex
+        cgroup = uuid.uuid4().hex
+        u = fakes.create_usercrentials()['user_credentials']
+        u.update({'job': {'job_id': jobid,
+                          'spool': "/spool"}
+                  })
+        token = self.control.authenticate(fakes.admin_token, u)
+        self.control.set_token_batch_info(token, {"cgroup": cgroup})
+        control = credentials.SQLiteTokenController(self.path)
+        job_info = control.get_job_from_token(token)
+        self.assertEqual(jobid, job_info['job_id'])
+        self.assertEqual(cgroup, job_info['cgroup'])
+
+    def test_add_remove_container(self):
+        token = fakes.user_token_no_container
+        c_id = uuid.uuid4().hex
+        self.control.add_container(token, c_id)
+        self.assertEqual([c_id], self.control.list_containers(token))
+        self.assertEqual([c_id],
+                         self.control.get_token(token)["containers"])
+        self.control.remove_container(token, c_id)
+        self.assertEqual([], self.control.list_containers(token))
+        self.assertNotIn("containers", self.control.get_token(token))
+
+    def test_list_containers_keeps_order(self):
+        token = fakes.user_token_no_container
+        c_ids = ["f%s" % uuid.uuid4().hex, "0%s" % uuid.uuid4().hex]
+        for c_id in c_ids:
+            self.control.add_container(token, c_id)
+        self.assertEqual(c_ids, self.control.list_containers(token))
+
+    def test_authorize_container(self):
+        t = fakes.user_token
+        c = fakes.containers[1]
+        self.assertEqual(c, self.control.authorize_container(t, c))
+        self.assertEqual(c, self.control.authorize_container(t, c[:6]))
+
+    def test_authorize_container_err(self):
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.authorize_container,
+                          fakes.user_token_no_container,
+                          fakes.containers[0])
+
+    def test_authorize_container_ambiguous(self):
+        token = fakes.user_token_no_container
+        self.control.add_container(token, "abc1")
+        self.control.add_container(token, "abc2")
+        self.assertEqual("abc2",
+                         self.control.authorize_container(token, "abc2"))
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.authorize_container, token, "ab")
+
+    def test_add_remove_image(self):
+        token = fakes.user_token_no_images
+        self.control.add_image(token, "image")
+        self.assertTrue(self.control.authorize_image(token, "image"))
+        self.control.remove_image(token, "image")
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.authorize_image, token, "image")
+
+    def test_add_image_name(self):
+        token = fakes.user_token_no_images
+        self.control.add_image_name(token, "ubuntu:16.04")
+        control = credentials.SQLiteTokenController(self.path)
+        token_info = control.get_token(token)
+        self.assertEqual(["ubuntu:16.04"], token_info["image_names"])
+        self.assertNotIn("images", token_info)
+
+    def test_last_seen(self):
+        token = fakes.user_token_no_container
+        self.assertNotIn("last_seen", self.control.get_token(token))
+        self.control.add_container(token, uuid.uuid4().hex)
+        self.assertIn("last_seen", self.control.get_token(token))
+
+    def test_list_sessions_and_remove_tokens(self):
+        sessions = dict(self.control.list_sessions())
+        self.assertEqual(len(fakes.token_store) - 1, len(sessions))
+        self.control.remove_tokens(list(sessions))
+        self.control.compact()
+        self.assertEqual([], self.control.list_sessions())
+        self.assertEqual(fakes.admin_token,
+                         self.control.get_admin_token())
+
+    def test_remove_token(self):
+        t = fakes.user_token
+        self.control.remove_token_from_cache(t)
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.get_token, t)
+        self.assertRaises(exceptions.UserCredentialsException,
+                          self.control.remove_token_from_cache, t)
+
+    @mock.patch('bdocker.utils.check_user_credentials')
+    def test_transaction(self, m):
+        u = fakes.create_usercrentials()['user_credentials']
+        u['job'] = {'job_id': uuid.uuid4().hex, 'spool': "/spool"}
+        with mock.patch.object(self.control, "_store_records",
+                               wraps=self.control._store_records) as m_s:
+            with self.control.transaction():
+                token = self.control.authenticate(fakes.admin_token, u)
+                self.control.set_token_batch_info(token, {"cgroup": "/c"})
+                self.control.add_container(token, "c1")
+                self.assertEqual("c1",
+                                 self.control.authorize_container(token,
+                                                                  "c"))
+        self.assertEqual(1, m_s.call_count)
+        control = credentials.SQLiteTokenController(self.path)
+        self.assertEqual("/c", control.get_job_from_token(token)["cgroup"])
+        self.assertEqual(["c1"], control.list_containers(token))
+
+    def test_transaction_aborted(self):
+        token = fakes.user_token_no_container
+
+        def add_and_fail():
+            with self.control.transaction(token):
+                self.control.add_container(token, "c1")
+                raise exceptions.DockerException("fail")
+
+        self.assertRaises(exceptions.DockerException, add_and_fail)
+        self.assertEqual([], self.control.list_containers(token))
+
+    def test_concurrent_writer_during_transaction(self):
+        token = fakes.user_token_no_container
+        other = credentials.SQLiteTokenController(self.path)
+        add_container_in_transaction(self.control, other, token)
+        self.assertEqual(["c_1", "c_2"],
+                         sorted(self.control.list_containers(token)))
+
+    def test_get_container_token(self):
+        token = fakes.user_token_no_container
+        c_id = uuid.uuid4().hex
+        self.control.add_container(token, c_id)
+        self.assertEqual(token, self.control.get_container_token(c_id))
+        self.assertIsNone(self.control.get_container_token("c_none"))
+
+    def test_transaction_read_only(self):
+        token = fakes.user_token_no_container
+        other = credentials.SQLiteTokenController(self.path)
+        with self.control.transaction(token, read_only=True):
+            self.assertEqual([], self.control.list_containers(token))
+            other.add_container(token, "c_1")
+            self.assertEqual([], self.control.list_containers(token))
+        self.assertEqual(["c_1"], self.control.list_containers(token))
+
+    def test_load_module_with_store_format(self):
+        conf = {"credentials": {"controller": "SQLiteTokenController",
+                                "token_store": self.path,
+                                "token_store_format": "json"}}
+        control = modules.load_credentials_module(conf)
+        self.assertIsInstance(control, credentials.SQLiteTokenController)
+        self.assertEqual(fakes.admin_token, control.get_admin_token())
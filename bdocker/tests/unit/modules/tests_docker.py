@@ -14,7 +14,16 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import copy
+import gzip
+import io
 import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
 import uuid
 
 import docker
@@ -22,8 +31,10 @@ import mock
 import testtools
 
 from bdocker import exceptions
+from bdocker import modules
 from bdocker.modules import docker_helper
 from bdocker.tests import fakes
+from bdocker import utils
 
 
 def create_generator(json_data):
@@ -37,7 +48,94 @@ class TestDocker(testtools.TestCase):
     def setUp(self):
         super(TestDocker, self).setUp()
         url = 'localhost:2375'
-        self.control = docker_helper.DockerController(url)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.addCleanup(docker_helper._clients.clear)
+        self.addCleanup(docker_helper._container_states.clear)
+        with mock.patch.object(docker.Client, 'version',
+                               return_value={'ApiVersion': '1.24'}):
+            self.control = docker_helper.DockerController(
+                url, pull_cache_dir=self.cache_dir)
+
+    def test_get_client_shared(self):
+        other = docker_helper.DockerController(
+            'localhost:2375', pull_cache_dir=self.cache_dir)
+        self.assertIs(self.control.control, other.control)
+        self.assertEqual('1.24', other.control.api_version)
+
+    def test_pull_cache_dir_shared(self):
+        os.chmod(self.cache_dir, 0o777)
+        self.assertRaises(exceptions.ConfigurationException,
+                          docker_helper.DockerController,
+                          'localhost:2375', pull_cache_dir=self.cache_dir)
+
+    def test_pull_cache_dir_symlink(self):
+        path = os.path.join(self.cache_dir, "link")
+        os.symlink(self.cache_dir, path)
+        self.assertRaises(exceptions.ConfigurationException,
+                          docker_helper.DockerController,
+                          'localhost:2375', pull_cache_dir=path)
+
+    @mock.patch("os.geteuid", return_value=12345)
+    def test_pull_cache_dir_other_owner(self, m_uid):
+        self.assertRaises(exceptions.ConfigurationException,
+                          docker_helper.DockerController,
+                          'localhost:2375', pull_cache_dir=self.cache_dir)
+
+    @mock.patch.object(docker.Client, 'version')
+    def test_get_client_newer_daemon(self, m):
+        m.return_value = {'ApiVersion': '1.99'}
+        client = docker_helper.get_client('localhost:2376')
+        self.assertEqual(docker_helper.MAX_DOCKER_API_VERSION,
+                         client.api_version)
+        self.assertIs(client, docker_helper.get_client('localhost:2376'))
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'version')
+    def test_get_client_no_daemon(self, m):
+        m.side_effect = Exception("Connection refused")
+        client = docker_helper.get_client('localhost:2376')
+        self.assertEqual(docker_helper.DOCKER_API_VERSION,
+                         client.api_version)
+        docker_helper.get_client('localhost:2376')
+        self.assertEqual(2, m.call_count)
+
+    @mock.patch.object(docker.Client, 'version')
+    def test_negotiate_when_daemon_available(self, m):
+        m.side_effect = Exception("Connection refused")
+        control = docker_helper.DockerController(
+            'localhost:2376', pull_cache_dir=self.cache_dir)
+        self.assertFalse(control.supports('id_filter'))
+        m.side_effect = None
+        m.return_value = {'ApiVersion': '1.24'}
+        self.assertTrue(control.supports('id_filter'))
+        self.assertIs(docker_helper.get_client('localhost:2376'),
+                      control.control)
+        control.supports('labels')
+        self.assertEqual(3, m.call_count)
+
+    @mock.patch.object(docker.Client, 'version')
+    def test_capabilities(self, m):
+        m.return_value = {'ApiVersion': '1.20'}
+        control = docker_helper.DockerController(
+            'localhost:2376', pull_cache_dir=self.cache_dir)
+        self.assertEqual({'labels': True,
+                          'label_filter': True,
+                          'stats_one_shot': True,
+                          'id_filter': False},
+                         control.capabilities)
+        self.assertTrue(self.control.supports('id_filter'))
+
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'version')
+    def test_list_containers_old_daemon(self, m_ver, m):
+        m_ver.return_value = {'ApiVersion': '1.20'}
+        m.return_value = copy.deepcopy(fakes.fake_container_info)
+        control = docker_helper.DockerController(
+            'localhost:2376', pull_cache_dir=self.cache_dir)
+        out = control.list_containers(fakes.fake_containers)
+        self.assertEqual(2, out.__len__())
+        m.assert_called_once_with(all=False)
 
     @mock.patch.object(docker.Client, 'pull')
     def test_pull(self, m):
@@ -62,6 +160,322 @@ class TestDocker(testtools.TestCase):
         self.assertRaises(exceptions.DockerException,
                           self.control.pull_image, image)
 
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_stream(self, m):
+        image = 'imageOK'
+        m.return_value = create_generator(fakes.fake_pull[image])
+        out = self.control.pull_image(image, stream=True)
+        self.assertIn("f1e4b055fb65: Pull complete\n", "".join(out))
+        m.assert_called_once_with(repository=image, tag='latest',
+                                  stream=True)
+
+    @mock.patch.object(docker.Client, 'pull')
+    def test_prefetch_images(self, m):
+        m.side_effect = lambda **kw: create_generator(
+            fakes.fake_pull['imageOK'])
+        thread = self.control.prefetch_images(["ubuntu:16.04", "centos"])
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        m.assert_has_calls([
+            mock.call(repository="ubuntu", tag='16.04', stream=True),
+            mock.call(repository="centos", tag='latest', stream=True)])
+
+    @mock.patch.object(docker.Client, 'pull')
+    def test_prefetch_images_error(self, m):
+        m.side_effect = lambda **kw: create_generator(
+            fakes.fake_pull['imageError'])
+        thread = self.control.prefetch_images(["imageError", "ubuntu"])
+        thread.join(5)
+        self.assertEqual(2, m.call_count)
+
+    def test_wait_pull(self):
+        released = []
+        pulling = threading.Event()
+
+        def pull():
+            with self.control.pull_cache.lock("ubuntu:latest"):
+                pulling.set()
+                time.sleep(0.2)
+                released.append(True)
+        thread = threading.Thread(target=pull)
+        thread.start()
+        pulling.wait(5)
+        self.control.wait_pull("ubuntu")
+        self.assertEqual([True], released)
+        thread.join()
+
+    def test_prune_pull_cache(self):
+        cache = self.control.pull_cache
+        for name in ("ubuntu:latest", "busybox:latest"):
+            with cache.lock(name):
+                cache.set(name, "sha256:aaa")
+        self.assertEqual(0, self.control.prune_pull_cache())
+        with cache.lock("busybox:latest"):
+            # the entries of the pulls in flight are kept
+            self.assertEqual(1, cache.prune(now=time.time() + cache.ttl))
+        ubuntu = cache._entry_path("ubuntu:latest")
+        busybox = cache._entry_path("busybox:latest")
+        self.assertFalse(os.path.exists(ubuntu))
+        self.assertFalse(os.path.exists("%s.lock" % ubuntu))
+        self.assertTrue(os.path.exists(busybox))
+        self.assertTrue(os.path.exists("%s.lock" % busybox))
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_recent(self, m, m_ins):
+        image = 'imageOK'
+        m.return_value = create_generator(fakes.fake_pull[image])
+        m_ins.return_value = {'Id': 'sha256:aaa'}
+        self.control.pull_image(image)
+        out = self.control.pull_image(image)
+        self.assertEqual(
+            ["Status: Image is up to date for imageOK:latest"], out)
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_recent_changed(self, m, m_ins):
+        image = 'imageOK'
+        m.side_effect = lambda **kw: create_generator(
+            fakes.fake_pull[image])
+        m_ins.side_effect = [{'Id': 'sha256:aaa'},
+                             {'Id': 'sha256:bbb'},
+                             {'Id': 'sha256:bbb'}]
+        self.control.pull_image(image)
+        self.control.pull_image(image)
+        self.assertEqual(2, m.call_count)
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_expired(self, m, m_ins):
+        image = 'imageOK'
+        self.control.pull_cache.ttl = 0
+        m.side_effect = lambda **kw: create_generator(
+            fakes.fake_pull[image])
+        m_ins.return_value = {'Id': 'sha256:aaa'}
+        self.control.pull_image(image)
+        self.control.pull_image(image)
+        self.assertEqual(2, m.call_count)
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_single_flight(self, m, m_ins):
+        image = 'imageOK'
+        started = threading.Event()
+
+        def slow_pull(**kwargs):
+            started.set()
+            time.sleep(0.2)
+            return create_generator(fakes.fake_pull[image])
+        m.side_effect = slow_pull
+        m_ins.return_value = {'Id': 'sha256:aaa'}
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(self.control.pull_image(image)))
+        first.start()
+        started.wait()
+        results.append(self.control.pull_image(image))
+        first.join()
+        self.assertEqual(1, m.call_count)
+        self.assertIn(
+            ["Status: Image is up to date for imageOK:latest"], results)
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    def test_pull_stream_recent(self, m, m_ins):
+        image = 'busybox:1.0'
+        m.return_value = create_generator(fakes.fake_pull['imageOK'])
+        m_ins.return_value = {'Id': 'sha256:aaa'}
+        list(self.control.pull_image(image, stream=True))
+        out = list(self.control.pull_image(image, stream=True))
+        self.assertEqual(["Status: Image is up to date for busybox:1.0\n"],
+                         out)
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'images')
+    def test_list_images(self, m):
+        m.return_value = [{'Id': 'sha256:aaa',
+                           'RepoTags': ['ubuntu:16.04'],
+                           'Size': 10, 'Created': 1458231723},
+                          {'Id': 'sha256:bbb',
+                           'RepoTags': ['<none>:<none>'],
+                           'Size': 5, 'Created': 1458231670}]
+        out = self.control.list_images()
+        self.assertEqual([{"id": 'sha256:aaa', "tags": ['ubuntu:16.04'],
+                           "size": 10, "created": 1458231723},
+                          {"id": 'sha256:bbb', "tags": [],
+                           "size": 5, "created": 1458231670}], out)
+        self.control.list_images()
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'inspect_image')
+    @mock.patch.object(docker.Client, 'pull')
+    @mock.patch.object(docker.Client, 'images')
+    def test_list_images_after_pull(self, m, m_pull, m_ins):
+        m.return_value = []
+        m_pull.return_value = create_generator(fakes.fake_pull['imageOK'])
+        m_ins.return_value = {'Id': 'sha256:aaa'}
+        self.control.list_images()
+        self.control.pull_image('imageOK')
+        self.control.list_images()
+        self.assertEqual(2, m.call_count)
+
+    @mock.patch.object(docker.Client, 'images')
+    def test_list_images_err(self, m):
+        m.side_effect = Exception("Not connected")
+        self.assertRaises(exceptions.DockerException,
+                          self.control.list_images)
+
+    def test_record_image_use_disabled(self):
+        self.control.track_image_usage = False
+        self.control.record_image_use("ubuntu:16.04")
+        self.assertFalse(os.path.exists(self.control.image_usage.log_path))
+        self.control.track_image_usage = True
+        self.control.record_image_use("ubuntu:16.04")
+        self.assertEqual({"ubuntu:16.04"},
+                         set(self.control.image_usage.load()))
+
+    @mock.patch.object(docker_helper, "DockerController")
+    def test_load_docker_module_image_usage(self, m_dock):
+        for docker_conf, expected in (({}, False),
+                                      ({"gc_budget": 10}, True),
+                                      ({"gc_budget": 10,
+                                        "gc_interval": 0}, False)):
+            docker_conf["base_url"] = "localhost:2375"
+            modules.load_docker_module({"dockerAPI": docker_conf})
+            self.assertEqual(
+                expected, m_dock.call_args[1]["track_image_usage"])
+
+    def test_image_usage(self):
+        usage = self.control.image_usage
+        self.control.pull_cache.ensure_dir()
+        usage.touch("ubuntu:16.04", now=10)
+        usage.touch("busybox:latest", now=20)
+        usage.touch("ubuntu:16.04", now=30)
+        self.assertEqual({"ubuntu:16.04": 30, "busybox:latest": 20},
+                         usage.load())
+        usage.compact(forget=["busybox:latest"])
+        usage.touch("centos:7", now=40)
+        self.assertEqual({"ubuntu:16.04": 30, "centos:7": 40},
+                         usage.load())
+
+    def _gc_images(self, m_images, history=None):
+        m_images.return_value = [
+            {'Id': 'sha256:' + 'a' * 64, 'RepoTags': ['ubuntu:16.04'],
+             'Size': 400, 'Created': 1},
+            {'Id': 'sha256:' + 'b' * 64, 'RepoTags': ['busybox:latest'],
+             'Size': 100, 'Created': 1},
+            {'Id': 'sha256:' + 'c' * 64, 'RepoTags': ['centos:7'],
+             'Size': 500, 'Created': 1},
+            {'Id': 'sha256:' + 'd' * 64, 'RepoTags': ['debian:8'],
+             'Size': 200, 'Created': 1}]
+        if history is None:
+            # every image is a single layer
+            sizes = dict((image['Id'], image['Size'])
+                         for image in m_images.return_value)
+            history = dict((image_id, [{'Id': image_id, 'Created': 1,
+                                        'CreatedBy': image_id,
+                                        'Size': size}])
+                           for image_id, size in sizes.items())
+        patcher = mock.patch.object(docker.Client, 'history',
+                                    side_effect=history.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _gc_shared_history(self):
+        base = {'Id': '<missing>', 'Created': 1,
+                'CreatedBy': 'ADD file:base in /', 'Size': 60}
+        return {
+            'sha256:' + 'a' * 64: [
+                {'Id': 'sha256:' + 'a' * 64, 'Created': 2,
+                 'CreatedBy': 'RUN apt-get update', 'Size': 340},
+                {'Id': '<missing>', 'Created': 1, 'CreatedBy': 'CMD sh',
+                 'Size': 0}, base],
+            'sha256:' + 'b' * 64: [
+                {'Id': 'sha256:' + 'b' * 64, 'Created': 3,
+                 'CreatedBy': 'RUN make', 'Size': 40},
+                {'Id': '<missing>', 'Created': 1, 'CreatedBy': 'CMD sh',
+                 'Size': 0}, base],
+            'sha256:' + 'c' * 64: [
+                {'Id': 'sha256:' + 'c' * 64, 'Created': 1,
+                 'CreatedBy': 'ADD file:centos in /', 'Size': 500}],
+            'sha256:' + 'd' * 64: [
+                {'Id': 'sha256:' + 'd' * 64, 'Created': 1,
+                 'CreatedBy': 'ADD file:debian in /', 'Size': 200}],
+        }
+
+    @mock.patch.object(docker.Client, 'remove_image')
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'images')
+    def test_collect_images_lru(self, m_images, m_cont, m_rm):
+        self._gc_images(m_images)
+        m_cont.return_value = [{'Image': 'debian:8'}]
+        self.control.pull_cache.ensure_dir()
+        self.control.image_usage.touch("busybox", now=10)
+        self.control.image_usage.touch("centos:7", now=30)
+        self.control.image_usage.touch("ubuntu:16.04", now=20)
+        removed = self.control.collect_images(1000, 0.9, 0.6,
+                                              in_use=["aaaaaaaaaaaa"])
+        # ubuntu is in use by a job and debian by a container
+        self.assertEqual(['sha256:' + 'b' * 64, 'sha256:' + 'c' * 64],
+                         removed)
+        self.assertEqual({"ubuntu:16.04": 20},
+                         self.control.image_usage.load())
+
+    @mock.patch.object(docker.Client, 'remove_image')
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'images')
+    def test_collect_images_largest(self, m_images, m_cont, m_rm):
+        self._gc_images(m_images)
+        m_cont.return_value = []
+        removed = self.control.collect_images(1000, 0.9, 0.6,
+                                              policy='largest')
+        self.assertEqual(['sha256:' + 'c' * 64, 'sha256:' + 'a' * 64],
+                         removed)
+        m_rm.assert_called_with(image='sha256:' + 'a' * 64)
+
+    @mock.patch.object(docker.Client, 'remove_image')
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'images')
+    def test_collect_images_under_budget(self, m_images, m_cont, m_rm):
+        self._gc_images(m_images)
+        removed = self.control.collect_images(2000, 0.9, 0.6)
+        self.assertEqual([], removed)
+        self.assertFalse(m_rm.called)
+
+    @mock.patch.object(docker.Client, 'remove_image')
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'images')
+    def test_collect_images_conflict(self, m_images, m_cont, m_rm):
+        self._gc_images(m_images)
+        m_cont.return_value = []
+        m_rm.side_effect = [Exception("conflict"), None, None]
+        removed = self.control.collect_images(1000, 0.9, 0.6,
+                                              policy='largest')
+        self.assertEqual(['sha256:' + 'a' * 64, 'sha256:' + 'd' * 64],
+                         removed)
+
+    @mock.patch.object(docker.Client, 'remove_image')
+    @mock.patch.object(docker.Client, 'containers')
+    @mock.patch.object(docker.Client, 'images')
+    def test_collect_images_shared_layers(self, m_images, m_cont, m_rm):
+        # ubuntu and busybox share a base layer of 60 bytes, so the
+        # images take 1140 bytes instead of 1200
+        self._gc_images(m_images, history=self._gc_shared_history())
+        m_cont.return_value = []
+        self.assertEqual([], self.control.collect_images(1200, 0.96, 0.5))
+        self.assertFalse(m_rm.called)
+        removed = self.control.collect_images(1200, 0.9, 0.5,
+                                              policy='largest')
+        # ubuntu frees 340 bytes, since busybox uses the base layer
+        self.assertEqual(['sha256:' + 'c' * 64, 'sha256:' + 'a' * 64],
+                         removed)
+
+    def test_collect_images_bad_policy(self):
+        self.assertRaises(exceptions.ConfigurationException,
+                          self.control.collect_images,
+                          1000, 0.9, 0.6, policy='fifo')
+
     @mock.patch.object(docker.Client, 'remove_image')
     def test_delete_image(self, m):
         image = uuid.uuid4().hex
@@ -135,6 +549,42 @@ class TestDocker(testtools.TestCase):
                           self.control.list_containers_details,
                           containers[0])
 
+    @mock.patch.object(docker.Client, 'inspect_container')
+    def test_list_containers_details_some_err(self, m):
+        containers = [uuid.uuid4().hex, uuid.uuid4().hex]
+        m.side_effect = lambda c_id: (
+            fakes.fake_container_details if c_id == containers[1]
+            else create_generator([]))
+        out = self.control.list_containers_details(containers)
+        self.assertEqual(2, out.__len__())
+        self.assertEqual(containers[0][:12], out[0][0])
+        self.assertIn("Container information error", out[0][4])
+        self.assertEqual("fakehostname", out[1][0])
+
+    @mock.patch.object(docker.Client, 'remove_container')
+    def test_clean_containers_concurrent(self, m):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def remove(c_id, force):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            if c_id == "c3":
+                raise Exception("Not Found")
+        m.side_effect = remove
+        self.control.workers = 3
+        containers = ["c%s" % i for i in range(8)]
+        out = self.control.clean_containers(containers)
+        self.assertEqual(8, m.call_count)
+        self.assertEqual(3, running[1])
+        self.assertEqual(containers[:3], out[:3])
+        self.assertIn("Error", out[3])
+        self.assertEqual(containers[4:], out[4:])
+
     @mock.patch.object(docker.Client, 'containers')
     def test_list_containers(self, m):
         m.return_value = fakes.fake_container_info
@@ -143,6 +593,131 @@ class TestDocker(testtools.TestCase):
         self.assertIsNotNone(out)
         self.assertEqual(2, out.__len__())
 
+    @mock.patch.object(docker.Client, 'containers')
+    def test_list_containers_filters(self, m):
+        m.return_value = fakes.fake_container_info
+        containers = fakes.fake_containers
+        out = self.control.list_containers(containers, all=True)
+        self.assertEqual(2, out.__len__())
+        m.assert_called_once_with(all=True,
+                                  filters={'id': containers})
+
+    @mock.patch.object(docker.Client, 'containers')
+    def test_list_containers_job(self, m):
+        job_id = uuid.uuid4().hex
+        unlabeled = uuid.uuid4().hex
+        m.side_effect = [copy.deepcopy(fakes.fake_container_info), []]
+        containers = fakes.fake_containers + [unlabeled]
+        out = self.control.list_containers(containers, job_id=job_id)
+        self.assertEqual(2, out.__len__())
+        m.assert_has_calls([
+            mock.call(all=False,
+                      filters={'label': 'bdocker.job_id=%s' % job_id}),
+            mock.call(all=False, filters={'id': [unlabeled]})])
+
+    @mock.patch.object(docker.Client, 'containers')
+    def test_list_containers_job_labeled(self, m):
+        job_id = uuid.uuid4().hex
+        m.return_value = copy.deepcopy(fakes.fake_container_info)
+        out = self.control.list_containers(fakes.fake_containers,
+                                           job_id=job_id)
+        self.assertEqual(2, out.__len__())
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'create_container')
+    def test_run_container_label(self, m_create):
+        m_create.return_value = fakes.fake_create
+        job_id = uuid.uuid4().hex
+        self.control.run_container(image_id="ubuntu", detach=True,
+                                   command='ls', job_id=job_id)
+        self.assertEqual({'bdocker.job_id': job_id},
+                         m_create.call_args[1]['labels'])
+
+    @mock.patch.object(docker.Client, 'containers')
+    def test_list_containers_exited_cache(self, m):
+        c_id = fakes.container_real[0]['Id']
+        states = self.control.container_states
+        states.activate()
+        states.update({'status': 'die', 'id': c_id, 'time': 1458231723,
+                       'Actor': {'ID': c_id,
+                                 'Attributes': {'exitCode': '3'}}})
+        m.return_value = copy.deepcopy(fakes.container_real)
+        self.control.list_containers([c_id], all=True)
+        out = self.control.list_containers([c_id], all=True)
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(c_id[:12], out[0][0])
+        self.assertIn("Exited (3)", out[0][4])
+        self.assertEqual([], self.control.list_containers([c_id]))
+        self.assertEqual(1, m.call_count)
+
+    @mock.patch.object(docker.Client, 'inspect_container')
+    def test_containers_details_exited_cache(self, m):
+        c_id = uuid.uuid4().hex
+        states = self.control.container_states
+        states.activate()
+        states.update({'status': 'die', 'id': c_id, 'time': 1})
+        m.return_value = {'State': {'Running': False}}
+        out = self.control.container_details(c_id)
+        self.assertEqual(out, self.control.container_details(c_id))
+        self.assertEqual(1, m.call_count)
+        states.update({'status': 'start', 'id': c_id, 'time': 2})
+        self.control.container_details(c_id)
+        self.assertEqual(2, m.call_count)
+
+    @mock.patch.object(docker.Client, 'create_container')
+    def test_run_container_warm_pool(self, m_create):
+        created = ["c%s" % i for i in range(4)]
+        m_create.side_effect = [{'Id': c_id} for c_id in created]
+        self.control.warm_pool = docker_helper.WarmPool(
+            2, lambda spec: self.control._create_container(*spec,
+                                                           pooled=True),
+            mock.MagicMock())
+        with mock.patch.object(self.control.warm_pool, 'fill') as m_fill:
+            out = self.control.run_container(
+                image_id="ubuntu", detach=True, command=['ls', '/'],
+                job_id="1")
+        self.assertEqual("c0", out)
+        spec = ("ubuntu", ('ls', '/'), True, None, None, None, None, "1")
+        m_fill.assert_called_once_with(spec)
+        self.control.warm_pool.fill(spec).join(5)
+        self.assertEqual({'bdocker.job_id': '1',
+                          'bdocker.warm_pool': 'true'},
+                         m_create.call_args[1]['labels'])
+        with mock.patch.object(self.control, 'wait_pull') as m_wait, \
+                mock.patch.object(self.control.warm_pool, 'fill'):
+            out = self.control.run_container(
+                image_id="ubuntu", detach=True, command=['ls', '/'],
+                job_id="1")
+        self.assertEqual("c1", out)
+        self.assertFalse(m_wait.called)
+
+    @mock.patch.object(docker.Client, 'remove_container')
+    @mock.patch.object(docker.Client, 'containers')
+    def test_clean_warm_pool(self, m_list, m_remove):
+        delete = mock.MagicMock()
+        self.control.warm_pool = docker_helper.WarmPool(
+            1, mock.MagicMock(), delete)
+        self.control.warm_pool._containers[("ubuntu", "1")] = ["c1"]
+        self.control.warm_pool._containers[("ubuntu", "2")] = ["c2"]
+        m_list.return_value = [{'Id': 'c1'}, {'Id': 'c3'}]
+        out = self.control.clean_warm_pool("1")
+        self.assertEqual(["c1", "c3"], out)
+        delete.assert_called_once_with("c1")
+        m_remove.assert_called_once_with("c3", force=True)
+        m_list.assert_called_once_with(
+            all=True, filters={'label': ['bdocker.job_id=1',
+                                         'bdocker.warm_pool']})
+        self.assertEqual("c2", self.control.warm_pool.take(("ubuntu", "2")))
+
+    @mock.patch.object(docker.Client, 'containers')
+    def test_list_containers_short_id(self, m):
+        m.return_value = copy.deepcopy(fakes.container_real)
+        containers = [fakes.container_real[1]['Id'][:12],
+                      uuid.uuid4().hex]
+        out = self.control.list_containers(containers)
+        self.assertEqual(1, out.__len__())
+        self.assertEqual(containers[0], out[0][0])
+
     @mock.patch.object(docker.Client, 'logs')
     @mock.patch.object(docker.Client, 'create_container')
     @mock.patch.object(docker.Client, 'start')
@@ -196,6 +771,18 @@ class TestDocker(testtools.TestCase):
         self.assertIsNotNone(out)
         self.assertEqual(logs, out)
 
+    @mock.patch.object(docker.Client, 'logs')
+    def test_logs_stream(self, m_log):
+        m_log.return_value = fakes.create_generator([b"root\n", b"home\n"])
+        container_id = uuid.uuid4().hex
+        out = self.control.logs_container(container_id, stream=True,
+                                          tail=10, since=5, follow=True)
+        self.assertEqual([u"root\n", u"home\n"], list(out))
+        m_log.assert_called_once_with(container=container_id,
+                                      stdout=True, stderr=True,
+                                      stream=True, timestamps=False,
+                                      tail=10, since=5, follow=True)
+
     @mock.patch.object(docker.Client, 'logs')
     @mock.patch("bdocker.parsers.parse_docker_log")
     def test_logs_err(self, m_parse, m_log):
@@ -233,34 +820,356 @@ class TestDocker(testtools.TestCase):
         out = self.control.stop_container(container_id)
         self.assertEqual(out, container_id)
 
+    @staticmethod
+    def _tar_stream(members):
+        data = io.BytesIO()
+        tar = tarfile.open(fileobj=data, mode='w')
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        tar.close()
+        data.seek(0)
+        return data
+
+    @mock.patch("os.lchown")
     @mock.patch.object(docker.Client, 'get_archive')
-    @mock.patch("io.FileIO")
-    @mock.patch("tarfile.TarInfo")
-    @mock.patch("tarfile.TarFile")
-    def test_copy_from_container(self, m_tar, m_tarinf, m_file, m_get):
-        m_class = mock.MagicMock()
-        m_class.data = None
-        docker_out = m_class
+    def test_copy_from_container(self, m_get, m_chown):
+        docker_out = self._tar_stream([("baa", None),
+                                       ("baa/file", b"data")])
         stat = {}
         m_get.return_value = docker_out, stat
         container_id = uuid.uuid4().hex
         container_path = "/baa"
-        host_path = "/foo"
+        host_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, host_path)
         out = self.control.copy_from_container(container_id,
                                                container_path,
-                                               host_path)
+                                               host_path,
+                                               uid=1000, gid=1001)
         self.assertEqual(stat, out)
+        with open(os.path.join(host_path, "baa", "file"), 'rb') as f:
+            self.assertEqual(b"data", f.read())
+        m_chown.assert_has_calls([
+            mock.call(os.path.join(host_path, "baa"), 1000, 1001),
+            mock.call(os.path.join(host_path, "baa/file"), 1000, 1001)
+        ])
+        self.assertTrue(docker_out.closed)
 
-    @mock.patch.object(docker.Client, 'put_archive')
-    @mock.patch("io.FileIO")
-    @mock.patch("tarfile.TarFile")
-    @mock.patch("os.path")
-    def test_copy_to_container(self, m_os, m_tar, m_file, mput):
-        mput.return_value = True
+    @mock.patch.object(docker.Client, 'get_archive')
+    def test_copy_from_container_outside(self, m_get):
+        host_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, host_path)
+        name = "../%s-evil" % os.path.basename(host_path)
+        m_get.return_value = self._tar_stream([(name, b"data")]), {}
+        self.assertRaises(exceptions.DockerException,
+                          self.control.copy_from_container,
+                          uuid.uuid4().hex, "/baa", host_path)
+        self.assertFalse(os.path.exists(os.path.join(host_path, name)))
+
+    def _copy_to_container(self, mput, host_path):
+        sent = []
+
+        def put_archive(container, path, data):
+            sent.append(b"".join(data))
+            return True
+        mput.side_effect = put_archive
         container_id = uuid.uuid4().hex
-        container_path = "/baa"
-        host_path = "/foo"
-        out = self.control.copy_to_container(container_id,
-                                             container_path,
+        out = self.control.copy_to_container(container_id, "/baa",
                                              host_path)
         self.assertEqual(True, out)
+        return io.BytesIO(sent[0])
+
+    def _make_host_dir(self):
+        host_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, host_dir)
+        host_path = os.path.join(host_dir, "data")
+        os.mkdir(host_path)
+        with open(os.path.join(host_path, "file"), "wb") as f:
+            f.write(b"x" * 200000)
+        return host_path
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container(self, mput):
+        host_path = self._make_host_dir()
+        sent = self._copy_to_container(mput, host_path)
+        tar = tarfile.open(fileobj=sent, mode="r:")
+        self.assertEqual(["data", "data/file"], sorted(tar.getnames()))
+        self.assertEqual(200000, tar.getmember("data/file").size)
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_gzip(self, mput):
+        host_path = self._make_host_dir()
+        self.control.copy_compression = 'gzip'
+        sent = self._copy_to_container(mput, host_path)
+        self.assertEqual(b"\x1f\x8b", sent.getvalue()[:2])
+        tar = tarfile.open(fileobj=sent, mode="r:gz")
+        self.assertEqual(["data", "data/file"], sorted(tar.getnames()))
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_pgzip(self, mput):
+        host_path = self._make_host_dir()
+        self.control.copy_compression = 'pgzip'
+        self.control.copy_compression_workers = 2
+        sent = self._copy_to_container(mput, host_path)
+        tar = tarfile.open(fileobj=sent, mode="r:gz")
+        self.assertEqual(["data", "data/file"], sorted(tar.getnames()))
+
+    def test_parallel_gzip(self):
+        chunks = [os.urandom(1000) for n in range(9)]
+        out = list(utils.parallel_gzip(iter(chunks), 2))
+        self.assertEqual(9, len(out))
+        data = gzip.GzipFile(fileobj=io.BytesIO(b"".join(out))).read()
+        self.assertEqual(b"".join(chunks), data)
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_stream(self, mput):
+        host_path = self._make_host_dir()
+        mput.side_effect = lambda container, path, data: list(data)
+        out = list(self.control.copy_to_container(uuid.uuid4().hex,
+                                                  "/baa", host_path,
+                                                  stream=True))
+        self.assertTrue(out[-1].startswith("Transferred 0.2 MB"))
+        self.assertTrue(mput.called)
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_stream_error(self, mput):
+        mput.side_effect = Exception("failed")
+        out = self.control.copy_to_container(uuid.uuid4().hex, "/baa",
+                                             self._make_host_dir(),
+                                             stream=True)
+        self.assertRaises(exceptions.DockerException, list, out)
+
+    def test_copy_to_container_bad_compression(self):
+        self.assertRaises(exceptions.ParseException,
+                          self.control.copy_to_container,
+                          uuid.uuid4().hex, "/baa", "/foo",
+                          compression="lz4")
+
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_not_found(self, mput):
+        self.assertRaises(exceptions.DockerException,
+                          self.control.copy_to_container,
+                          uuid.uuid4().hex, "/baa", "/not/found")
+        self.assertFalse(mput.called)
+
+    @mock.patch.object(docker.Client, 'inspect_container')
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_delta(self, mput, minspect):
+        minspect.return_value = {'State': {'Running': False,
+                                           'StartedAt': 'start'}}
+        sent = []
+        mput.side_effect = lambda container, path, data: sent.append(
+            tarfile.open(fileobj=io.BytesIO(b"".join(data)),
+                         mode="r:").getnames())
+        host_path = self._make_host_dir()
+        os.mkdir(os.path.join(host_path, "sub"))
+        with open(os.path.join(host_path, "sub", "new"), "wb") as f:
+            f.write(b"new")
+        container_id = uuid.uuid4().hex
+        for n in range(2):
+            self.control.copy_to_container(container_id, "/baa",
+                                           host_path, delta=True,
+                                           job_id="1")
+        with open(os.path.join(host_path, "sub", "new"), "wb") as f:
+            f.write(b"changed")
+        with mock.patch.object(utils, '_file_hash',
+                               wraps=utils._file_hash) as mhash:
+            self.control.copy_to_container(container_id, "/baa",
+                                           host_path, delta=True,
+                                           job_id="1")
+        self.assertEqual(1, mhash.call_count)
+        self.assertEqual([["data", "data/file", "data/sub",
+                           "data/sub/new"],
+                          ["data", "data/sub", "data/sub/new"]],
+                         [sorted(names) for names in sent])
+
+    @mock.patch.object(docker.Client, 'inspect_container')
+    @mock.patch.object(docker.Client, 'put_archive')
+    def test_copy_to_container_delta_started(self, mput, minspect):
+        minspect.return_value = {'State': {'Running': False,
+                                           'StartedAt': 'start'}}
+        host_path = self._make_host_dir()
+        container_id = uuid.uuid4().hex
+        self.control.copy_to_container(container_id, "/baa", host_path,
+                                       delta=True, job_id="1")
+        minspect.return_value = {'State': {'Running': False,
+                                           'StartedAt': 'again'}}
+        self.control.copy_to_container(container_id, "/baa", host_path,
+                                       delta=True, job_id="1")
+        self.assertEqual(2, mput.call_count)
+        self.control.forget_copies("1")
+        self.assertEqual({"hashes": {}, "copies": {}},
+                         self.control.copy_manifests.load("1"))
+
+    @mock.patch("os.lchown")
+    @mock.patch.object(docker.Client, 'get_archive')
+    def test_copy_from_container_delta(self, m_get, m_chown):
+        host_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, host_path)
+        with open(os.path.join(host_path, "file"), "wb") as f:
+            f.write(b"host")
+        os.utime(os.path.join(host_path, "file"), (0, 0))
+        m_get.return_value = self._tar_stream([("file", b"cont")]), {}
+        self.control.copy_from_container(uuid.uuid4().hex, "/baa",
+                                         host_path, delta=True)
+        with open(os.path.join(host_path, "file"), 'rb') as f:
+            self.assertEqual(b"host", f.read())
+
+    def test_tar_stream_closed(self):
+        host_path = self._make_host_dir()
+        stream = utils.read_tar_raw_data_stream(host_path, chunk_size=512)
+        self.assertEqual(512, len(next(stream)))
+        stream.close()
+        self.assertEqual([], [t for t in threading.enumerate()
+                              if t.name == "tar_stream"])
+
+    def test_bad_copy_compression(self):
+        self.assertRaises(exceptions.ConfigurationException,
+                          docker_helper.DockerController,
+                          'localhost:2375', copy_compression='lz4')
+
+
+class TestContainerStates(testtools.TestCase):
+    """Test the container state table kept by the docker events."""
+
+    def setUp(self):
+        super(TestContainerStates, self).setUp()
+        self.states = docker_helper.ContainerStates()
+        self.states.activate()
+
+    def test_die(self):
+        out = self.states.update({
+            'Type': 'container', 'Action': 'die', 'time': 33,
+            'Actor': {'ID': 'c1', 'Attributes': {'exitCode': '137'}}})
+        expected = {'status': 'exited', 'exit_code': 137,
+                    'finished_at': 33}
+        self.assertEqual(expected, out)
+        self.assertEqual(expected, self.states.get('c1'))
+
+    def test_ignored(self):
+        self.assertIsNone(self.states.update(
+            {'Type': 'image', 'Action': 'pull', 'id': 'ubuntu'}))
+        self.assertIsNone(self.states.update(
+            {'status': 'exec_start: bash', 'id': 'c1'}))
+        self.assertIsNone(self.states.get('c1'))
+
+    def test_destroy(self):
+        self.states.update({'status': 'start', 'id': 'c1'})
+        self.assertEqual({'status': 'running'}, self.states.get('c1'))
+        self.states.update({'status': 'destroy', 'id': 'c1'})
+        self.assertIsNone(self.states.get('c1'))
+
+    def test_cache_exited(self):
+        self.states.update({'status': 'start', 'id': 'c1'})
+        self.states.cache('c1', 'row', {'Id': 'c1'})
+        self.assertNotIn('row', self.states.get('c1'))
+        self.states.update({'status': 'die', 'id': 'c1', 'time': 1})
+        self.states.cache('c1', 'row', {'Id': 'c1'})
+        self.assertEqual({'Id': 'c1'}, self.states.get('c1')['row'])
+        self.states.update({'status': 'restart', 'id': 'c1'})
+        self.assertNotIn('row', self.states.get('c1'))
+
+    def test_inactive(self):
+        self.states.update({'status': 'die', 'id': 'c1', 'time': 1})
+        self.states.deactivate()
+        self.assertIsNone(self.states.get('c1'))
+        self.states.activate()
+        self.assertIsNone(self.states.get('c1'))
+
+
+class TestEventListener(testtools.TestCase):
+    """Test the docker events listener."""
+
+    def test_run(self):
+        states = docker_helper.ContainerStates()
+        died = []
+        listener = docker_helper.EventListener(
+            'localhost:2375', states,
+            on_die=lambda c_id, state: died.append((c_id, state)),
+            retry_interval=0.01)
+        events = [{'status': 'start', 'id': 'c1', 'time': 1},
+                  {'status': 'die', 'id': 'c1', 'time': 2,
+                   'Actor': {'ID': 'c1', 'Attributes': {'exitCode': '0'}}},
+                  {'status': 'start', 'id': 'c2', 'time': 3}]
+        subscribed = []
+
+        def subscribe(since):
+            subscribed.append(since)
+            if len(subscribed) > 1:
+                listener.stop()
+                raise Exception("Connection refused")
+            return iter(events)
+        with mock.patch.object(listener, '_subscribe',
+                               side_effect=subscribe):
+            listener.run()
+        self.assertEqual(
+            [('c1', {'status': 'exited', 'exit_code': 0,
+                     'finished_at': 2})], died)
+        self.assertEqual([None, 3], subscribed)
+        self.assertFalse(states.active)
+
+    def test_handle_error(self):
+        states = docker_helper.ContainerStates()
+        on_die = mock.MagicMock(side_effect=Exception("Not found"))
+        listener = docker_helper.EventListener('localhost:2375', states,
+                                               on_die=on_die)
+        listener.handle({'status': 'die', 'id': 'c1', 'time': 2})
+        on_die.assert_called_once_with(
+            'c1', {'status': 'exited', 'exit_code': None,
+                   'finished_at': 2})
+
+
+class TestWarmPool(testtools.TestCase):
+    """Test the pool of containers created ahead."""
+
+    def setUp(self):
+        super(TestWarmPool, self).setUp()
+        self.created = []
+        self.deleted = []
+
+        def create(spec):
+            c_id = "%s-%s" % (spec[0], len(self.created))
+            self.created.append(c_id)
+            return c_id
+        self.pool = docker_helper.WarmPool(2, create, self.deleted.append,
+                                           max_specs=2)
+
+    def test_fill_take(self):
+        spec = ("a", "1")
+        self.assertIsNone(self.pool.take(spec))
+        self.pool.fill(spec).join(5)
+        self.assertEqual(["a-0", "a-1"], self.created)
+        self.assertIsNone(self.pool.fill(spec))
+        self.assertEqual("a-0", self.pool.take(spec))
+        self.assertEqual("a-1", self.pool.take(spec))
+        self.assertIsNone(self.pool.take(spec))
+
+    def test_evict(self):
+        for spec in (("a", "1"), ("b", "1"), ("c", "1")):
+            self.pool.fill(spec).join(5)
+        self.assertEqual(["a-0", "a-1"], self.deleted)
+        self.assertIsNone(self.pool.take(("a", "1")))
+        self.assertEqual("b-2", self.pool.take(("b", "1")))
+
+    def test_drain(self):
+        self.pool.fill(("a", "1")).join(5)
+        self.pool.fill(("b", "2")).join(5)
+        out = self.pool.drain(lambda spec: spec[-1] == "1")
+        self.assertEqual(["a-0", "a-1"], out)
+        self.assertEqual(out, self.deleted)
+        self.assertEqual("b-2", self.pool.take(("b", "2")))
+
+    def test_fill_error(self):
+        pool = docker_helper.WarmPool(
+            2, mock.MagicMock(side_effect=Exception("No image")),
+            self.deleted.append)
+        pool.fill(("a", "1")).join(5)
+        self.assertIsNone(pool.take(("a", "1")))
+        thread = pool.fill(("a", "1"))
+        self.assertIsNotNone(thread)
+        thread.join(5)
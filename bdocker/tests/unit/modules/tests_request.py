@@ -76,3 +76,45 @@ class TestRequest(testtools.TestCase):
         self.assertRaises(webob.exc.HTTPInternalServerError,
                           self.control.execute_get,
                           path=path, parameters=parameters)
+
+    @mock.patch("six.moves.http_client.HTTPConnection")
+    def test_stream(self, m_conn):
+        lines = [b'{"log": "root\\n"}\n', b'{"log": "home\\n"}\n', b'']
+        response = m_conn.return_value.getresponse.return_value
+        response.status = 200
+        response.readline.side_effect = lines
+        parameters = {"token": "tokennnnnn", "stream": True}
+        result = self.control.execute_stream(path="/logs",
+                                             parameters=parameters)
+        self.assertEqual([u"root\n", u"home\n"], list(result))
+        m_conn.assert_called_once_with("127.0.0.33", 5000)
+        self.assertEqual(
+            "GET", m_conn.return_value.request.call_args[0][0])
+        self.assertIn(
+            "/logs?", m_conn.return_value.request.call_args[0][1])
+        m_conn.return_value.close.assert_called_once_with()
+
+    @mock.patch("six.moves.http_client.HTTPConnection")
+    def test_stream_error_line(self, m_conn):
+        lines = [b'{"log": "root\\n"}\n',
+                 b'{"status_code": 404, "error": "lost"}\n']
+        response = m_conn.return_value.getresponse.return_value
+        response.status = 200
+        response.readline.side_effect = lines
+        result = self.control.execute_stream(path="/logs",
+                                             parameters={})
+        self.assertEqual(u"root\n", next(result))
+        self.assertRaises(webob.exc.HTTPNotFound, next, result)
+
+    @mock.patch("six.moves.http_client.HTTPConnection")
+    def test_stream_401(self, m_conn):
+        response = m_conn.return_value.getresponse.return_value
+        response.status = 401
+        response.reason = "Unauthorized"
+        response.getheaders.return_value = [
+            ("Content-Type", "application/json")]
+        response.readline.side_effect = [
+            b'{"results": "Token not found"}', b'']
+        self.assertRaises(webob.exc.HTTPUnauthorized,
+                          self.control.execute_stream,
+                          path="/logs", parameters={})
@@ -14,6 +14,11 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import shutil
+import tempfile
+
+import mock
 import testtools
 
 from bdocker import exceptions
@@ -48,6 +53,40 @@ class TestParsers(testtools.TestCase):
                           utils.validate_directory,
                           req_path, home_path)
 
+    def test_validate_dir_sibling(self):
+        home_path = '/home/jorge'
+        req_path = '/home/jorge2/script_dir'
+
+        self.assertRaises(exceptions.UserCredentialsException,
+                          utils.validate_directory,
+                          req_path, home_path)
+
+    def test_update_yaml_file_merge(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "acc")
+        utils.write_yaml_file(path, {"cpu": 1, "containers": {"c1": 1}})
+        with mock.patch("fcntl.flock") as m_lock:
+            utils.update_yaml_file(path, {"cpu": 2,
+                                          "containers": {"c2": 2}},
+                                   merge_keys=("containers",))
+        self.assertTrue(m_lock.called)
+        self.assertEqual({"cpu": 2, "containers": {"c1": 1, "c2": 2}},
+                         utils.read_yaml_file(path))
+
+    def test_removable_file_lock(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "lock")
+        with utils.removable_file_lock(path):
+            self.assertFalse(utils.remove_locked_files(path))
+        record = os.path.join(tmp_dir, "record")
+        open(record, 'w').close()
+        self.assertTrue(utils.remove_locked_files(path, [record]))
+        self.assertEqual([], os.listdir(tmp_dir))
+        with utils.removable_file_lock(path):
+            self.assertTrue(os.path.exists(path))
+
     def test_logs(self):
         log_list = fakes.fake_log
         log_gen = fakes.create_generator(log_list)
@@ -55,6 +94,50 @@ class TestParsers(testtools.TestCase):
         self.assertIsNotNone(out)
         self.assertEqual(log_list, out)
 
+    def test_stream_log(self):
+        chunks = [b"line 1\n", b"caf\xc3", b"\xa9\n", b""]
+        result = list(parsers.stream_docker_log(iter(chunks)))
+        self.assertEqual([u"line 1\n", u"caf", u"\xe9\n"], result)
+
+    def test_pull_summary(self):
+        result = parsers.parse_docker_generator(iter(fakes.pull_out))
+        self.assertEqual(
+            ["latest: Pulling from FAKE",
+             "c2ddbea624bd: Downloading",
+             "f1e4b055fb65: Pull complete",
+             "Digest: sha256:0326ccfeddaaa974a3de8a21db451e782a306a46d5c"
+             "597eee743c91a93d36bb7",
+             "Status: Downloaded newer image for busybox:latest"],
+            result)
+
+    def test_pull_stream_coalesced(self):
+        chunks = list(parsers.stream_docker_pull(iter(fakes.pull_out),
+                                                 interval=10,
+                                                 clock=lambda: 0))
+        self.assertEqual(2, len(chunks))
+        self.assertEqual(
+            "latest: Pulling from FAKE\n"
+            "c2ddbea624bd: Downloading 2%\n"
+            "f1e4b055fb65: Pull complete\n"
+            "Digest: sha256:0326ccfeddaaa974a3de8a21db451e782a306a46d5c"
+            "597eee743c91a93d36bb7\n",
+            chunks[0])
+
+    def test_pull_stream_interval(self):
+        clock = iter(range(100))
+        chunks = list(parsers.stream_docker_pull(
+            iter(fakes.pull_out_exist), interval=2,
+            clock=lambda: next(clock)))
+        self.assertEqual(["latest: Pulling from FAKE\n"
+                          "c2ddbea624bd: Pulling fs layer\n",
+                          "f1e4b055fb65: Pulling fs layer\n"
+                          "Status: Image is up to date for busybox:latest\n"],
+                         chunks)
+
+    def test_pull_stream_error(self):
+        chunks = parsers.stream_docker_pull(iter(fakes.pull_out_error))
+        self.assertRaises(exceptions.DockerException, list, chunks)
+
     def test_details(self):
         details = fakes.fake_container_details
         out = parsers.parse_inspect_container(details)
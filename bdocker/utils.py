@@ -18,19 +18,97 @@ try:
     import ConfigParser as cfg
 except Exception:
     import configparser as cfg
+import bisect
+import collections
+try:
+    from collections import abc as collections_abc
+except ImportError:
+    import collections as collections_abc
+import contextlib
+import errno
+import fcntl
+import hashlib
 import io
+import json
+import multiprocessing.pool
 import os
 import pwd
 import re
+import stat
 import tarfile
+import threading
 import uuid
+import zlib
 
 import yaml
+try:
+    from yaml import CSafeDumper as YamlDumper
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
+    from yaml import SafeLoader as YamlLoader
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 from bdocker import exceptions
 
 # Role name for working node.
 WORKING_NODE = 'working'
+# Formats in which data files can be serialized.
+DATA_FORMATS = ('yaml', 'json', 'msgpack')
+# Compressions of the tar streams sent to docker.
+TAR_COMPRESSIONS = ('none', 'gzip', 'pgzip')
+# Bytes read at once from a tar stream.
+TAR_CHUNK_SIZE = 64 * 1024
+# Bytes of the tar stream in each gzip member of pgzip.
+PGZIP_BLOCK_SIZE = 1024 * 1024
+
+
+def serialize_data(data, data_format='yaml'):
+    """Serialize data in one of the data formats.
+
+    :param data: dict data
+    :param data_format: yaml, json or msgpack
+    :return: serialized bytes
+    """
+    if data_format == 'yaml':
+        return yaml.dump(data, None, Dumper=YamlDumper,
+                         encoding='utf-8', allow_unicode=True)
+    if data_format == 'json':
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if data_format == 'msgpack':
+        if msgpack is None:
+            raise exceptions.ConfigurationException(
+                "msgpack format requires the msgpack package")
+        return msgpack.packb(data, use_bin_type=True)
+    raise exceptions.ConfigurationException(
+        "Data format %s is not supported" % data_format)
+
+
+def deserialize_data(raw, data_format='yaml'):
+    """Deserialize data from one of the data formats.
+
+    Empty data is deserialized as None.
+
+    :param raw: serialized bytes
+    :param data_format: yaml, json or msgpack
+    :return: dict data
+    """
+    if data_format == 'yaml':
+        return yaml.load(raw, Loader=YamlLoader)
+    if not raw:
+        return None
+    if data_format == 'json':
+        return json.loads(raw.decode('utf-8'))
+    if data_format == 'msgpack':
+        if msgpack is None:
+            raise exceptions.ConfigurationException(
+                "msgpack format requires the msgpack package")
+        return msgpack.unpackb(raw, raw=False)
+    raise exceptions.ConfigurationException(
+        "Data format %s is not supported" % data_format)
 
 
 def read_yaml_file(path):
@@ -39,10 +117,10 @@ def read_yaml_file(path):
     :param path: file path
     :return: dict data
     """
-    f = open(path, 'r')
+    f = open(path, 'rb')
     data = f.read()
     f.close()
-    return yaml.load(data)
+    return deserialize_data(data)
 
 
 def write_yaml_file(path, data):
@@ -51,33 +129,210 @@ def write_yaml_file(path, data):
     :param path: file path
     :param data: dict data
     """
-    with open(path, 'w') as my_file:
-        data_yaml = yaml.safe_dump(data, None,
-                                   encoding='utf-8',
-                                   allow_unicode=True)
+    with open(path, 'wb') as my_file:
+        data_yaml = serialize_data(data)
         my_file.write(data_yaml)
         my_file.flush()
         my_file.close()
 
 
-def update_yaml_file(path, data):
+def write_yaml_file_atomic(path, data):
+    """Replace yaml file atomically.
+
+    :param path: file path
+    :param data: dict data
+    """
+    write_data_file_atomic(path, data)
+
+
+def read_data_file(path, data_format='yaml'):
+    """Read data file.
+
+    :param path: file path
+    :param data_format: yaml, json or msgpack
+    :return: dict data
+    """
+    if data_format == 'yaml':
+        return read_yaml_file(path)
+    with open(path, 'rb') as my_file:
+        return deserialize_data(my_file.read(), data_format)
+
+
+def write_data_file(path, data, data_format='yaml'):
+    """Write data file.
+
+    :param path: file path
+    :param data: dict data
+    :param data_format: yaml, json or msgpack
+    """
+    if data_format == 'yaml':
+        return write_yaml_file(path, data)
+    with open(path, 'wb') as my_file:
+        my_file.write(serialize_data(data, data_format))
+        my_file.flush()
+
+
+def write_data_file_atomic(path, data, data_format='yaml'):
+    """Replace data file atomically.
+
+    The data is written in a temporal file in the same
+    directory, which is renamed over the original one.
+
+    :param path: file path
+    :param data: dict data
+    :param data_format: yaml, json or msgpack
+    """
+    tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    raw = serialize_data(data, data_format)
+    with open(tmp_path, 'wb') as my_file:
+        my_file.write(raw)
+        my_file.flush()
+        os.fsync(my_file.fileno())
+    os.rename(tmp_path, path)
+
+
+def update_yaml_file(path, data, merge_keys=()):
     """Update yaml file.
 
+    The file is locked while it is read and written, so the
+    updates of several processes are not lost.
+
     :param path: file path
     :param data: dict data
+    :param merge_keys: keys whose dict values are merged into the
+                       current ones instead of replacing them
     """
-    with open(path, 'r+') as my_file:
+    with open(path, 'rb+') as my_file:
+        fcntl.flock(my_file.fileno(), fcntl.LOCK_EX)
         current_data = my_file.read()
-        plain_data = yaml.load(current_data)
-        plain_data.update(data)
-        data_yaml = yaml.safe_dump(plain_data, None,
-                                   encoding='utf-8',
-                                   allow_unicode=True
-                                   )
+        plain_data = deserialize_data(current_data)
+        for key, value in data.items():
+            current = plain_data.get(key)
+            if key in merge_keys and isinstance(current, dict):
+                current.update(value)
+            else:
+                plain_data[key] = value
+        data_yaml = serialize_data(plain_data)
         my_file.seek(0)
         my_file.write(data_yaml)
         my_file.truncate()
-        my_file.close()
+
+
+def get_file_signature(path):
+    """Get the signature of a file.
+
+    The signature changes when the file is modified or replaced,
+    so it is enough to revalidate a cached copy of the file.
+
+    :param path: file path
+    :return: tuple with inode, size and modification time, or None
+    if the file does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+    return st.st_ino, st.st_size, mtime
+
+
+@contextlib.contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on a file.
+
+    :param path: lock file path, created if it does not exist
+    :param shared: take a shared lock instead of an exclusive one
+    """
+    with open(path, 'a') as lock_file:
+        if shared:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def removable_file_lock(path):
+    """Hold an exclusive lock on a file that can be removed.
+
+    Other process can remove the file while it holds the lock,
+    see remove_locked_files, so the lock is taken again when the
+    file was removed while this process waited for it.
+
+    :param path: lock file path, created if it does not exist
+    """
+    while True:
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                current = os.stat(path).st_ino
+            except OSError:
+                current = None
+            if current == os.fstat(lock_file.fileno()).st_ino:
+                break
+        except BaseException:
+            lock_file.close()
+            raise
+        lock_file.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def remove_locked_files(lock_path, paths=()):
+    """Remove a lock file, and the files it guards, if it is free.
+
+    The files are removed holding the lock, so the processes
+    waiting for it with removable_file_lock lock a new file.
+
+    :param lock_path: lock file path
+    :param paths: files guarded by the lock
+    :return: True if they were removed, False if the lock is held
+    """
+    try:
+        lock_file = open(lock_path, 'r')
+    except IOError:
+        return False
+    with lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        for path in list(paths) + [lock_path]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return True
+
+
+def acquire_process_lock(path):
+    """Try to take an exclusive lock on a file for the process.
+
+    The lock is held until the returned file is closed or the
+    process exits. It is a POSIX record lock, so it is not
+    inherited by the processes forked from the holder.
+
+    :param path: lock file path, created if it does not exist
+    :return: the locked file, or None if other process holds it
+    """
+    lock_file = open(path, 'a')
+    try:
+        fcntl.lockf(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        lock_file.close()
+        if e.errno in (errno.EACCES, errno.EAGAIN):
+            return None
+        raise
+    return lock_file
 
 
 def delete_file(path):
@@ -90,6 +345,116 @@ def delete_file(path):
 
 # Default configuration file
 default_conf_file = "/etc/configure_bdocker.cfg"
+# Sections of the configuration file.
+CONF_SECTIONS = ('resource', 'server', 'batch', 'credentials', 'dockerAPI')
+# Parsed configurations by path: (file signature, configuration).
+_configuration_cache = {}
+
+
+def _parse_boolean(value):
+    return str(value).upper() in ('TRUE', 'YES')
+
+
+def _parse_path(value):
+    return os.path.normpath(os.path.expanduser(value))
+
+
+# Fields of the configuration converted when it is loaded.
+CONF_FIELD_TYPES = {
+    'server': {'port': int,
+               'workers': int,
+               'timeout': int,
+               'sweep_interval': int,
+               'logging_file': _parse_path},
+    'batch': {'enable_cgroups': _parse_boolean,
+              'only_docker_accounting': _parse_boolean,
+              'include_wallclock': _parse_boolean,
+              'monitor_time': int,
+              'default_ru_wallclock': int,
+              'cgroups_dir': _parse_path,
+              'bdocker_accounting': _parse_path},
+    'credentials': {'token_ttl': int,
+                    'token_store': _parse_path},
+    'dockerAPI': {'pull_progress_interval': float,
+                  'pull_cache_ttl': int,
+                  'image_inventory_ttl': int,
+                  'gc_interval': int,
+                  'gc_budget': int,
+                  'gc_high_watermark': float,
+                  'gc_low_watermark': float,
+                  'workers': int,
+                  'warm_pool_size': int,
+                  'copy_compression_workers': int,
+                  'copy_progress_interval': float,
+                  'watch_events': _parse_boolean,
+                  'pull_cache_dir': _parse_path},
+}
+
+
+class ConfigSection(collections_abc.Mapping):
+    """Read-only section of the configuration.
+
+    """
+    __slots__ = ('_values',)
+
+    def __init__(self, values):
+        object.__setattr__(self, '_values', dict(values))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Configuration is read-only")
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "ConfigSection(%r)" % self._values
+
+
+class Configuration(collections_abc.Mapping):
+    """Validated and read-only configuration of bdocker.
+
+    Sections are read like the ones of a dict, or as
+    attributes, and their typed fields are already
+    converted, so it can be shared by all the threads
+    and replaced at once when it is loaded again.
+    """
+    __slots__ = ('path',) + CONF_SECTIONS
+
+    def __init__(self, conf, path=None):
+        object.__setattr__(self, 'path', path)
+        for section in CONF_SECTIONS:
+            values = conf.get(section)
+            if values is not None:
+                types = CONF_FIELD_TYPES.get(section, {})
+                values = ConfigSection(
+                    (key, types[key](value) if key in types else value)
+                    for key, value in values.items())
+            object.__setattr__(self, section, values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Configuration is read-only")
+
+    def __getitem__(self, key):
+        if key not in CONF_SECTIONS or getattr(self, key) is None:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return (section for section in CONF_SECTIONS
+                if getattr(self, section) is not None)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    @property
+    def role(self):
+        return self.resource['role']
 
 
 def validate_config(conf):
@@ -165,15 +530,22 @@ def validate_config(conf):
 def load_configuration_from_file(path=None):
     """Load configuration file.
 
+    The file is parsed and validated once. The same
+    configuration is returned until the file changes.
+
     :param path: file path
-    :return: configuration dict
+    :return: configuration
     """
 
-    config = cfg.SafeConfigParser()
     if not path:
         path = os.getenv(
             'BDOCKER_CONF_FILE',
             default_conf_file)
+    signature = get_file_signature(path)
+    cached = _configuration_cache.get(path)
+    if signature is not None and cached and cached[0] == signature:
+        return cached[1]
+    config = cfg.SafeConfigParser()
     try:
         with open(path) as f:
             config.readfp(f)
@@ -196,6 +568,7 @@ def load_configuration_from_file(path=None):
                 }
             )
         validate_config(conf)
+        conf = Configuration(conf, path)
     except exceptions.ParseException as e:
         raise exceptions.ConfigurationException(
             '"%s" not found'
@@ -203,6 +576,7 @@ def load_configuration_from_file(path=None):
     except BaseException as e:
         raise exceptions.ConfigurationException(
             message=None, exc=e)
+    _configuration_cache[path] = (signature, conf)
     return conf
 
 
@@ -268,8 +642,9 @@ def validate_directory(dir_request, dir_user):
     """
     real_path = os.path.realpath(dir_request)
     user_real_path = os.path.realpath(dir_user)
-    prefix = os.path.commonprefix([real_path, user_real_path])
-    if prefix != dir_user:
+    user_prefix = os.path.join(user_real_path, '')
+    if (real_path != user_real_path and
+            not real_path.startswith(user_prefix)):
         raise exceptions.UserCredentialsException(
             "User does not have permissions for %s"
             % real_path
@@ -333,41 +708,227 @@ def add_to_file(file_path, data):
     return True
 
 
-def write_tar_raw_data_stream(path, stream, uid, gid):
+def write_tar_raw_data_stream(path, stream, uid, gid,
+                              skip_unchanged=False):
     """Extract data from tar raw in stream data.
 
-    It extract the data from a stream to a file, and
-    change owner to the uid with gid.
+    The tar is read in stream mode, so members are extracted
+    as they arrive and the archive is never kept in memory.
+    Every member is validated to be inside path before it is
+    written, and its owner is changed to the uid with gid in
+    the same pass. Device members are skipped.
 
     :param path: file path
-    :param stream: data in stream.
+    :param stream: file-like object or raw data of the tar
     :param uid: user uid
     :param gid: group uid
+    :param skip_unchanged: do not write the files which already
+                           exist with the same size and modification
+                           time
     """
+    if not hasattr(stream, 'read'):
+        try:
+            stream = io.BytesIO(stream)
+        except TypeError:
+            stream = io.StringIO(stream)
+    my_tar = tarfile.open(fileobj=stream, mode='r|*')
     try:
-        stream_io = io.BytesIO(stream)
-    except TypeError:
-        stream_io = io.StringIO(stream)
-    my_tar = tarfile.TarFile(fileobj=stream_io)
-    my_tar.extractall(path=path)
-    change_owner_dir(path, uid, gid)
+        for member in my_tar:
+            target = os.path.join(path, member.name)
+            validate_directory(target, path)
+            if member.islnk():
+                validate_directory(
+                    os.path.join(path, member.linkname), path)
+            if member.isdev():
+                continue
+            if skip_unchanged and _is_unchanged(target, member):
+                continue
+            my_tar.extract(member, path=path)
+            if uid is not None or gid is not None:
+                os.lchown(target,
+                          -1 if uid is None else uid,
+                          -1 if gid is None else gid)
+    finally:
+        my_tar.close()
+
+
+def _is_unchanged(target, member):
+    if not member.isfile():
+        return False
+    try:
+        st = os.lstat(target)
+    except OSError:
+        return False
+    return (stat.S_ISREG(st.st_mode) and st.st_size == member.size and
+            int(st.st_mtime) == int(member.mtime))
 
 
-def read_tar_raw_data_stream(path):
-    """Read tar file and set in stream format.
+def read_tar_raw_data_stream(path, compression='none',
+                             chunk_size=TAR_CHUNK_SIZE, members=None,
+                             workers=None):
+    """Read a path as a tar stream.
 
-    It read the tar file and set in the stream data.
+    The tar is written by a thread into a pipe, from which it is
+    read in chunks, so it is neither kept in memory nor written
+    to disk. The thread starts when the stream is read.
 
     :param path: file path
-    :return: stream data
+    :param compression: none, gzip, or pgzip to compress blocks
+                        of the tar in parallel
+    :param chunk_size: bytes of each chunk, not used by pgzip
+    :param members: names in the tar of the only files to add,
+                    with their parent directories, as given by
+                    tree_manifest. All of them by default.
+    :param workers: threads of pgzip, one per CPU by default
+    :return: generator of tar chunks
     """
-    file_name = "/tmp/%s.tar" % uuid.uuid4().hex
-    tar_stream = tarfile.TarFile(file_name, mode="w")
-    arcname = os.path.basename(path)
-    tar_stream.add(path, arcname=arcname)
-    tar_stream.close()
-    io_stream = io.FileIO(file_name, 'r')
-    return io_stream
+    if compression not in TAR_COMPRESSIONS:
+        raise exceptions.ParseException(
+            "Unknown tar compression %s" % compression)
+    os.lstat(path)
+    mode = "w|gz" if compression == 'gzip' else "w|"
+    if members is not None:
+        members = _with_parents(members)
+    if compression == 'pgzip':
+        return parallel_gzip(
+            _stream_tar(path, mode, PGZIP_BLOCK_SIZE, members),
+            workers or multiprocessing.cpu_count())
+    return _stream_tar(path, mode, chunk_size, members)
+
+
+def _gzip_block(block):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+def parallel_gzip(chunks, workers):
+    """Compress chunks in parallel as gzip members.
+
+    A gzip stream may have several members, which are read as
+    one, so every chunk is compressed on its own by a pool of
+    threads, as zlib releases the GIL while it compresses. The
+    compressed chunks keep their order, and at most two chunks
+    per thread are pending, to bound the memory.
+
+    :param chunks: generator of data chunks
+    :param workers: number of threads
+    :return: generator of gzip members
+    """
+    pool = multiprocessing.pool.ThreadPool(workers)
+    pending = collections.deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_gzip_block, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+
+def _with_parents(names):
+    members = set()
+    for name in names:
+        while name and name not in members:
+            members.add(name)
+            name = os.path.dirname(name)
+    # Parents are sorted before their content.
+    return sorted(members)
+
+
+def _stream_tar(path, mode, chunk_size, members=None):
+    read_fd, write_fd = os.pipe()
+    errors = []
+    parent = os.path.dirname(path)
+
+    def write():
+        try:
+            with io.open(write_fd, 'wb') as pipe_out:
+                tar = tarfile.open(fileobj=pipe_out, mode=mode)
+                try:
+                    if members is None:
+                        tar.add(path, arcname=os.path.basename(path))
+                    for name in members or ():
+                        tar.add(os.path.join(parent, name), arcname=name,
+                                recursive=False)
+                finally:
+                    tar.close()
+        except Exception as e:
+            # It also ends when the reader stops, by a broken pipe.
+            errors.append(e)
+
+    writer = threading.Thread(target=write, name="tar_stream")
+    writer.daemon = True
+    writer.start()
+    try:
+        with io.open(read_fd, 'rb') as pipe_in:
+            while True:
+                chunk = pipe_in.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        writer.join()
+    if errors:
+        raise errors[0]
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as my_file:
+        for chunk in iter(lambda: my_file.read(TAR_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_manifest(path, hashes=None):
+    """Get the manifest of a file or directory tree.
+
+    The entries are indexed by their name in the tar written by
+    read_tar_raw_data_stream. Regular files have their size,
+    modification time and content hash, and symbolic links their
+    target instead of the hash. Directories have no entry. A
+    file is only read when its size or modification time are not
+    the ones of its entry in hashes.
+
+    :param path: file or directory path
+    :param hashes: dict of entries by absolute path of the files
+                   hashed before, which is updated
+    :return: dict of [size, mtime, hash] by name in the tar
+    """
+    if hashes is None:
+        hashes = {}
+    parent = os.path.dirname(path) or os.curdir
+    if os.path.isdir(path) and not os.path.islink(path):
+        paths = []
+        for root, dirs, files in os.walk(path):
+            # Links to directories are listed in dirs, not followed.
+            paths.extend(os.path.join(root, name)
+                         for name in dirs + files)
+    else:
+        paths = [path]
+    manifest = {}
+    for file_path in paths:
+        name = os.path.relpath(file_path, parent)
+        st = os.lstat(file_path)
+        mtime = getattr(st, 'st_mtime_ns', st.st_mtime)
+        if stat.S_ISLNK(st.st_mode):
+            entry = [st.st_size, mtime,
+                     "link:%s" % os.readlink(file_path)]
+        elif stat.S_ISREG(st.st_mode):
+            file_path = os.path.abspath(file_path)
+            entry = hashes.get(file_path)
+            if not entry or entry[:2] != [st.st_size, mtime]:
+                entry = [st.st_size, mtime, _file_hash(file_path)]
+                hashes[file_path] = entry
+        else:
+            continue
+        manifest[name] = entry
+    return manifest
 
 
 def change_owner_dir(path, uid, gid):
@@ -420,6 +981,91 @@ def get_boolean(data, key, default):
             return False
 
 
+def map_concurrently(function, items, workers):
+    """Apply a function to each item in a bounded pool of threads.
+
+    The results keep the order of the items. An item whose call
+    fails gets the exception as result, so the rest of the items
+    are not affected.
+
+    :param function: function called with each item
+    :param items: list of items
+    :param workers: maximum number of threads
+    :return: list of results or exceptions
+    """
+    def call(item):
+        try:
+            return function(item)
+        except Exception as e:
+            return e
+
+    items = list(items)
+    size = min(workers, len(items))
+    if size <= 1:
+        return [call(item) for item in items]
+    thread_pool = multiprocessing.pool.ThreadPool(size)
+    try:
+        return thread_pool.map(call, items)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+
+
+class PrefixIndex(object):
+    """Sorted index of identifiers resolved by prefix.
+
+    Identifiers are kept in a sorted list, so the identifiers
+    starting with a prefix are found with a binary search.
+    """
+
+    def __init__(self, identifiers=()):
+        self._identifiers = sorted(set(identifiers))
+
+    def __len__(self):
+        return len(self._identifiers)
+
+    def __contains__(self, identifier):
+        i = bisect.bisect_left(self._identifiers, identifier)
+        return (i < len(self._identifiers) and
+                self._identifiers[i] == identifier)
+
+    def add(self, identifier):
+        """Add an identifier to the index.
+
+        :param identifier: identifier
+        """
+        if identifier not in self:
+            bisect.insort(self._identifiers, identifier)
+
+    def remove(self, identifier):
+        """Remove an identifier from the index.
+
+        :param identifier: identifier
+        """
+        if identifier in self:
+            self._identifiers.remove(identifier)
+
+    def matches(self, prefix, limit=2):
+        """Return the identifiers starting with a prefix.
+
+        An identifier equal to the prefix is the only match,
+        like docker does.
+
+        :param prefix: identifier prefix
+        :param limit: maximum number of matches returned
+        :return: list of identifiers
+        """
+        i = bisect.bisect_left(self._identifiers, prefix)
+        result = []
+        for identifier in self._identifiers[i:i + limit]:
+            if not identifier.startswith(prefix):
+                break
+            if identifier == prefix:
+                return [identifier]
+            result.append(identifier)
+        return result
+
+
 def parse_image_name(full_name):
     tag = "latest"
     sp = full_name.split(":")
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 LIP - INDIGO-DataCloud
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure load and dump times of the token store formats.
+
+    $python tools/bench_token_store.py [tokens] [repeat]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import uuid
+
+import tabulate
+import yaml
+
+from bdocker import utils
+
+
+def create_token_store(tokens):
+    """Create a token store similar to the one of a busy node.
+
+    :param tokens: number of user tokens
+    :return: token store dict
+    """
+    token_store = {"admin": {"token": uuid.uuid4().hex}}
+    for n in range(tokens):
+        token_store[uuid.uuid4().hex] = {
+            "uid": 1000 + n,
+            "gid": 1000 + n,
+            "home": "/home/user%s" % n,
+            "created": 1458231723,
+            "last_seen": 1458231723,
+            "job": {"job_id": str(n),
+                    "spool": "/var/spool/sge/node/active_jobs/%s.1" % n,
+                    "cgroup": "/user/%s.1" % n},
+            "containers": [uuid.uuid4().hex + uuid.uuid4().hex],
+            "images": [uuid.uuid4().hex],
+        }
+    return token_store
+
+
+def bench(token_store, repeat):
+    """Return the best load and dump time of every format.
+
+    :param token_store: token store dict
+    :param repeat: number of measures of each operation
+    :return: list of rows (format, size, load, dump)
+    """
+    rows = []
+    directory = tempfile.mkdtemp()
+    try:
+        for data_format in utils.DATA_FORMATS:
+            if data_format == 'msgpack' and utils.msgpack is None:
+                rows.append((data_format, "not installed", "-", "-"))
+                continue
+            path = os.path.join(directory, "token_store.%s" % data_format)
+            dump = min(timeit.repeat(
+                lambda: utils.write_data_file(path, token_store,
+                                              data_format),
+                number=1, repeat=repeat))
+            load = min(timeit.repeat(
+                lambda: utils.read_data_file(path, data_format),
+                number=1, repeat=repeat))
+            rows.append((data_format, os.path.getsize(path),
+                         "%.3f" % load, "%.3f" % dump))
+    finally:
+        shutil.rmtree(directory)
+    return rows
+
+
+if __name__ == '__main__':
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print("%s tokens, libyaml %s" % (
+        tokens, "enabled" if utils.YamlLoader is not yaml.SafeLoader
+        else "not available"))
+    print(tabulate.tabulate(bench(create_token_store(tokens), repeat),
+                            headers=("format", "bytes", "load (s)",
+                                     "dump (s)"),
+                            tablefmt="plain", numalign="left"))